@@ -9,6 +9,7 @@ from scipy import misc
 from aspire.apple.picking import Picker
 from aspire import config
 from aspire.utils import ensure
+from aspire.utils.threads import process_pool
 
 logger = logging.getLogger(__name__)
 
@@ -68,7 +69,7 @@ class Apple:
         logger.info(f"launching {self.n_processes} processes")
 
         pbar = tqdm(total=len(filenames))
-        with futures.ProcessPoolExecutor(self.n_processes) as executor:
+        with process_pool(self.n_processes) as executor:
             to_do = []
             for filename in filenames:
                 future = executor.submit(self.process_micrograph, filename, False, False, False, create_jpg)
@@ -14,6 +14,7 @@ from sklearn import svm, preprocessing
 from aspire import config
 from aspire.apple.helper import PickerHelper
 from aspire.utils.numeric import xp
+from aspire.utils.threads import transform_threads, share_cores
 
 logger = logging.getLogger(__name__)
 
@@ -119,7 +120,9 @@ class Picker:
         query_box = PickerHelper.extract_query(micro_img, self.query_size // 2)
         logger.info('Extracting query images complete')
 
-        query_box = xp.conj(xp.fft2(query_box, axes=(2, 3)))
+        # The boxes are real, so their cross-correlations only need half of each spectrum
+        query_shape = query_box.shape[2:]
+        query_box = xp.conj(xp.rfft2(query_box, axes=(2, 3)))
 
         reference_box = PickerHelper.extract_references(micro_img, self.query_size, self.container_size)
 
@@ -127,19 +130,19 @@ class Picker:
         conv_map = xp.zeros((reference_size, query_box.shape[0], query_box.shape[1]))
 
         def _work(index):
-            reference_box_i = xp.fft2(reference_box[index], axes=(0, 1))
+            reference_box_i = xp.rfft2(reference_box[index], axes=(0, 1))
             window_t = xp.multiply(reference_box_i, query_box)
-            cc = xp.ifft2(window_t, axes=(2, 3))
-            return index, cc.real.max((2, 3)) - cc.real.mean((2, 3))
+            cc = xp.irfft2(window_t, s=query_shape, axes=(2, 3))
+            return index, cc.max((2, 3)) - cc.mean((2, 3))
 
         n_works = reference_size
-        n_threads = config.apple.conv_map_nthreads
+        n_threads = min(config.apple.conv_map_nthreads, transform_threads())
         pbar = tqdm(total=reference_size, disable=not show_progress)
 
         # Ideally we'd like something like 'SerialExecutor' to enable easy debugging
         # but for now do an if-else
         if n_threads > 1:
-            with futures.ThreadPoolExecutor(n_threads) as executor:
+            with share_cores(n_threads), futures.ThreadPoolExecutor(n_threads) as executor:
                 to_do = [executor.submit(_work, i) for i in range(n_works)]
 
                 for future in futures.as_completed(to_do):
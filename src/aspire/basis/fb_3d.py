@@ -155,7 +155,9 @@ class FBBasis3D(Basis):
         ind_radial = 0
         ind_ang = 0
 
-        x = np.zeros(shape=tuple([np.prod(self.sz)] + list(v.shape[1:])))
+        # Single precision coefficients are evaluated in single precision
+        dtype = np.result_type(v.dtype, np.float32)
+        x = np.zeros(shape=tuple([np.prod(self.sz)] + list(v.shape[1:])), dtype=dtype)
         for ell in range(0, self.ell_max + 1):
             k_max = self.k_max[ell]
             idx_radial = ind_radial + np.arange(0, k_max)
@@ -165,7 +167,7 @@ class FBBasis3D(Basis):
 
             for m in range(-ell, ell + 1):
                 ang = self._precomp['ang'][:, ind_ang]
-                ang_radial = np.expand_dims(ang[ang_idx], axis=1) * radial[r_idx]
+                ang_radial = (np.expand_dims(ang[ang_idx], axis=1) * radial[r_idx]).astype(dtype, copy=False)
                 idx = ind + np.arange(0, len(idx_radial))
                 x[mask] += ang_radial @ v[idx]
                 ind += len(idx)
@@ -200,7 +202,8 @@ class FBBasis3D(Basis):
         ind_radial = 0
         ind_ang = 0
 
-        v = np.zeros(shape=tuple([self.count] + list(x.shape[1:])))
+        dtype = np.result_type(x.dtype, np.float32)
+        v = np.zeros(shape=tuple([self.count] + list(x.shape[1:])), dtype=dtype)
         for ell in range(0, self.ell_max + 1):
             k_max = self.k_max[ell]
             idx_radial = ind_radial + np.arange(0, k_max)
@@ -210,7 +213,7 @@ class FBBasis3D(Basis):
 
             for m in range(-ell, ell + 1):
                 ang = self._precomp['ang'][:, ind_ang]
-                ang_radial = np.expand_dims(ang[ang_idx], axis=1) * radial[r_idx]
+                ang_radial = (np.expand_dims(ang[ang_idx], axis=1) * radial[r_idx]).astype(dtype, copy=False)
                 idx = ind + np.arange(0, len(idx_radial))
                 v[idx] = ang_radial.T @ x[mask]
                 ind += len(idx)
@@ -4,7 +4,7 @@ from numpy import pi
 from scipy.special import jv
 from scipy.fftpack import ifft, fft
 
-from aspire.nfft import anufft3, nufft3
+from aspire.nfft import anufft3, nufft3, points_key
 from aspire.utils.matrix import roll_dim, unroll_dim
 from aspire.utils.matlab_compat import m_reshape
 from aspire.basis.basis_utils import lgwt
@@ -24,6 +24,19 @@ class FFBBasis2D(FBBasis2D):
     IEEE Transactions on Computational Imaging, 2 (1), pp. 1-12 (2016).​
 
     """
+    def __init__(self, size, ell_max=None, epsilon=None):
+        """
+        Initialize an object for the 2D fast Fourier-Bessel basis class
+
+        :param size: The size of the vectors for which to define the basis.
+            Currently only square images are supported.
+        :param ell_max: The maximum order ell of the basis elements (see `FBBasis2D`).
+        :param epsilon: The desired precision of the NUFFTs used in evaluating the basis.
+            If None, the nfft.epsilon configuration value is used.
+        """
+        self.epsilon = epsilon
+        super().__init__(size, ell_max)
+
     def _build(self):
         """
         Build the internal data structure to 2D Fourier-Bessel basis
@@ -46,6 +59,10 @@ class FFBBasis2D(FBBasis2D):
 
         # precompute the basis functions in 2D grids
         self._precomp = self._precomp()
+        # and the NUFFT points of the polar Fourier grid, with their key, so that the cached NUFFT plans are found
+        # without hashing them every time
+        self._nufft_pts = 2 * pi * m_reshape(self._precomp["freqs"], (2, -1))
+        self._pts_key = points_key(self._nufft_pts)
 
         # get normalized factors
         self._norms = self.norms()
@@ -158,10 +175,8 @@ class FFBBasis2D(FBBasis2D):
         pf = m_reshape(pf, (n_r * n_theta, n_data))
 
         # perform inverse non-uniformly FFT transform back to 2D coordinate basis
-        freqs = m_reshape(self._precomp["freqs"], (2, n_r * n_theta))
-        x = np.zeros((self.sz[0], self.sz[1], n_data), dtype=v.dtype)
-        for isample in range(0, n_data):
-            x[..., isample] = 2*np.real(anufft3(pf[:, isample], 2 * pi * freqs, self.sz))
+        x = 2 * anufft3(pf, self._nufft_pts, self.sz, real=True, epsilon=self.epsilon, pts_key=self._pts_key)
+        x = m_reshape(x, (self.sz[0], self.sz[1], n_data)).astype(v.dtype, copy=False)
 
         # return the x with the first two dimensions of self.sz
         x = roll_dim(x, sz_roll)
@@ -184,15 +199,12 @@ class FFBBasis2D(FBBasis2D):
         # get information on polar grids from precomputed data
         n_theta = np.size(self._precomp["freqs"], 2)
         n_r = np.size(self._precomp["freqs"], 1)
-        freqs = m_reshape(self._precomp["freqs"], new_shape=(2, n_r * n_theta))
 
         # number of 2D image samples
         n_data = np.size(x, 2)
 
-        pf = np.zeros((n_r*n_theta, n_data), dtype=complex)
         # resamping x in a polar Fourier gird using nonuniform discrete Fourier transform
-        for isample in range(0, n_data):
-            pf[..., isample] = nufft3(x[..., isample], 2 * pi * freqs, self.sz)
+        pf = nufft3(x, self._nufft_pts, self.sz, epsilon=self.epsilon, pts_key=self._pts_key)
         pf = m_reshape(pf, new_shape=(n_r, n_theta, n_data))
 
         # Recover "negative" frequencies from "positive" half plane.
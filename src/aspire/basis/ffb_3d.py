@@ -2,7 +2,7 @@ import logging
 import numpy as np
 from numpy import pi
 
-from aspire.nfft import anufft3, nufft3
+from aspire.nfft import anufft3, nufft3, points_key
 from aspire.utils.matrix import roll_dim, unroll_dim
 from aspire.utils.matlab_compat import m_flatten, m_reshape
 from aspire.basis.basis_utils import sph_bessel, norm_assoc_legendre, lgwt
@@ -20,6 +20,19 @@ class FFBBasis3D(FBBasis3D):
 
     """
 
+    def __init__(self, size, ell_max=None, epsilon=None):
+        """
+        Initialize an object for the 3D fast Fourier-Bessel basis class
+
+        :param size: The size of the vectors for which to define the basis.
+            Currently only cubic volumes are supported.
+        :param ell_max: The maximum order ell of the basis elements (see `FBBasis3D`).
+        :param epsilon: The desired precision of the NUFFTs used in evaluating the basis.
+            If None, the nfft.epsilon configuration value is used.
+        """
+        self.epsilon = epsilon
+        super().__init__(size, ell_max)
+
     def _build(self):
         """
         Build the internal data structure for 3D Fourier-Bessel basis
@@ -42,6 +55,8 @@ class FFBBasis3D(FBBasis3D):
 
         # precompute the basis functions in 3D grids
         self._precomp = self._precomp()
+        # and the key of the NUFFT points, so that the cached NUFFT plans are found without hashing them every time
+        self._pts_key = points_key(self._precomp['fourier_pts'])
 
         # get normalized factors
         self._norms = self.norms()
@@ -232,9 +247,8 @@ class FFBBasis3D(FBBasis3D):
 
         # perform inverse non-uniformly FFT transformation back to 3D rectangular coordinates
         freqs = m_reshape(self._precomp['fourier_pts'], (3, n_r * n_theta*n_phi, -1))
-        x = np.zeros((self.sz[0], self.sz[1], self.sz[2], n_data), dtype=v.dtype)
-        for isample in range(0, n_data):
-            x[..., isample] = np.real(anufft3(pf[:, isample], freqs, self.sz))
+        x = anufft3(pf, freqs, self.sz, real=True, epsilon=self.epsilon, pts_key=self._pts_key)
+        x = m_reshape(x, (self.sz[0], self.sz[1], self.sz[2], n_data)).astype(v.dtype, copy=False)
 
         # return the x with the first three dimensions of self.sz
         x = roll_dim(x, sz_roll)
@@ -261,9 +275,7 @@ class FFBBasis3D(FBBasis3D):
         n_theta = np.size(self._precomp['ang_theta_wtd'], 0)
 
         # resamping x in a polar Fourier gird using nonuniform discrete Fourier transform
-        pf = np.zeros((n_theta*n_phi*n_r, n_data), dtype=complex)
-        for isample in range(0, n_data):
-            pf[..., isample] = nufft3(x[..., isample], self._precomp['fourier_pts'], self.sz)
+        pf = nufft3(x, self._precomp['fourier_pts'], self.sz, epsilon=self.epsilon, pts_key=self._pts_key)
 
         pf = m_reshape(pf, (n_theta, n_phi*n_r*n_data))
 
@@ -28,7 +28,7 @@ class FPSWFBasis2D(PSWFBasis2D):
         two-dimensional bandlimited functions", Appl. Comput. Harmon. Anal. 22, 235-256 (2007).
     """
 
-    def __init__(self, size, gamma_truncation=1.0, beta=1.0):
+    def __init__(self, size, gamma_truncation=1.0, beta=1.0, epsilon=None):
         """
         Initialize an object for 2D prolate spheroidal wave function (PSWF) basis expansion using fast method.
 
@@ -43,7 +43,10 @@ class FPSWFBasis2D(PSWFBasis2D):
             In general, the bandlimit is c = beta*pi*(size[0]//2), therefore for
             the default value beta = 1 there is no oversampling assumed. This
             parameter controls the bandlimit of the PSWFs.
+        :param epsilon: The desired precision of the NUFFTs used in evaluating the basis.
+            If None, the nfft.epsilon configuration value is used.
         """
+        self.epsilon = epsilon
         super().__init__(size, gamma_truncation, beta)
 
     def _build(self):
@@ -289,14 +292,9 @@ class FPSWFBasis2D(PSWFBasis2D):
         """
         x = self.us_fft_pts
         n = images.shape[0]
-        num_images = finish - start
 
-        m = x.shape[0]
-
-        images_nufft = np.zeros((m, num_images), dtype='complex128')
-        for i in range(start, finish):
-            images_nufft[:, i - start] = nufft3(images[..., i], 2 * pi * x.T,
-                                                (n, n))
+        # All images share the same points, so transform them together as a stack
+        images_nufft = nufft3(images[..., start:finish], 2 * pi * x.T, (n, n), epsilon=self.epsilon)
         return images_nufft
 
     def _pswf_integration(self, images_nufft):
@@ -0,0 +1,11 @@
+import click
+
+from aspire.nfft import calibrate
+
+
+@click.command()
+@click.option('--repeats', default=3, help='Number of times each problem is timed')
+@click.option('--profile', default=None, help='Path to save the profile to. Defaults to the nfft.profile config value.')
+def calibrate_nfft(repeats, profile):
+    """Time the available NUFFT backends and save the fastest one for each problem size."""
+    calibrate(repeats=repeats, filepath=profile)
@@ -1,23 +1,104 @@
+import os
+import copy
+import time
+import hashlib
 import logging
+import tempfile
 import numpy as np
+from concurrent import futures
 from functools import partial
-import scipy.sparse.linalg
-from scipy.sparse.linalg import LinearOperator
 from scipy.linalg import norm
 
 from aspire import config
 from aspire.estimation.kernel import FourierKernel
+from aspire.estimation.preconditioner import KernelPreconditioner, JacobiPreconditioner, CoarseGridPreconditioner
+from aspire.utils import ensure
+from aspire.utils.optimize import conj_grad, block_conj_grad, iterative_refinement
+from aspire.utils.threads import thread_limits, process_pool
+from aspire.nfft import selected_plan_class
+from aspire.nfft.gridding import GriddingPlan
+from aspire.volume import Backprojector
 
 logger = logging.getLogger(__name__)
 
 
+def tree_sum(partials):
+    """
+    Sum partial results pairwise, in a balanced tree
+    :param partials: A non-empty list of partial results, each an array or a tuple of arrays.
+    :return: The sum of the partial results (a tuple of sums, for tuples).
+    """
+    def add(a, b):
+        if isinstance(a, tuple):
+            return tuple(x + y for x, y in zip(a, b))
+        return a + b
+
+    while len(partials) > 1:
+        partials = [add(*partials[i:i+2]) if i + 1 < len(partials) else partials[i]
+                    for i in range(0, len(partials), 2)]
+    return partials[0]
+
+
+def _save_checkpoint(filepath, **arrays):
+    """
+    Save arrays to a .npz file atomically (through a temporary file in the same folder), so that an interruption never
+    leaves a partially written file behind
+    :param filepath: The path of the file.
+    :param arrays: The arrays to save, by name.
+    """
+    folder = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_filepath = tempfile.mkstemp(dir=folder, suffix='.npz')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_filepath, filepath)
+    except Exception:
+        os.remove(tmp_filepath)
+        raise
+
+
+def _shard_partial(estimator, method_name, rank, world_size, args):
+    """
+    Compute the partial result of a pass of an Estimator over one shard of its source, in a worker process
+    :param estimator: The Estimator object.
+    :param method_name: The name of the method computing the partial result of the pass over a given source.
+    :param rank: The index of the shard.
+    :param world_size: The total number of shards.
+    :param args: Further arguments to the method.
+    :return: The partial result.
+    """
+    src = estimator.src.shard(rank, world_size)
+    # Thread limits are per process, so each worker enters them once for its whole pass
+    with thread_limits():
+        return getattr(estimator, method_name)(src, *args)
+
+
 class Estimator:
-    def __init__(self, src, basis, as_type='single', batch_size=512, preconditioner='circulant'):
+    def __init__(self, src, basis, as_type='single', batch_size=512, preconditioner='circulant', epsilon=None,
+                 n_processes=1):
+        """
+        :param src: A `ImageSource` object representing the images from which to estimate
+        :param basis: A `Basis` object used to represent the estimate
+        :param as_type: The data type of the estimation kernel
+        :param batch_size: The number of images to process at a time
+        :param preconditioner: The preconditioner used by the conjugate gradient solver: 'circulant' (the inverse of
+            the circulant approximation of the kernel), 'jacobi' (the inverse of the diagonal of the kernel, in the
+            basis), 'coarse' (the Jacobi preconditioner with an exact solve on the lowest-frequency basis functions),
+            or 'none' (or None).
+        :param epsilon: The desired precision of the NUFFTs used in forming the kernel and the adjoint mapping.
+            If None, the nfft.epsilon configuration value is used.
+        :param n_processes: The number of processes among which the passes over the images (forming the kernel and
+            the adjoint mapping) are distributed. Each process works on its own shard of the source, and their partial
+            results are summed.
+        """
         self.src = src
         self.basis = basis
         self.as_type = as_type
         self.batch_size = batch_size
         self.preconditioner = preconditioner
+        self.epsilon = epsilon
+        self.n_processes = n_processes
 
         self.L = src.L
         self.n = src.n
@@ -35,8 +116,13 @@ class Estimator:
         """Lazy attributes instantiated on first-access"""
 
         if name == 'kernel':
-            logger.info('Computing kernel')
-            kernel = self.kernel = self.compute_kernel()
+            kernel = self.load_cached_kernel()
+            if kernel is None:
+                logger.info('Computing kernel')
+                with thread_limits():
+                    kernel = self.compute_kernel()
+                self.save_cached_kernel(kernel)
+            self.kernel = kernel
             return kernel
 
         elif name == 'precond_kernel':
@@ -52,11 +138,123 @@ class Estimator:
     def compute_kernel(self):
         raise NotImplementedError('Subclasses must implement the compute_kernel method')
 
-    def estimate(self, b_coeff=None, tol=None):
-        if b_coeff is None:
-            b_coeff = self.src_backward()
-        est_coeff = self.conj_grad(b_coeff, tol=tol)
-        est = self.basis.evaluate(est_coeff)
+    def reduce(self, method, *args, out=None):
+        """
+        Run a pass over the images of the source, either serially or distributed among `n_processes` processes
+        :param method: A method of this object, taking an `ImageSource` (followed by `args`) and returning the partial
+            result (an array or a tuple of arrays) of the pass over the images of that source.
+        :param args: Further arguments to `method`.
+        :param out: An array (e.g. a memory-mapped one) into which the partial results of the processes are added one
+            by one as they arrive, rather than kept until they can all be summed. Only used with several processes.
+        :return: The sum of the partial results over all images of the source (`out`, if given and used).
+        """
+        if self.n_processes <= 1:
+            return method(self.src, *args)
+
+        # Workers do not need the kernels, which may be large
+        estimator = copy.copy(self)
+        for name in ('kernel', 'precond_kernel', 'mean_kernel'):
+            estimator.__dict__.pop(name, None)
+
+        with process_pool(self.n_processes) as executor:
+            pending = [
+                executor.submit(_shard_partial, estimator, method.__name__, rank, self.n_processes, args)
+                for rank in range(self.n_processes)
+            ]
+            if out is None:
+                return tree_sum([future.result() for future in pending])
+
+            while pending:
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    out += future.result()
+                # Release the partial results already added
+                del done
+
+        return out
+
+    def kernel_digest(self):
+        """
+        Compute a digest of everything the kernel depends on: the type of estimator, the image size and data type,
+        the NUFFT precision, and the rotations, amplitudes and filters of the images (but not the images themselves).
+        :return: A hexadecimal SHA-256 digest.
+        """
+        h = hashlib.sha256()
+        epsilon = config.nfft.epsilon if self.epsilon is None else self.epsilon
+        h.update(f'{self.__class__.__name__},{self.L},{self.n},{np.dtype(self.as_type).str},{epsilon!r}'.encode())
+        h.update(np.ascontiguousarray(self.src.rots, dtype='float64'))
+        h.update(np.ascontiguousarray(self.src.amplitudes, dtype='float64'))
+
+        # Filters are identified by their values on the grid, and each image by the index of its filter
+        filters = [] if self.src.filters is None else list(self.src.filters)
+        unique_filters = list(dict.fromkeys(filters))
+        for f in unique_filters:
+            h.update(np.ascontiguousarray(f.evaluate_grid(self.L), dtype='float64'))
+        filter_index = {id(f): i for i, f in enumerate(unique_filters)}
+        h.update(np.array([filter_index[id(f)] for f in filters], dtype='int64'))
+
+        return h.hexdigest()
+
+    def _kernel_cache_path(self):
+        """
+        :return: The path at which the kernel of this estimator is cached, or None if caching is disabled.
+        """
+        directory = config.kernel_cache.directory
+        if not directory:
+            return None
+        return os.path.join(os.path.expanduser(directory), f'{self.kernel_digest()}.npz')
+
+    def load_cached_kernel(self):
+        """
+        Look up the kernel of this estimator in the kernel cache (the 'directory' parameter in the 'kernel_cache'
+        section of package configuration)
+        :return: A FourierKernel object, or None if caching is disabled or the kernel was not found.
+        """
+        filepath = self._kernel_cache_path()
+        if filepath is None or not os.path.exists(filepath):
+            return None
+        logger.info(f'Loading kernel from {filepath}')
+        return FourierKernel.load(filepath)
+
+    def save_cached_kernel(self, kernel):
+        """
+        Save the kernel of this estimator to the kernel cache, if caching is enabled
+        :param kernel: A FourierKernel object.
+        """
+        filepath = self._kernel_cache_path()
+        if filepath is not None:
+            logger.info(f'Saving kernel to {filepath}')
+            kernel.save(filepath)
+
+    def estimate(self, b_coeff=None, tol=None, x0=None, checkpoint=None):
+        """
+        Estimate a volume from the images of the source
+        :param b_coeff: The adjoint mapping of the source in the basis. If None, it is computed.
+        :param tol: The tolerance of the conjugate gradient iterations (see `conj_grad`).
+        :param x0: The coefficients to start the conjugate gradient iterations from (see `conj_grad`).
+        :param checkpoint: The path of a checkpoint file for the conjugate gradient iterations (see `conj_grad`).
+        :return: An L-by-L-by-L volume.
+        """
+        with thread_limits():
+            if b_coeff is None:
+                b_coeff = self.src_backward()
+            est_coeff = self.conj_grad(b_coeff, tol=tol, x0=x0, checkpoint=checkpoint)
+            est = self.basis.evaluate(est_coeff)
+
+        return est
+
+    def estimate_many(self, b_coeffs, tol=None, x0=None):
+        """
+        Estimate several volumes with the kernel of this estimator (e.g. from the adjoint mappings of different subsets
+        of the images, sharing the same kernel), solving for all of them together (see `conj_grad_many`)
+        :param b_coeffs: A `basis.count`-by-K array of K right-hand sides, adjoint mappings in the basis.
+        :param tol: The tolerance of the block conjugate gradient iterations (see `conj_grad_many`).
+        :param x0: Coefficients to start the block conjugate gradient iterations from (see `conj_grad_many`).
+        :return: An L-by-L-by-L-by-K array of volumes.
+        """
+        with thread_limits():
+            est_coeffs = self.conj_grad_many(b_coeffs, tol=tol, x0=x0)
+            est = self.basis.evaluate(est_coeffs)
 
         return est
 
@@ -67,57 +265,261 @@ class Estimator:
         :return: The adjoint mapping applied to the images, averaged over the whole dataset and expressed
             as coefficients of `basis`.
         """
-        mean_b = np.zeros((self.L, self.L, self.L), dtype=self.as_type)
-
-        for i in range(0, self.n, self.batch_size):
-            im = self.src.images(i, self.batch_size)
-            batch_mean_b = self.src.im_backward(im, i) / self.n
-            mean_b += batch_mean_b.astype(self.as_type)
+        with thread_limits():
+            mean_b = self.reduce(self.src_backward_partial)
 
-        res = self.basis.evaluate_t(mean_b)
+        # The coefficients are in double precision, whatever the type of the estimator (see `as_type`)
+        res = self.basis.evaluate_t(mean_b.astype(np.float64, copy=False))
         logger.info(f'Determined adjoint mappings. Shape = {res.shape}')
         return res
 
-    def conj_grad(self, b_coeff, tol=None):
-        n = b_coeff.shape[0]
-        kernel = self.kernel
+    def src_backward_partial(self, src):
+        """
+        Apply adjoint mapping to the images of a source (or a shard of it)
+        :param src: An `ImageSource` object.
+        :return: An L-by-L-by-L volume, the sum of the adjoint mappings applied to the images of `src`, divided by the
+            total number of images.
+        """
+        # The backprojector spreads with the gridding backend, so it is only used when that is the backend that would
+        # be selected for the adjoint NUFFT of a batch anyway
+        num_pts = self.L**2 * min(self.batch_size, src.n)
+        if config.mean.gridded_backprojection and selected_plan_class((self.L,) * 3, num_pts) is GriddingPlan:
+            # Spread all batches onto a single Fourier grid, which is only transformed back once
+            backprojector = Backprojector(self.L, epsilon=self.epsilon)
+            for i in range(0, src.n, self.batch_size):
+                im = src.images(i, self.batch_size)
+                src.im_backward(im, i, backprojector=backprojector)
+            mean_b = (backprojector.volume() / self.n).astype(self.as_type)
+        else:
+            mean_b = np.zeros((self.L, self.L, self.L), dtype=self.as_type)
+            for i in range(0, src.n, self.batch_size):
+                im = src.images(i, self.batch_size)
+                batch_mean_b = src.im_backward(im, i, epsilon=self.epsilon) / self.n
+                mean_b += batch_mean_b.astype(self.as_type)
 
-        regularizer = config.mean.regularizer
-        if regularizer > 0:
-            kernel += regularizer
+        return mean_b
 
-        operator = LinearOperator((n, n), matvec=partial(self.apply_kernel, kernel=kernel))
-        if self.precond_kernel is None:
-            M = None
-        else:
-            precond_kernel = self.precond_kernel
-            if regularizer > 0:
-                precond_kernel += regularizer
-            M = LinearOperator((n, n), matvec=partial(self.apply_kernel, kernel=precond_kernel))
+    def conj_grad(self, b_coeff, tol=None, x0=None, checkpoint=None):
+        """
+        Solve for the coefficients of the estimate, by (preconditioned) conjugate gradient
+        :param b_coeff: The right-hand side, the adjoint mapping of the source in the basis.
+        :param tol: The tolerance on the residual, relative to the norm of `b_coeff`. If None, the mean.cg_tol
+            configuration value is used.
+        :param x0: The coefficients to start the iterations from (e.g. a previous estimate). If None, the iterations
+            start from zero.
+        :param checkpoint: The path of a .npz file to which the state of the iterations is saved periodically (see the
+            mean.checkpoint_iterations and mean.checkpoint_seconds configuration values), so that they may be resumed
+            if interrupted. If the file exists when this method is called, the iterations resume from it (and x0 is
+            ignored). It is removed once the iterations converge.
+        :return: The coefficients of the estimate.
+        """
+        n = b_coeff.shape[0]
+        kernel, precond_kernel = self._regularized_kernels()
 
         tol = tol or config.mean.cg_tol
         target_residual = tol * norm(b_coeff)
 
-        def cb(xk):
-            logger.info(f'Delta {norm(b_coeff - self.apply_kernel(xk))} (target {target_residual})')
+        preconditioner = self._make_preconditioner(self.apply_kernel, kernel, precond_kernel)
 
-        x, info = scipy.sparse.linalg.cg(operator, b_coeff, M=M, callback=cb, tol=tol)
+        if config.mean.mixed_precision:
+            ensure(checkpoint is None, 'Checkpoints are not supported with mixed precision')
+            return self._mixed_precision_solve(
+                self.apply_kernel, b_coeff, kernel, preconditioner, tol, config.mean.mixed_precision_tol, x0=x0
+            )
 
-        if info != 0:
+        init = {'x': x0}
+        if checkpoint is not None and os.path.exists(checkpoint):
+            logger.info(f'Resuming conjugate gradient from {checkpoint}')
+            with np.load(checkpoint) as data:
+                init = {'x': data['x'], 'p': data['p']}
+
+        last_checkpoint = [time.time()]
+
+        def cb(info, x, p):
+            i, residual = info['iter'][-1], info['res'][-1]
+            logger.info(f'Delta {residual} (target {target_residual})')
+
+            if checkpoint is None:
+                return
+            every_iterations, every_seconds = config.mean.checkpoint_iterations, config.mean.checkpoint_seconds
+            if (every_iterations > 0 and i % every_iterations == 0) or \
+                    (every_seconds > 0 and time.time() - last_checkpoint[0] >= every_seconds):
+                logger.info(f'Saving conjugate gradient state to {checkpoint}')
+                _save_checkpoint(checkpoint, x=x, p=p)
+                last_checkpoint[0] = time.time()
+
+        cg_opt = {'max_iter': 10 * n, 'rel_tolerance': tol, 'iter_callback': cb}
+        if preconditioner is not None:
+            cg_opt['preconditioner'] = preconditioner
+
+        start = time.time()
+        x, _, info = conj_grad(partial(self.apply_kernel, kernel=kernel), b_coeff, cg_opt, init)
+        self._log_solve(info['iter'][-1], time.time() - start)
+
+        if info['res'][-1] >= target_residual:
             raise RuntimeError('Unable to converge!')
+        if checkpoint is not None and os.path.exists(checkpoint):
+            os.remove(checkpoint)
         return x
 
+    def conj_grad_many(self, b_coeffs, tol=None, x0=None):
+        """
+        Solve for the coefficients of several estimates with the same kernel, by (preconditioned) block conjugate
+        gradient, applying the kernel to all of them together in each iteration
+        :param b_coeffs: A `basis.count`-by-K array of K right-hand sides.
+        :param tol: The tolerance on the residual of each right-hand side, relative to its norm. If None, the
+            mean.cg_tol configuration value is used.
+        :param x0: A `basis.count`-by-K array of coefficients to start the iterations from. If None, the iterations
+            start from zero.
+        :return: A `basis.count`-by-K array of the coefficients of the estimates.
+        """
+        n, k = b_coeffs.shape
+        kernel, precond_kernel = self._regularized_kernels()
+        preconditioner = self._make_preconditioner(self.apply_kernel, kernel, precond_kernel)
+
+        tol = tol or config.mean.cg_tol
+        target_residuals = tol * norm(b_coeffs, axis=0)
+
+        def cb(info, x, p):
+            logger.info(f'Delta {info["res"][-1]} (target {target_residuals})')
+
+        # The block solver takes the right-hand sides as rows
+        def apply(x):
+            return np.reshape(self.apply_kernel(x.T, kernel=kernel).T, x.shape)
+
+        cg_opt = {'max_iter': 10 * n, 'rel_tolerance': tol, 'iter_callback': cb}
+        if preconditioner is not None:
+            cg_opt['preconditioner'] = lambda x: preconditioner(x.T).T
+        init = {'x': None if x0 is None else x0.T}
+
+        start = time.time()
+        x, _, info = block_conj_grad(apply, b_coeffs.T, cg_opt, init)
+        self._log_solve(info['iter'][-1], time.time() - start)
+
+        if np.any(info['res'][-1] >= target_residuals):
+            raise RuntimeError('Unable to converge!')
+        return x.T
+
+    def _mixed_precision_solve(self, apply_kernel, b_coeff, kernel, preconditioner, tol, inner_tol, x0=None):
+        """
+        Solve the kernel system by iterative refinement: the residuals are computed in double precision, and the
+        corrections by conjugate gradient iterations in single precision (with single precision kernels, coefficients
+        and convolutions), which roughly halves their memory traffic
+        :param apply_kernel: A function applying a kernel (given as the `kernel` keyword argument) to coefficients.
+        :param b_coeff: The right-hand side.
+        :param kernel: The kernel of the system.
+        :param preconditioner: The preconditioner (a `Preconditioner` object), or None. Preconditioning kernels are
+            converted to single precision, and other preconditioners applied in the precision of their input.
+        :param tol: The tolerance on the residual, relative to the norm of `b_coeff`.
+        :param inner_tol: The tolerance of each single precision solve, relative to the norm of its residual.
+        :param x0: The coefficients to start the iterations from. If None, the iterations start from zero.
+        :return: The solution of the system.
+        """
+        n = b_coeff.shape[0]
+
+        def single(kernel):
+            dtype = np.complex64 if np.iscomplexobj(kernel.kernel) else np.float32
+            return FourierKernel(kernel.kernel.astype(dtype, copy=False), kernel.is_centered())
+
+        if isinstance(preconditioner, KernelPreconditioner):
+            preconditioner = KernelPreconditioner(preconditioner.apply_kernel, single(preconditioner.kernel))
+
+        cg_opt = {'max_iter': 10 * n, 'rel_tolerance': inner_tol}
+        if preconditioner is not None:
+            cg_opt['preconditioner'] = preconditioner
+        apply_single = partial(apply_kernel, kernel=single(kernel))
+        inner_iterations = []
+
+        def solve(r):
+            x, _, info = conj_grad(apply_single, r.astype(np.float32), cg_opt)
+            inner_iterations.append(info['iter'][-1])
+            return x
+
+        start = time.time()
+        x, info = iterative_refinement(partial(apply_kernel, kernel=kernel), solve, b_coeff, tol, x0=x0)
+        self._log_solve(sum(inner_iterations), time.time() - start)
+
+        if info['res'][-1] >= tol * norm(b_coeff):
+            raise RuntimeError('Unable to converge!')
+        return x
+
+    def _make_preconditioner(self, apply_kernel, kernel, precond_kernel):
+        """
+        Set up the preconditioner of this estimator (see `__init__`) for a system
+        :param apply_kernel: A function applying a kernel (given as the `kernel` keyword argument) to a `count`-by-K
+            array of K coefficient vectors.
+        :param kernel: The kernel of the system.
+        :param precond_kernel: The preconditioning kernel, used by the 'circulant' preconditioner.
+        :return: A `Preconditioner` object, or None if the system is not preconditioned.
+        """
+        name = self.preconditioner
+        if name is None or name == 'none':
+            return None
+
+        start = time.time()
+        apply = partial(apply_kernel, kernel=kernel)
+        count = self.basis.count
+        if name == 'circulant':
+            preconditioner = KernelPreconditioner(apply_kernel, precond_kernel)
+        elif name == 'jacobi':
+            preconditioner = JacobiPreconditioner(apply, count, config.mean.jacobi_probes)
+        elif name == 'coarse':
+            preconditioner = CoarseGridPreconditioner(
+                apply, count, config.mean.jacobi_probes, self._coarse_indices(config.mean.coarse_size)
+            )
+        else:
+            raise ValueError(f'Unknown preconditioner {name}')
+
+        logger.info(f'Set up {name} preconditioner in {time.time() - start:.2f}s')
+        return preconditioner
+
+    def _coarse_indices(self, size):
+        """
+        :param size: The number of basis functions to select.
+        :return: The indices of the `size` basis functions of lowest (radial) frequency, the zeros of the Bessel
+            functions defining the Fourier-Bessel basis functions.
+        """
+        ensure(hasattr(self.basis, 'r0'), 'The coarse preconditioner requires a Fourier-Bessel basis')
+        indices = self.basis.indices()
+        freqs = self.basis.r0[indices['ks'].astype(int), indices['ells'].astype(int)]
+        return np.argsort(freqs, kind='stable')[:size]
+
+    def _log_solve(self, iterations, seconds):
+        """
+        Log the number of conjugate gradient iterations and the wall time of a solve, to compare preconditioners
+        :param iterations: The number of iterations.
+        :param seconds: The wall time of the iterations (excluding the set up of the preconditioner).
+        """
+        logger.info(f'Conjugate gradient with {self.preconditioner} preconditioner: {iterations} iterations in '
+                    f'{seconds:.2f}s')
+
+    def _regularized_kernels(self):
+        """
+        :return: A tuple of the kernel and the preconditioning kernel (or None) of this estimator, to which the
+            mean.regularizer configuration value has been added.
+        """
+        kernel, precond_kernel = self.kernel, self.precond_kernel
+
+        regularizer = config.mean.regularizer
+        if regularizer > 0:
+            kernel += regularizer
+            if precond_kernel is not None:
+                precond_kernel += regularizer
+        return kernel, precond_kernel
+
     def apply_kernel(self, vol_coeff, kernel=None):
         """
         Applies the kernel represented by convolution
-        :param vol_coeff: The volume to be convolved, stored in the basis coefficients.
+        :param vol_coeff: The volume to be convolved, stored in the basis coefficients, or a `basis.count`-by-K array
+            of K such volumes, which are convolved together.
         :param kernel: a Kernel object. If None, the kernel for this Estimator is used.
         :return: The result of evaluating `vol_coeff` in the given basis, convolving with the kernel given by
             kernel, and backprojecting into the basis.
         """
         if kernel is None:
             kernel = self.kernel
-        vol = self.basis.evaluate(vol_coeff).squeeze()
+        # The stack of K volumes (if any) is kept as is, even for K = 1, so that the result has the shape of vol_coeff
+        vol = self.basis.evaluate(vol_coeff)
         vol = kernel.convolve_volume(vol)
         vol = self.basis.evaluate_t(vol)
 
@@ -1,24 +1,25 @@
+import time
 import logging
+import tempfile
 import numpy as np
-from scipy.fftpack import fftn
-import scipy.sparse.linalg
-from scipy.sparse.linalg import LinearOperator
 from scipy.linalg import norm
 from tqdm import tqdm
 from functools import partial
 
 from aspire import config
-from aspire.image import Image
 from aspire.volume import rotated_grids
-from aspire.nfft import anufft3
-from aspire.utils.fft import mdim_ifftshift
+from aspire.nfft import Plan
+from aspire.utils.fft import fftn, mdim_ifftshift
 from aspire.utils import ensure
-from aspire.utils.matrix import vol_to_vec, vecmat_to_volmat, volmat_to_vecmat, symmat_to_vec_iso, vec_to_symmat_iso, \
-    make_symmat
+from aspire.utils.threads import thread_limits
+from aspire.utils.optimize import conj_grad
+from aspire.utils.matrix import vol_to_vec, vec_to_vol, vecmat_to_volmat, volmat_to_vecmat, symmat_to_vec_iso, \
+    vec_to_symmat_iso, make_symmat
 from aspire.utils.matlab_compat import m_reshape
 from aspire.estimation import Estimator
 from aspire.estimation.mean import MeanEstimator
 from aspire.estimation.kernel import FourierKernel
+from aspire.estimation.preconditioner import KernelPreconditioner
 
 logger = logging.getLogger(__name__)
 
@@ -28,69 +29,114 @@ class CovarianceEstimator(Estimator):
         if 'mean_kernel' in kwargs:
             self.mean_kernel = kwargs.pop('mean_kernel')
         super().__init__(*args, **kwargs)
+        ensure(self.preconditioner in ('circulant', 'none', None),
+               'Only the circulant preconditioner is supported for covariance estimation')
 
     def __getattr__(self, name):
         """Lazy attributes instantiated on first-access"""
 
         if name == 'mean_kernel':
-            mean_kernel = self.mean_kernel = MeanEstimator(self.src, self.basis).kernel
+            mean_kernel = self.mean_kernel = MeanEstimator(self.src, self.basis, n_processes=self.n_processes).kernel
             return mean_kernel
         return super(CovarianceEstimator, self).__getattr__(name)
 
     def compute_kernel(self):
+        if self.n_processes > 1 and config.covar.kernel_directory:
+            # Each worker sends back its partial kernel (from its own temporary file), which is added to the kernel
+            # here as soon as it arrives
+            kernel_f = self._kernel_array((2 * self.L,) * 5 + (self.L + 1,))
+            kernel_f = self.reduce(self.compute_kernel_partial, out=kernel_f)
+        else:
+            kernel_f = self.reduce(self.compute_kernel_partial)
+        return FourierKernel(kernel_f, centered=False)
+
+    def _kernel_array(self, shape):
+        """
+        Allocate a zero-initialized array to accumulate the kernel into
+        :param shape: The shape of the array.
+        :return: An array of type `as_type`, memory-mapped to an (anonymous) temporary file in the directory given by
+            the covar.kernel_directory configuration value if that is set, or kept in memory otherwise.
+        """
+        directory = config.covar.kernel_directory
+        if not directory:
+            return np.zeros(shape, dtype=self.as_type)
+
+        logger.info(f'Accumulating kernel in a temporary file in {directory}')
+        with tempfile.TemporaryFile(dir=directory) as f:
+            # The mapping outlives the file object, and the file is deleted once it is no longer mapped
+            return np.memmap(f, dtype=self.as_type, mode='w+', shape=shape)
+
+    def compute_kernel_partial(self, src):
+        """
+        Accumulate the (non-centered, Fourier domain) kernel over the images of a source (or a shard of it)
+
+        The spatial domain kernel is a sum of outer products f_i f_i^T of one 2L-by-2L-by-2L volume per image, the
+        adjoint NUFFT of the image's (squared) filter weights, so its Fourier transform is the real part of the sum of
+        the outer products of the (Hermitian) 3D Fourier transforms F_i of these volumes. It is therefore accumulated
+        directly in the Fourier domain, as the sum of Re(F_i) Re(F_i)^T - Im(F_i) Im(F_i)^T, and since it is real and
+        even, only the non-negative frequencies along its last dimension are kept.
+
+        :param src: An `ImageSource` object.
+        :return: A 2L-by-...-by-2L-by-(L+1) (6 dimensions) array, the contribution of the images of `src` to the
+            kernel. See `_kernel_array` for where it is kept.
+        """
         # TODO: Most of this stuff is duplicated in MeanEstimator - move up the hierarchy?
         n = self.n
         L = self.L
         _2L = 2 * self.L
 
-        kernel = np.zeros((_2L, _2L, _2L, _2L, _2L, _2L), dtype=self.as_type)
-        sq_filters_f = self.src.eval_filter_grid(self.L, power=2)
+        kernel = self._kernel_array((_2L,) * 5 + (L + 1,))
+        # A view of the kernel as a (2L)^3-by-(2L)^2*(L+1) matrix, accumulated a chunk of rows at a time
+        kernel_mat = np.reshape(kernel, (_2L ** 3, -1))
+        chunk_size = max(1, config.covar.kernel_chunk_bytes // (kernel_mat.shape[1] * kernel_mat.itemsize))
+        sq_filters_f = src.eval_filter_grid(self.L, power=2)
 
-        for i in tqdm(range(0, n, self.batch_size)):
-            _range = np.arange(i, min(n, i + self.batch_size))
-            pts_rot = rotated_grids(L, self.src.rots[_range, :, :])
+        for i in tqdm(range(0, src.n, self.batch_size)):
+            _range = np.arange(i, min(src.n, i + self.batch_size))
+            pts_rot = rotated_grids(L, src.rots[_range, :, :])
             weights = sq_filters_f[:, :, _range]
-            weights *= self.src.amplitudes[_range] ** 2
+            weights *= src.amplitudes[_range] ** 2
 
             if L % 2 == 0:
                 weights[0, :, :] = 0
                 weights[:, 0, :] = 0
 
-            # TODO: This is where this differs from MeanEstimator
             pts_rot = m_reshape(pts_rot, (3, L**2, -1))
             weights = m_reshape(weights, (L**2, -1))
 
             batch_n = weights.shape[-1]
             factors = np.zeros((_2L, _2L, _2L, batch_n), dtype=self.as_type)
 
-            # TODO: Numpy has got to have a functional shortcut to avoid looping like this!
+            # Points differ for every image, so build one-off Plans rather than going through the plan cache
             for j in range(batch_n):
-                factors[:, :, :, j] = anufft3(weights[:, j], pts_rot[:, :, j], (_2L, _2L, _2L), real=True)
+                plan = Plan(sz=(_2L, _2L, _2L), fourier_pts=pts_rot[:, :, j], epsilon=self.epsilon)
+                factors[:, :, :, j] = np.real(plan.adjoint(weights[:, j]))
 
-            factors = vol_to_vec(factors)
-            kernel += vecmat_to_volmat(factors @ factors.T) / (n * L**8)
+            # Ensure symmetric kernel
+            factors[0, :, :, :] = 0
+            factors[:, 0, :, :] = 0
+            factors[:, :, 0, :] = 0
 
-        # Ensure symmetric kernel
-        kernel[0, :, :, :, :, :] = 0
-        kernel[:, 0, :, :, :, :] = 0
-        kernel[:, :, 0, :, :, :] = 0
-        kernel[:, :, :, 0, :, :] = 0
-        kernel[:, :, :, :, 0, :] = 0
-        kernel[:, :, :, :, :, 0] = 0
+            factors_f = fftn(mdim_ifftshift(factors, range(0, 3)), axes=(0, 1, 2))
+            factors_f_half = np.reshape(factors_f[:, :, :L + 1, :], (-1, batch_n)).T
+            factors_f = np.reshape(factors_f, (-1, batch_n))
+            # Contiguous copies, so that the products below go through BLAS
+            re, im = (np.ascontiguousarray(a, dtype=self.as_type) for a in (factors_f.real, factors_f.imag))
+            re_half, im_half = (np.ascontiguousarray(a, dtype=self.as_type)
+                                for a in (factors_f_half.real, factors_f_half.imag))
 
-        logger.info('Computing non-centered Fourier Transform')
-        kernel = mdim_ifftshift(kernel, range(0, 6))
-        kernel_f = fftn(kernel)
-        # Kernel is always symmetric in spatial domain and therefore real in Fourier
-        kernel_f = np.real(kernel_f)
+            for j in range(0, _2L ** 3, chunk_size):
+                rows = slice(j, j + chunk_size)
+                kernel_mat[rows] += (re[rows] @ re_half - im[rows] @ im_half) / (n * L**8)
 
-        return FourierKernel(kernel_f, centered=False)
+        return kernel
 
     def estimate(self, mean_vol, noise_variance, tol=None):
         logger.info('Running Covariance Estimator')
-        b_coeff = self.src_backward(mean_vol, noise_variance)
-        est_coeff = self.conj_grad(b_coeff, tol=tol)
-        covar_est = self.basis.mat_evaluate(est_coeff)
+        with thread_limits():
+            b_coeff = self.src_backward(mean_vol, noise_variance)
+            est_coeff = self.conj_grad(b_coeff, tol=tol)
+            covar_est = self.basis.mat_evaluate(est_coeff)
         covar_est = vecmat_to_volmat(
             make_symmat(
                 volmat_to_vecmat(covar_est)
@@ -107,24 +153,33 @@ class CovarianceEstimator(Estimator):
         if regularizer > 0:
             kernel += regularizer
 
-        operator = LinearOperator((N, N), matvec=partial(self.apply_kernel, kernel=kernel, packed=True))
-        if self.precond_kernel is None:
-            M = None
-        else:
-            precond_kernel = self.precond_kernel
-            if regularizer > 0:
-                precond_kernel += regularizer
-            M = LinearOperator((N, N), matvec=partial(self.apply_kernel, kernel=precond_kernel, packed=True))
+        precond_kernel = self.precond_kernel
+        if precond_kernel is not None and regularizer > 0:
+            precond_kernel += regularizer
+        apply_kernel = partial(self.apply_kernel, packed=True)
+        preconditioner = None if precond_kernel is None else KernelPreconditioner(apply_kernel, precond_kernel)
 
         tol = tol or config.covar.cg_tol
+        if config.covar.mixed_precision:
+            x = self._mixed_precision_solve(
+                apply_kernel, b_coeff, kernel, preconditioner, tol, config.covar.mixed_precision_tol
+            )
+            return vec_to_symmat_iso(x)
+
         target_residual = tol * norm(b_coeff)
 
-        def cb(xk):
-            logger.info(f'Delta {norm(b_coeff - self.apply_kernel(xk, packed=True))} (target {target_residual})')
+        def cb(info, x, p):
+            logger.info(f'Delta {info["res"][-1]} (target {target_residual})')
 
-        x, info = scipy.sparse.linalg.cg(operator, b_coeff, M=M, callback=cb, tol=tol)
+        cg_opt = {'max_iter': 10 * N, 'rel_tolerance': tol, 'iter_callback': cb}
+        if preconditioner is not None:
+            cg_opt['preconditioner'] = preconditioner
 
-        if info != 0:
+        start = time.time()
+        x, _, info = conj_grad(partial(apply_kernel, kernel=kernel), b_coeff, cg_opt)
+        self._log_solve(info['iter'][-1], time.time() - start)
+
+        if info['res'][-1] >= target_residual:
             raise RuntimeError('Unable to converge!')
         return vec_to_symmat_iso(x)
 
@@ -159,22 +214,33 @@ class CovarianceEstimator(Estimator):
         :return: The sum of the outer products of the mean-subtracted images in `src`, corrected by the expected noise
         contribution and expressed as coefficients of `basis`.
         """
+        covar_b = self.reduce(self.src_backward_partial, mean_vol)
+
+        # The coefficients are in double precision, whatever the type of the estimator (see `as_type`)
+        covar_b_coeff = self.basis.mat_evaluate_t(covar_b.astype(np.float64, copy=False))
+        return self._shrink(covar_b_coeff, noise_variance, shrink_method)
+
+    def src_backward_partial(self, src, mean_vol):
+        """
+        Accumulate the outer products of the backprojected mean-subtracted images of a source (or a shard of it)
+        :param src: An `ImageSource` object.
+        :param mean_vol: The mean volume.
+        :return: An L-by-...-by-L (6 dimensions) array, the sum of the outer products over the images of `src`, divided
+            by the total number of images.
+        """
         covar_b = np.zeros((self.L, self.L, self.L, self.L, self.L, self.L), dtype=self.as_type)
 
-        for i in range(0, self.n, self.batch_size):
-            im = self.src.images(i, self.batch_size)
-            batch_n = im.shape[-1]
-            im_centered = im - self.src.vol_forward(mean_vol, i, self.batch_size)
+        for i in range(0, src.n, self.batch_size):
+            im = src.images(i, self.batch_size)
+            im_centered = im - src.vol_forward(mean_vol, i, self.batch_size, epsilon=self.epsilon)
 
-            im_centered_b = np.zeros((self.L, self.L, self.L, batch_n), dtype=self.as_type)
-            for j in range(batch_n):
-                im_centered_b[:, :, :, j] = self.src.im_backward(Image(im_centered[:, :, j]), i+j)
-            im_centered_b = vol_to_vec(im_centered_b)
+            # The backprojections of all images in the batch, as the columns of an L^3-by-n matrix
+            im_centered_b = src.im_backward_each(im_centered, i, epsilon=self.epsilon)
+            im_centered_b = np.ascontiguousarray(vol_to_vec(im_centered_b), dtype=self.as_type)
 
             covar_b += vecmat_to_volmat(im_centered_b @ im_centered_b.T) / self.n
 
-        covar_b_coeff = self.basis.mat_evaluate_t(covar_b)
-        return self._shrink(covar_b_coeff, noise_variance, shrink_method)
+        return covar_b
 
     def _shrink(self, covar_b_coeff, noise_variance, method=None):
         """
@@ -186,7 +252,15 @@ class CovarianceEstimator(Estimator):
         """
         ensure(method in (None, 'frobenius_norm', 'operator_norm', 'soft_threshold'), 'Unsupported shrink method')
 
-        An = self.basis.mat_evaluate_t(self.mean_kernel.toeplitz())
+        # The mean kernel's Toeplitz matrix, expressed in the basis, is formed by convolving the basis functions with
+        # the kernel rather than by forming the (L^3-by-L^3) matrix itself, a block of basis functions at a time
+        count = self.basis.count
+        operator = self.mean_kernel.toeplitz_operator(self.L)
+        An = np.zeros((count, count))
+        for i in range(0, count, config.covar.batch_size):
+            block = np.eye(count)[:, i:i+config.covar.batch_size]
+            basis_vecs = vol_to_vec(self.basis.evaluate(block))
+            An[:, i:i+config.covar.batch_size] = self.basis.evaluate_t(vec_to_vol(operator @ basis_vecs))
         if method is None:
             covar_b_coeff -= noise_variance * An
         else:
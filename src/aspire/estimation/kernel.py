@@ -1,10 +1,14 @@
+import os
 import logging
+import tempfile
+from functools import partial
 import numpy as np
 from scipy.fftpack import ifftn, fftn, fftshift, fft, ifft
+from scipy.sparse.linalg import LinearOperator
 
 from aspire.utils import ensure
-from aspire.utils.fft import mdim_fftshift, mdim_ifftshift
-from aspire.utils.matrix import vol_to_vec, vec_to_vol, roll_dim, unroll_dim, vecmat_to_volmat
+from aspire.utils.fft import mdim_fftshift, mdim_ifftshift, rfftn, irfftn
+from aspire.utils.matrix import vol_to_vec, vec_to_vol, roll_dim, unroll_dim
 from aspire.utils.matlab_compat import m_reshape
 
 logger = logging.getLogger(__name__)
@@ -20,9 +24,13 @@ class FourierKernel(Kernel):
         self.kernel = kernel
         self.M = kernel.shape[0]
         self.as_type = kernel.dtype
+        # Kernels of real functions that are even (such as the covariance kernel) may be stored with only the
+        # non-negative frequencies along their last dimension, M//2+1 of them
+        self.half = kernel.shape[-1] != self.M
 
         # TODO: `centered` should be populated based on how the object is constructed, not explicitly
         self._centered = centered
+        self._kernel_half = None
 
     def __add__(self, delta):
         """
@@ -42,16 +50,66 @@ class FourierKernel(Kernel):
     def is_centered(self):
         return self._centered
 
+    def save(self, filepath):
+        """
+        Save the kernel to a .npz file
+        :param filepath: The path of the file. The file is written atomically (through a temporary file in the same
+            folder), so that a partially written kernel is never found there.
+        """
+        folder = os.path.dirname(os.path.abspath(filepath))
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_filepath = tempfile.mkstemp(dir=folder, suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, kernel=self.kernel, centered=self._centered)
+            os.replace(tmp_filepath, filepath)
+        except Exception:
+            os.remove(tmp_filepath)
+            raise
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        Load a kernel saved with `save`
+        :param filepath: The path of the file.
+        :return: A FourierKernel object.
+        """
+        with np.load(filepath) as data:
+            return cls(data['kernel'], centered=bool(data['centered']))
+
+    def kernel_half(self):
+        """
+        The kernel restricted to non-negative frequencies along its last dimension, for convolving real volumes.
+        Since the real part of a convolution only depends on the Hermitian part (K(k) + conj(K(-k))) / 2 of the kernel,
+        that is what is returned (for the usual kernels, which are Fourier transforms of real functions, this is just
+        the kernel itself).
+        :return: An M-by-...-by-M-by-(M//2+1) array.
+        """
+        if self.half:
+            return self.kernel
+        if self._kernel_half is None:
+            kernel = self.kernel
+            # The kernel at frequency -k, for each frequency k
+            kernel_mirror = np.roll(np.flip(kernel), 1, axis=tuple(range(self.ndim)))
+            self._kernel_half = ((kernel + np.conj(kernel_mirror)) / 2)[..., :self.M // 2 + 1]
+        return self._kernel_half
+
     def circularize(self):
         logger.info('Circularizing kernel')
-        kernel = np.real(ifftn(self.kernel))
+        if self.half:
+            kernel = irfftn(self.kernel, (self.M,) * self.ndim)
+        else:
+            kernel = np.real(ifftn(self.kernel))
         kernel = mdim_fftshift(kernel)
 
         for dim in range(self.ndim):
             logger.info(f'Circularizing dimension {dim}')
             kernel = self.circularize_1d(kernel, dim)
 
-        xx = fftn(mdim_ifftshift(kernel))
+        if self.half:
+            xx = rfftn(mdim_ifftshift(kernel))
+        else:
+            xx = fftn(mdim_ifftshift(kernel))
         return xx
 
     def circularize_1d(self, kernel, dim):
@@ -74,35 +132,37 @@ class FourierKernel(Kernel):
 
         return fftshift(kernel_circ, dim)
 
-    def convolve_volume(self, x):
+    def convolve_volume(self, x, real=True):
         """
-        Convolve volume with kernel
+        Convolve volumes with kernel
         :param x: An N-by-N-by-N-by-... array of volumes to be convolved.
+        :param real: Whether the volumes are real. If so (the default), all volumes are convolved together through
+            real-to-complex FFTs, with only half of their spectrum (and of the kernel), and the result is real.
+            Otherwise, full complex FFTs are used, and the result is complex.
         :return: The original volumes convolved by the kernel with the same dimensions as before.
         """
         N = x.shape[0]
-        kernel_f = self.kernel[..., np.newaxis]
-        N_ker = kernel_f.shape[0]
+        N_ker = self.M
+        dtype = x.dtype
 
         x, sz_roll = unroll_dim(x, 4)
         ensure(x.shape[0] == x.shape[1] == x.shape[2] == N, "Volumes in x must be cubic")
-        ensure(kernel_f.shape[3] == 1, "Convolution kernel must be cubic")
-        ensure(len(set(kernel_f.shape[:3])) == 1, "Convolution kernel must be cubic")
-
-        is_singleton = x.shape[3] == 1
-
-        if is_singleton:
-            x = fftn(x[..., 0], (N_ker, N_ker, N_ker))[..., np.newaxis]
-        else:
-            raise NotImplementedError('not yet')
-
-        x = x * kernel_f
-
-        if is_singleton:
-            x[..., 0] = np.real(ifftn(x[..., 0]))
-            x = x[:N, :N, :N, :]
+        ensure(self.ndim == 3, "Convolution kernel must be cubic")
+        ensure(real or not self.half, "Complex volumes cannot be convolved with a half kernel")
+
+        # All volumes are zero-padded and transformed together, along the first three axes of the stack
+        axes = (0, 1, 2)
+        if real:
+            x = rfftn(x, (N_ker, N_ker, N_ker), axes=axes)
+            x *= self.kernel_half()[..., np.newaxis]
+            x = irfftn(x, (N_ker, N_ker, N_ker), axes=axes)
         else:
-            raise NotImplementedError('not yet')
+            x = fftn(x, (N_ker, N_ker, N_ker), axes=axes)
+            x *= self.kernel[..., np.newaxis]
+            x = ifftn(x, axes=axes)
+        x = x[:N, :N, :N, :]
+        if real:
+            x = x.astype(dtype, copy=False)
 
         x = roll_dim(x, sz_roll)
 
@@ -123,6 +183,9 @@ class FourierKernel(Kernel):
         is_singleton = len(shape) == 6
         N_ker = kernel_f.shape[0]
 
+        if self.half:
+            return self._convolve_volume_matrix_half(x)
+
         # Note from MATLAB code:
         # Order is important here.  It's about 20% faster to run from 1 through 6 compared with 6 through 1.
         # TODO: Experiment with scipy order; try overwrite_x argument
@@ -152,6 +215,32 @@ class FourierKernel(Kernel):
 
         return x
 
+    def _convolve_volume_matrix_half(self, x):
+        """
+        Convolve a real volume matrix with a kernel stored with only the non-negative frequencies along its last
+        dimension (see the `half` attribute)
+        :param x: An N-by-...-by-N (6 dimensions) volume matrix to be convolved.
+        :return: The original volume matrix convolved by the kernel with the same dimensions as before.
+        """
+        N = x.shape[0]
+        N_ker = self.M
+        real_type = x.dtype
+
+        # The real transform must come first (and its inverse last); the complex ones are cropped as they go, as above
+        x = rfftn(x, (N_ker,), axes=(5,))
+        x = x.astype(np.result_type(real_type, np.complex64), copy=False)
+        for axis in range(5):
+            x = fft(x, N_ker, axis, overwrite_x=True)
+
+        x *= self.kernel
+
+        for axis in reversed(range(5)):
+            x = ifft(x, None, axis, overwrite_x=True)
+            x = x[(slice(None),) * axis + (slice(0, N),)]
+        x = irfftn(x, (N_ker,), axes=(5,))[..., :N]
+
+        return x.astype(real_type, copy=False)
+
     def toeplitz(self, L=None):
         """
         Compute the 3D Toeplitz matrix corresponding to this Fourier Kernel
@@ -162,10 +251,50 @@ class FourierKernel(Kernel):
         if L is None:
             L = int(self.M/2)
 
-        A = np.eye(L**3, dtype=self.as_type)
-        for i in range(L**3):
-            A[:, i] = vol_to_vec(self.convolve_volume(vec_to_vol(A[:, i])))
+        # The convolution of real volumes only depends on the Hermitian part of the kernel, whose inverse FFT is the
+        # real part of that of the kernel (and that of a half kernel, which is Hermitian by construction, its inverse
+        # real FFT). The entry of the matrix at (x, y) is this (circular) spatial kernel at x-y.
+        if self.half:
+            kernel = irfftn(self.kernel, (self.M,) * self.ndim)
+        else:
+            kernel = np.real(ifftn(self.kernel))
+        diffs = np.mod(np.subtract.outer(np.arange(L), np.arange(L)), self.M)
+
+        A = kernel[
+            diffs[:, np.newaxis, np.newaxis, :, np.newaxis, np.newaxis],
+            diffs[np.newaxis, :, np.newaxis, np.newaxis, :, np.newaxis],
+            diffs[np.newaxis, np.newaxis, :, np.newaxis, np.newaxis, :]
+        ]
+        return A.astype(self._toeplitz_type(), copy=False)
+
+    def toeplitz_operator(self, L=None):
+        """
+        The 3D Toeplitz matrix corresponding to this Fourier Kernel (see `toeplitz`), as an implicit operator that
+        convolves vectorized volumes with the kernel, without forming the matrix
+        :param L: The size of the volumes to be convolved (default M/2, where the dimensions of this Fourier Kernel
+            are MxMxM
+        :return: A `scipy.sparse.linalg.LinearOperator` object of size L^3-by-L^3, acting on volumes unrolled into
+            vectors by `vol_to_vec`. Blocks of vectors are convolved together.
+        """
+        if L is None:
+            L = int(self.M/2)
+
+        # The transpose of the matrix is the convolution with the kernel reflected through the origin
+        transpose = FourierKernel(np.conj(self.kernel), self._centered)
+
+        def matmat(X, kernel):
+            return vol_to_vec(kernel.convolve_volume(vec_to_vol(X)))
 
-        A = vecmat_to_volmat(A)
-        return A
+        return LinearOperator(
+            (L**3, L**3),
+            matvec=partial(matmat, kernel=self),
+            matmat=partial(matmat, kernel=self),
+            rmatvec=partial(matmat, kernel=transpose),
+            dtype=self._toeplitz_type()
+        )
 
+    def _toeplitz_type(self):
+        """
+        :return: The data type of the Toeplitz matrix of this kernel, which is real for half kernels.
+        """
+        return np.finfo(self.as_type).dtype if self.half else self.as_type
@@ -1,39 +1,43 @@
 import logging
 import numpy as np
-from scipy.fftpack import fft2
 
-from aspire.volume import rotated_grids
-from aspire.nfft import anufft3
-from aspire.utils.fft import mdim_ifftshift
+from aspire import config
+from aspire.volume import rotated_grids, backprojection_data
+from aspire.nfft import Plan
+from aspire.utils.fft import mdim_ifftshift, fftn_real
 from aspire.utils.matlab_compat import m_reshape, m_flatten
 from aspire.estimation import Estimator
 from aspire.estimation.kernel import FourierKernel
+from aspire.utils.threads import thread_limits
 
 logger = logging.getLogger(__name__)
 
 
 class MeanEstimator(Estimator):
 
-    def compute_kernel(self):
-        _2L = 2 * self.L
-        kernel = np.zeros((_2L, _2L, _2L), dtype=self.as_type)
-        sq_filters_f = self.src.eval_filter_grid(self.L, power=2)
+    def _kernel_weights(self, src, _range, sq_filters_f):
+        """
+        Compute the weights of the rotated grid points of a batch of images in the kernel
+        :param src: The `ImageSource` object containing the images.
+        :param _range: The indices of the images in the batch.
+        :param sq_filters_f: An L-by-L-by-n array of the squared filters of all images of `src`.
+        :return: An array of L^2*len(_range) weights.
+        """
+        weights = sq_filters_f[:, :, _range]
+        weights *= src.amplitudes[_range] ** 2
 
-        for i in range(0, self.n, self.batch_size):
-            _range = np.arange(i, min(self.n, i + self.batch_size))
-            pts_rot = rotated_grids(self.L, self.src.rots[_range, :, :])
-            weights = sq_filters_f[:, :, _range]
-            weights *= self.src.amplitudes[_range] ** 2
-
-            if self.L % 2 == 0:
-                weights[0, :, :] = 0
-                weights[:, 0, :] = 0
-
-            pts_rot = m_reshape(pts_rot, (3, -1))
-            weights = m_flatten(weights)
+        if self.L % 2 == 0:
+            weights[0, :, :] = 0
+            weights[:, 0, :] = 0
 
-            kernel += 1 / (self.n * self.L ** 4) * anufft3(weights, pts_rot, (_2L, _2L, _2L), real=True)
+        return m_flatten(weights)
 
+    def _fourier_kernel(self, kernel):
+        """
+        Form the FourierKernel object from the kernel accumulated over all batches of images
+        :param kernel: A 2L-by-2L-by-2L array.
+        :return: A FourierKernel object.
+        """
         # Ensure symmetric kernel
         kernel[0, :, :] = 0
         kernel[:, 0, :] = 0
@@ -41,9 +45,87 @@ class MeanEstimator(Estimator):
 
         logger.info('Computing non-centered Fourier Transform')
         kernel = mdim_ifftshift(kernel, range(0, 3))
-        kernel_f = fft2(kernel, axes=(0, 1, 2))
-        kernel_f = np.real(kernel_f)
+        kernel_f = fftn_real(kernel)
+        kernel_f = np.real(kernel_f).astype(self.as_type, copy=False)
 
         return FourierKernel(kernel_f, centered=False)
 
+    def compute_kernel(self):
+        return self._fourier_kernel(self.reduce(self.compute_kernel_partial))
+
+    def compute_kernel_partial(self, src):
+        """
+        Accumulate the (spatial domain) kernel over the images of a source (or a shard of it)
+        :param src: An `ImageSource` object.
+        :return: A 2L-by-2L-by-2L array, the contribution of the images of `src` to the kernel.
+        """
+        _2L = 2 * self.L
+        kernel = np.zeros((_2L, _2L, _2L), dtype=self.as_type)
+        sq_filters_f = src.eval_filter_grid(self.L, power=2)
+
+        for i in range(0, src.n, self.batch_size):
+            _range = np.arange(i, min(src.n, i + self.batch_size))
+            pts_rot = rotated_grids(self.L, src.rots[_range, :, :])
+            pts_rot = m_reshape(pts_rot, (3, -1))
+            weights = self._kernel_weights(src, _range, sq_filters_f)
+
+            # Points are unique to each batch, so build a one-off Plan rather than going through the plan cache
+            plan = Plan(sz=(_2L, _2L, _2L), fourier_pts=pts_rot, epsilon=self.epsilon)
+            kernel += 1 / (self.n * self.L ** 4) * np.real(plan.adjoint(weights))
+
+        return kernel
+
+    def compute_kernel_and_src_backward(self):
+        """
+        Compute the kernel and apply the adjoint mapping to the source in a single pass over the images.
+        The kernel and the backprojection of each batch of images are adjoint NUFFTs at the same points, so they are
+        computed together, by the same plan. The backprojection, an L-by-L-by-L volume, is the center of the
+        2L-by-2L-by-2L adjoint transform of the images.
+        :return: A tuple (kernel, b_coeff) of the FourierKernel object (as returned by `compute_kernel`) and the
+            adjoint mapping (as returned by `src_backward`).
+        """
+        kernel, mean_b = self.reduce(self.compute_kernel_and_src_backward_partial)
+
+        b_coeff = self.basis.evaluate_t(mean_b.astype(np.float64, copy=False))
+        logger.info(f'Determined adjoint mappings. Shape = {b_coeff.shape}')
+        return self._fourier_kernel(kernel), b_coeff
+
+    def compute_kernel_and_src_backward_partial(self, src):
+        """
+        Accumulate the kernel and the adjoint mapping over the images of a source (or a shard of it), in a single pass
+        :param src: An `ImageSource` object.
+        :return: A tuple of the contribution of the images of `src` to the (spatial domain) kernel, as returned by
+            `compute_kernel_partial`, and to the adjoint mapping, as returned by `src_backward_partial`.
+        """
+        L = self.L
+        _2L = 2 * L
+        kernel = np.zeros((_2L, _2L, _2L), dtype=self.as_type)
+        mean_b = np.zeros((L, L, L), dtype=self.as_type)
+        sq_filters_f = src.eval_filter_grid(L, power=2)
+        # Modes -L//2 .. L - L//2 - 1 of the 2L-by-2L-by-2L transform
+        center = slice(L - L // 2, 2 * L - L // 2)
+
+        for i in range(0, src.n, self.batch_size):
+            im = src.images(i, self.batch_size)
+            _range = np.arange(i, min(src.n, i + self.batch_size))
+            im = src.im_backward_prepare(im, i)
+            pts_rot, im_f = backprojection_data(im, src.rots[_range, :, :])
+            weights = self._kernel_weights(src, _range, sq_filters_f)
+
+            plan = Plan(sz=(_2L, _2L, _2L), fourier_pts=pts_rot, epsilon=self.epsilon, ntransf=2)
+            vol = plan.adjoint(np.column_stack((weights, im_f)))
+            kernel += 1 / (self.n * L ** 4) * np.real(vol[:, :, :, 0])
+            mean_b += (np.real(vol[center, center, center, 1]) / (L * self.n)).astype(self.as_type)
+
+        return kernel, mean_b
 
+    def estimate(self, b_coeff=None, tol=None, x0=None, checkpoint=None):
+        if b_coeff is None and config.mean.single_pass and 'kernel' not in self.__dict__:
+            kernel = self.load_cached_kernel()
+            if kernel is None:
+                logger.info('Computing kernel and adjoint mappings in a single pass')
+                with thread_limits():
+                    kernel, b_coeff = self.compute_kernel_and_src_backward()
+                self.save_cached_kernel(kernel)
+            self.kernel = kernel
+        return super().estimate(b_coeff=b_coeff, tol=tol, x0=x0, checkpoint=checkpoint)
@@ -1,9 +1,8 @@
 import logging
 import numpy as np
 
-from aspire.utils.coor_trans import grid_2d
-from aspire.utils.fft import centered_fft2
 from aspire.utils.filters import ScalarFilter, ArrayFilter
+from aspire.estimation.statistics import BackgroundMoments, NoisePSD, compute_statistics
 
 logger = logging.getLogger(__name__)
 
@@ -15,13 +14,16 @@ class NoiseEstimator:
 
 
 class WhiteNoiseEstimator(NoiseEstimator):
-    def __init__(self, src, bgRadius=1, batchSize=512):
+    def __init__(self, src, bgRadius=1, batchSize=512, noise_variance=None):
         """
         A White Noise Estimator
         Any additional args/kwargs are passed on to the Source's 'images' method
         :param src: A Source object which can give us images on demand
         :param bgRadius: The radius of the disk whose complement is used to estimate the noise.
         :param batchSize:  The size of the batches in which to compute the variance estimate
+        :param noise_variance: The noise variance of the images, if already known (e.g. the variance of a
+            `BackgroundMoments` statistic computed together with other statistics, see `compute_statistics`).
+            If None, it is estimated from the images.
         """
         self.src = src
         self.L = src.L
@@ -29,7 +31,7 @@ class WhiteNoiseEstimator(NoiseEstimator):
         self.bgRadius = bgRadius
         self.batchSize = batchSize
 
-        self.filter = self._create_filter()
+        self.filter = self._create_filter(noise_variance)
 
     def estimate(self):
         """
@@ -55,28 +57,22 @@ class WhiteNoiseEstimator(NoiseEstimator):
         TODO: How's this initial estimate of variance different from the 'estimate' method?
         """
         # Run estimate using saved parameters
-        g2d = grid_2d(self.L)
-        mask = g2d['r'] >= self.bgRadius
-
-        first_moment = 0
-        second_moment = 0
-        for i in range(0, self.n, self.batchSize):
-            images = self.src.images(start=i, num=self.batchSize).asnumpy()
-            images_masked = (images * np.expand_dims(mask, 2))
-
-            _denominator = self.n * np.sum(mask)
-            first_moment += np.sum(images_masked) / _denominator
-            second_moment += np.sum(np.abs(images_masked**2)) / _denominator
-        return second_moment - first_moment**2
+        (_, noise_variance), = compute_statistics(
+            self.src, [BackgroundMoments(self.L, self.bgRadius)], batch_size=self.batchSize
+        )
+        return float(noise_variance)
 
 
 class AnisotropicNoiseEstimator(NoiseEstimator):
-    def __init__(self, src, bgRadius=1, batchSize=512):
+    def __init__(self, src, bgRadius=1, batchSize=512, noise_psd=None):
         """
         A White Noise Estimator
         :param src: A Source object which can give us images on demand
         :param bgRadius: The radius of the disk whose complement is used to estimate the noise.
         :param batchSize:  The size of the batches in which to compute the variance estimate
+        :param noise_psd: The noise PSD of the images, if already known (e.g. the value of a `NoisePSD` statistic
+            computed together with other statistics, see `compute_statistics`). If None, it is estimated from the
+            images.
         TODO: A base class NoiseEstimator should be instantiated using any object that can furnish images.
         """
         self.src = src
@@ -85,7 +81,7 @@ class AnisotropicNoiseEstimator(NoiseEstimator):
         self.bgRadius = bgRadius
         self.batchSize = batchSize
 
-        self.filter = self._create_filter()
+        self.filter = self._create_filter(noise_psd)
 
     def estimate(self):
         """
@@ -108,21 +104,5 @@ class AnisotropicNoiseEstimator(NoiseEstimator):
         TODO: How's this initial estimate of variance different from the 'estimate' method?
         """
         # Run estimate using saved parameters
-        g2d = grid_2d(self.L)
-        mask = g2d['r'] >= self.bgRadius
-
-        mean_est = 0
-        noise_psd_est = np.zeros((self.L, self.L)).astype(self.src.dtype)
-        for i in range(0, self.n, self.batchSize):
-            images = self.src.images(i, self.batchSize).asnumpy()
-            images_masked = (images * np.expand_dims(mask, 2))
-
-            _denominator = self.n * np.sum(mask)
-            mean_est += np.sum(images_masked) / _denominator
-            im_masked_f = centered_fft2(images_masked)
-            noise_psd_est += np.sum(np.abs(im_masked_f**2), axis=2) / _denominator
-
-        mid = self.L // 2
-        noise_psd_est[mid, mid] -= mean_est**2
-
-        return noise_psd_est
+        noise_psd_est, = compute_statistics(self.src, [NoisePSD(self.L, self.bgRadius)], batch_size=self.batchSize)
+        return noise_psd_est.astype(self.src.dtype)
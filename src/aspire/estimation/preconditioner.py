@@ -0,0 +1,143 @@
+"""
+Preconditioners for the conjugate gradient solves of estimators.
+
+Each preconditioner approximates the inverse of a symmetric positive definite operator A, given as a function that
+applies it to a `count`-by-K array of K coefficient vectors at once (see `Estimator.apply_kernel`), and is itself
+applied to coefficient vectors by calling it.
+"""
+import logging
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+
+from aspire.utils import ensure
+
+logger = logging.getLogger(__name__)
+
+
+class Preconditioner:
+    # The name under which the preconditioner is selected (see `Estimator.__init__`)
+    name = None
+
+    def __call__(self, coeff):
+        """
+        Apply the preconditioner
+        :param coeff: A coefficient vector, or a `count`-by-K array of K such vectors.
+        :return: The preconditioned vector(s), of the same shape.
+        """
+        raise NotImplementedError('Subclasses must implement the __call__ method')
+
+
+class KernelPreconditioner(Preconditioner):
+    """
+    Convolution with a (preconditioning) kernel, such as the inverse of the circulant approximation of the kernel of an
+    estimator (see `FourierKernel.circularize`)
+    """
+    name = 'circulant'
+
+    def __init__(self, apply_kernel, kernel):
+        """
+        :param apply_kernel: A function applying a kernel, given as its `kernel` keyword argument, to coefficients.
+        :param kernel: The preconditioning kernel, a `FourierKernel` object.
+        """
+        self.apply_kernel = apply_kernel
+        self.kernel = kernel
+
+    def __call__(self, coeff):
+        return self.apply_kernel(coeff, kernel=self.kernel)
+
+
+def operator_diagonal(apply, count, n_probes, block_size=64, seed=0):
+    """
+    Compute (or estimate) the diagonal of an operator
+    :param apply: A function applying the operator to a `count`-by-K array of K vectors.
+    :param count: The dimension of the space.
+    :param n_probes: If count is at most this number, the diagonal is computed exactly, by applying the operator to
+        the columns of the identity. Otherwise, it is estimated from this many random +/-1 probe vectors z, as the
+        ratio of the sums of z * Az and of z * z (Bekas et al., Appl. Numer. Math. 57 (11), 2007).
+    :param block_size: The number of vectors to which the operator is applied at once.
+    :param seed: The seed of the random probe vectors.
+    :return: An array of `count` values.
+    """
+    exact = count <= n_probes
+    if not exact:
+        probes = np.random.RandomState(seed).choice([-1., 1.], size=(count, n_probes))
+
+    diagonal = np.zeros(count)
+    for i in range(0, count if exact else n_probes, block_size):
+        if exact:
+            block = np.eye(count)[:, i:i+block_size]
+            diagonal[i:i+block_size] = np.diag(np.reshape(apply(block), block.shape)[i:i+block_size])
+        else:
+            block = probes[:, i:i+block_size]
+            diagonal += np.sum(block * np.reshape(apply(block), block.shape), axis=1)
+
+    # Each probe contributes 1 to the sum of z * z for every coefficient
+    return diagonal if exact else diagonal / n_probes
+
+
+class JacobiPreconditioner(Preconditioner):
+    """
+    Division by the diagonal of the operator, in the space of basis coefficients
+    """
+    name = 'jacobi'
+
+    def __init__(self, apply, count, n_probes, rel_floor=1e-3):
+        """
+        :param apply: A function applying the operator to a `count`-by-K array of K vectors.
+        :param count: The dimension of the space.
+        :param n_probes: The number of probe vectors used to estimate the diagonal (see `operator_diagonal`).
+        :param rel_floor: The smallest value of the diagonal, relative to its largest value. Estimates of the diagonal
+            from random probes may be small or even negative where the true diagonal is small, and are clamped to it.
+        """
+        diagonal = operator_diagonal(apply, count, n_probes)
+        ensure(diagonal.max() > 0, 'The diagonal of the operator must be positive')
+
+        floor = rel_floor * diagonal.max()
+        n_clamped = np.count_nonzero(diagonal < floor)
+        if n_clamped > 0:
+            logger.info(f'Clamping {n_clamped} entries of the diagonal to {floor}')
+        self.inv_diagonal = 1. / np.maximum(diagonal, floor)
+
+    def __call__(self, coeff):
+        # Keep the precision of the coefficients (see `Estimator._mixed_precision_solve`)
+        inv_diagonal = self.inv_diagonal.astype(coeff.dtype, copy=False)
+        return np.reshape(inv_diagonal, (-1,) + (1,) * (coeff.ndim - 1)) * coeff
+
+
+class CoarseGridPreconditioner(Preconditioner):
+    """
+    A two-level preconditioner: the Jacobi preconditioner, plus an exact correction on a coarse space of
+    low-frequency basis functions. These are the components of the error which the Jacobi preconditioner (like the
+    smoothers of multigrid methods) is least effective on. The correction solves the operator restricted to the
+    coarse space, which is formed explicitly and factored once:
+
+        P = D^-1 + C (C^T A C)^-1 C^T
+
+    where D is the diagonal of A and the columns of C are the coarse basis vectors.
+    """
+    name = 'coarse'
+
+    def __init__(self, apply, count, n_probes, coarse_indices):
+        """
+        :param apply: A function applying the operator to a `count`-by-K array of K vectors.
+        :param count: The dimension of the space.
+        :param n_probes: The number of probe vectors used to estimate the diagonal (see `operator_diagonal`).
+        :param coarse_indices: The indices of the basis vectors spanning the coarse space.
+        """
+        self.jacobi = JacobiPreconditioner(apply, count, n_probes)
+        self.coarse_indices = np.asarray(coarse_indices)
+
+        n_coarse = len(self.coarse_indices)
+        coarse = np.zeros((count, n_coarse))
+        coarse[self.coarse_indices, np.arange(n_coarse)] = 1
+        coarse_op = np.reshape(apply(coarse), coarse.shape)[self.coarse_indices]
+        # Symmetrize, to guard against rounding in the operator
+        self.coarse_factor = cho_factor((coarse_op + coarse_op.T) / 2)
+
+    def __call__(self, coeff):
+        result = self.jacobi(coeff)
+        result[self.coarse_indices] += np.reshape(
+            cho_solve(self.coarse_factor, np.reshape(coeff[self.coarse_indices], (len(self.coarse_indices), -1))),
+            coeff[self.coarse_indices].shape
+        )
+        return result
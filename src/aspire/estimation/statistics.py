@@ -0,0 +1,233 @@
+"""
+Statistics of the images of an `ImageSource`, computed together in a single pass over the images.
+
+Each statistic keeps a partial state, which is updated with each batch of images and finalized into the value of the
+statistic once all images have been seen. Partial states of disjoint sets of images (e.g. the shards of a source) can
+be merged, so that a pass may also be distributed among several processes.
+"""
+import logging
+import numpy as np
+
+from aspire.utils.coor_trans import grid_2d
+from aspire.utils.fft import centered_fft2
+from aspire.utils.threads import process_pool, thread_limits
+
+logger = logging.getLogger(__name__)
+
+
+class Statistic:
+    def initial_state(self):
+        """
+        :return: The partial state of the statistic before any image has been seen.
+        """
+        raise NotImplementedError('Subclasses must implement the initial_state method')
+
+    def update(self, state, images):
+        """
+        Add a batch of images to a partial state
+        :param state: A partial state.
+        :param images: An L-by-L-by-n array of images.
+        :return: The updated partial state.
+        """
+        raise NotImplementedError('Subclasses must implement the update method')
+
+    def merge(self, state1, state2):
+        """
+        Merge the partial states of two disjoint sets of images
+        :param state1: A partial state.
+        :param state2: Another partial state.
+        :return: The partial state of the union of the two sets of images.
+        """
+        raise NotImplementedError('Subclasses must implement the merge method')
+
+    def finalize(self, state):
+        """
+        :param state: The partial state of all images.
+        :return: The value of the statistic.
+        """
+        raise NotImplementedError('Subclasses must implement the finalize method')
+
+
+class Moments(Statistic):
+    """
+    The mean and (population) variance of values taken from each image, accumulated with the pairwise update of
+    Chan et al. (Updating Formulae and a Pairwise Algorithm for Computing Sample Variances, 1979), which, unlike the
+    difference of the first two raw moments, does not lose precision when the mean is large relative to the spread.
+    The partial state is a tuple (count, mean, sum of squared deviations from the mean).
+    """
+
+    # The axes of the (subclass-defined) values of a batch along which moments are taken
+    axis = None
+
+    def values(self, images):
+        """
+        :param images: An L-by-L-by-n array of images.
+        :return: The values of the batch whose moments are accumulated.
+        """
+        raise NotImplementedError('Subclasses must implement the values method')
+
+    def initial_state(self):
+        return 0, 0., 0.
+
+    def update(self, state, images):
+        values = self.values(images)
+        count = values.size if self.axis is None else values.shape[self.axis]
+        if count == 0:
+            return state
+        mean = np.mean(values, axis=self.axis, keepdims=True)
+        m2 = np.sum(np.abs(values - mean) ** 2, axis=self.axis)
+        return self.merge(state, (count, np.reshape(mean, np.shape(m2)), m2))
+
+    def merge(self, state1, state2):
+        count1, mean1, m21 = state1
+        count2, mean2, m22 = state2
+        if count1 == 0:
+            return state2
+        if count2 == 0:
+            return state1
+
+        count = count1 + count2
+        delta = mean2 - mean1
+        mean = mean1 + delta * count2 / count
+        m2 = m21 + m22 + np.abs(delta) ** 2 * count1 * count2 / count
+        return count, mean, m2
+
+    def finalize(self, state):
+        """
+        :param state: The partial state of all images.
+        :return: A tuple of the mean and the variance.
+        """
+        count, mean, m2 = state
+        return mean, m2 / count
+
+
+class ImageMoments(Moments):
+    """
+    The mean image and the variance of each pixel over all images
+    """
+    axis = -1
+
+    def values(self, images):
+        return images
+
+
+class BackgroundMoments(Moments):
+    """
+    The mean and the variance of the pixels outside a disk (the background, which is taken to be pure noise) over all
+    images
+    """
+
+    def __init__(self, L, bgRadius=1):
+        """
+        :param L: The size of the images.
+        :param bgRadius: The radius of the disk whose complement is the background.
+        """
+        self.mask = grid_2d(L)['r'] >= bgRadius
+
+    def values(self, images):
+        return images[self.mask]
+
+
+class NoisePSD(Statistic):
+    """
+    The power spectral distribution of the noise, estimated as the average periodogram of the images with everything
+    but their background masked out.
+    The partial state is a tuple (number of images, sum of background pixels, sum of periodograms).
+    """
+
+    def __init__(self, L, bgRadius=1):
+        """
+        :param L: The size of the images.
+        :param bgRadius: The radius of the disk whose complement is the background.
+        """
+        self.L = L
+        self.mask = grid_2d(L)['r'] >= bgRadius
+
+    def initial_state(self):
+        return 0, 0., np.zeros((self.L, self.L))
+
+    def update(self, state, images):
+        images_masked = images * np.expand_dims(self.mask, 2)
+        im_masked_f = centered_fft2(images_masked)
+        return self.merge(state, (
+            images.shape[-1], np.sum(images_masked), np.sum(np.abs(im_masked_f) ** 2, axis=2)
+        ))
+
+    def merge(self, state1, state2):
+        return tuple(x + y for x, y in zip(state1, state2))
+
+    def finalize(self, state):
+        """
+        :param state: The partial state of all images.
+        :return: An L-by-L array, the noise PSD (with the zero frequency at its center).
+        """
+        count, background_sum, psd_sum = state
+        denominator = count * np.sum(self.mask)
+        noise_psd = psd_sum / denominator
+
+        mid = self.L // 2
+        noise_psd[mid, mid] -= (background_sum / denominator) ** 2
+        return noise_psd
+
+
+def merge_states(statistics, partials):
+    """
+    Merge partial states of disjoint sets of images pairwise, in a balanced tree
+    :param statistics: A list of `Statistic` objects.
+    :param partials: A non-empty list of partial states, each a list of the partial states of `statistics`.
+    :return: The list of the merged partial states of `statistics`.
+    """
+    def merge(a, b):
+        return [s.merge(x, y) for s, x, y in zip(statistics, a, b)]
+
+    while len(partials) > 1:
+        partials = [merge(*partials[i:i+2]) if i + 1 < len(partials) else partials[i]
+                    for i in range(0, len(partials), 2)]
+    return partials[0]
+
+
+def partial_states(src, statistics, batch_size=512):
+    """
+    Accumulate the partial states of several statistics in a single pass over the images of a source
+    :param src: An `ImageSource` object (or a shard of one).
+    :param statistics: A list of `Statistic` objects.
+    :param batch_size: The number of images to process at a time.
+    :return: The list of the partial states of `statistics` over all images of `src`.
+    """
+    states = [s.initial_state() for s in statistics]
+    with thread_limits():
+        for i in range(0, src.n, batch_size):
+            images = src.images(i, batch_size).asnumpy()
+            states = [s.update(state, images) for s, state in zip(statistics, states)]
+    return states
+
+
+def _shard_states(src, statistics, batch_size, rank, world_size):
+    """
+    Accumulate the partial states of several statistics over one shard of a source, in a worker process
+    """
+    return partial_states(src.shard(rank, world_size), statistics, batch_size)
+
+
+def compute_statistics(src, statistics, batch_size=512, n_processes=1):
+    """
+    Compute several statistics of the images of a source in a single pass over them
+    :param src: An `ImageSource` object.
+    :param statistics: A list of `Statistic` objects.
+    :param batch_size: The number of images to process at a time.
+    :param n_processes: The number of processes among which the images are distributed. Each process works on its own
+        shard of the source, and their partial states are merged.
+    :return: The list of the values of `statistics`.
+    """
+    logger.info(f'Computing {len(statistics)} statistics of {src.n} images in batches of {batch_size}')
+    if n_processes <= 1:
+        states = partial_states(src, statistics, batch_size)
+    else:
+        with process_pool(n_processes) as executor:
+            futures = [
+                executor.submit(_shard_states, src, statistics, batch_size, rank, n_processes)
+                for rank in range(n_processes)
+            ]
+            states = merge_states(statistics, [future.result() for future in futures])
+
+    return [s.finalize(state) for s, state in zip(statistics, states)]
@@ -5,7 +5,7 @@ import mrcfile
 
 from aspire.utils import ensure
 from aspire.utils.coor_trans import grid_2d
-from aspire.utils.fft import centered_fft2, centered_ifft2
+from aspire.utils.fft import centered_fft2, centered_ifft2, centered_rfft2, centered_irfft2, rfftn, irfftn
 
 
 # TODO: The implementation of these functions should move directly inside the appropriate Image methods that call them.
@@ -27,18 +27,33 @@ def _im_translate(im, shifts):
     ensure(im.shape[0] == im.shape[1], "images must be square")
 
     L = im.shape[0]
-    im_f = fft2(im, axes=(0, 1))
+    real = np.isrealobj(im)
     grid_1d = ifftshift(np.ceil(np.arange(-L/2, L/2))) * 2 * np.pi / L
-    om_x, om_y = np.meshgrid(grid_1d, grid_1d, indexing='ij')
-
-    phase_shifts_x = np.broadcast_to(-shifts[:, 0], (L, L, n_shifts))
-    phase_shifts_y = np.broadcast_to(-shifts[:, 1], (L, L, n_shifts))
+    if real:
+        # Real images only need the non-negative frequencies along the second dimension
+        im_f = rfftn(im, axes=(0, 1))
+        om_x, om_y = np.meshgrid(grid_1d, np.arange(L//2 + 1) * 2 * np.pi / L, indexing='ij')
+    else:
+        im_f = fft2(im, axes=(0, 1))
+        om_x, om_y = np.meshgrid(grid_1d, grid_1d, indexing='ij')
+
+    phase_shifts_x = np.broadcast_to(-shifts[:, 0], om_x.shape + (n_shifts,))
+    phase_shifts_y = np.broadcast_to(-shifts[:, 1], om_y.shape + (n_shifts,))
     phase_shifts = (om_x[:, :, np.newaxis] * phase_shifts_x) + (om_y[:, :, np.newaxis] * phase_shifts_y)
 
     mult_f = np.exp(-1j * phase_shifts)
+    if real and L % 2 == 0:
+        # As for filters (see Filter.evaluate_grid), the Nyquist row -pi has no mirror image on the full grid, so the
+        # complex transform effectively averages the shifts at -pi and +pi there (except at the corner (-pi, -pi))
+        mult_mirror = np.exp(1j * (np.pi * shifts[:, 0] + om_y[L//2][:, np.newaxis] * shifts[:, 1]))
+        mult_f[L//2] = (mult_f[L//2] + mult_mirror) / 2
+        mult_f[L//2, -1] = mult_mirror[-1]
     im_translated_f = im_f * mult_f
-    im_translated = ifft2(im_translated_f, axes=(0, 1))
-    im_translated = np.real(im_translated)
+    if real:
+        im_translated = irfftn(im_translated_f, s=(L, L), axes=(0, 1))
+    else:
+        im_translated = ifft2(im_translated_f, axes=(0, 1))
+        im_translated = np.real(im_translated)
 
     return im_translated
 
@@ -162,15 +177,20 @@ class Image:
         :param filter: An object of type `Filter`.
         :return: A new filtered `Image` object.
         """
-        filter_values = filter.evaluate_grid(self.res)
+        # Real images only need (the Hermitian part of) the filter on the non-negative half of the frequency plane
+        real = np.isrealobj(self.data)
+        filter_values = filter.evaluate_grid(self.res, half=real)
 
-        im_f = centered_fft2(self.data)
+        im_f = centered_rfft2(self.data) if real else centered_fft2(self.data)
         if im_f.ndim > filter_values.ndim:
             im_f = np.expand_dims(filter_values, 2) * im_f
         else:
             im_f = filter_values * im_f
-        im = centered_ifft2(im_f)
-        im = np.real(im)
+        if real:
+            im = centered_irfft2(im_f, (self.res, self.res))
+        else:
+            im = centered_ifft2(im_f)
+            im = np.real(im)
 
         return Image(im)
 
@@ -1,4 +1,9 @@
+import os
+import copy
+import json
+import time
 import logging
+import hashlib
 from collections import OrderedDict
 import numpy as np
 from aspire import config
@@ -11,6 +16,15 @@ logger = logging.getLogger(__name__)
 backends = None
 # Default preferred Plan subclass
 default_plan_class = None
+# Cached Plan objects used by 'anufft3'/'nufft3', keyed by signal size, precision and a key of the Fourier points
+# (see 'points_key'), but not by the number of signals transformed together, which is set on each plan as it is used.
+# Ordered by last use (most recent last), so that the least recently used plan is evicted first.
+# Sized by the 'plan_cache_size' parameter in package configuration.
+plan_cache = OrderedDict()
+# Fastest backend for each problem class (see 'problem_class'), as measured by 'calibrate'.
+# Populated from the file given by the 'profile' parameter in package configuration when first needed,
+# and left as an empty dict if no such file exists.
+profile = None
 
 
 def check_backends(raise_errors=True):
@@ -31,6 +45,8 @@ def check_backends(raise_errors=True):
             'pynfft'
                 The Python wrapper for the Chemnitz NFFT library
                 https://www-user.tu-chemnitz.de/~potts/nfft/
+            'gridding'
+                A pure-NumPy Kaiser-Bessel gridding NUFFT, which is always available (but slower than the above)
         :return: The proper Plan-subclass if the backend is expected to work or None otherwise.
 
         It's important to keep these checks lightweight since all usable backend classes are cached on module load.
@@ -55,6 +71,10 @@ def check_backends(raise_errors=True):
             except ImportError:
                 pass
 
+        elif backend == "gridding":
+            from aspire.nfft.gridding import GriddingPlan
+            plan_class = GriddingPlan
+
         if plan_class is None:
             logger.info(f"NFFT backend {backend} not usable")
         else:
@@ -62,6 +82,8 @@ def check_backends(raise_errors=True):
             return plan_class
 
     backends = OrderedDict((k, _try_backend(k)) for k in config.nfft.backends)
+    # Any cached plans may belong to a backend that is no longer preferred
+    clear_plan_cache()
     try:
         default_backend = next(k for k, v in backends.items() if v is not None)
         logger.error(f'Selected NFFT backend = {default_backend}')
@@ -105,22 +127,220 @@ class Plan:
                 else:
                     raise RuntimeError('Requested backend unavailable')
             else:
-                # If a Plan was constructed as a generic Plan(), use the default (best) Plan class
+                # If a Plan was constructed as a generic Plan(), use the fastest Plan class for this problem
+                # if the backends have been calibrated, or the default (best) Plan class otherwise
                 if default_plan_class is None:
                     check_backends(raise_errors=True)
-                return super(Plan, cls).__new__(default_plan_class)
+                sz = kwargs.get('sz', args[0] if len(args) > 0 else None)
+                fourier_pts = kwargs.get('fourier_pts', args[1] if len(args) > 1 else None)
+                plan_class = default_plan_class
+                if sz is not None and fourier_pts is not None:
+                    plan_class = selected_plan_class(sz, np.size(fourier_pts) // len(sz))
+                return super(Plan, cls).__new__(plan_class)
         else:
             # If a Plan-subclass was constructed directly, invoke default behavior
             return super(Plan, cls).__new__(cls)
 
 
-def anufft3(vol_f, fourier_pts, sz, real=False):
-    plan = Plan(sz=sz, fourier_pts=fourier_pts)
+def problem_class(sz, num_pts):
+    """
+    Classify a NUFFT problem for the purpose of choosing a backend
+    :param sz: A tuple indicating the geometry of the signal
+    :param num_pts: The number of non-uniform points
+    :return: A string of the form '<dim>,<size class>,<points class>', where the size class is the signal size rounded
+        to the nearest power of 2, and the points class is the number of points rounded to the nearest power of 10.
+    """
+    size_class = int(np.round(np.log2(max(max(sz), 1))))
+    pts_class = int(np.round(np.log10(max(num_pts, 1))))
+    return f'{len(sz)},{size_class},{pts_class}'
+
+
+def load_profile(filepath=None):
+    """
+    Load a backend profile written by `calibrate`
+    :param filepath: Path to the profile. If None, the nfft.profile configuration value is used.
+    :return: On return, the global name 'profile' has been populated (with an empty dict if no profile was found).
+    """
+    global profile
+
+    filepath = os.path.expanduser(filepath or config.nfft.profile)
+    profile = {}
+    if os.path.exists(filepath):
+        with open(filepath) as f:
+            profile = json.load(f)['fastest']
+        logger.info(f'Loaded NFFT backend profile from {filepath}')
+
+
+def profiled_plan_class(sz, num_pts):
+    """
+    Determine the fastest available backend for a NUFFT problem, according to the calibrated backend profile
+    :param sz: A tuple indicating the geometry of the signal
+    :param num_pts: The number of non-uniform points
+    :return: A Plan subclass, or None if no usable profile entry exists for problems of this dimension.
+    """
+    if profile is None:
+        load_profile()
+
+    dim, size_class, pts_class = map(int, problem_class(sz, num_pts).split(','))
+    # Use the closest problem class of the same dimension that was calibrated with a backend that is still available
+    candidates = []
+    for key, backend in profile.items():
+        _dim, _size_class, _pts_class = map(int, key.split(','))
+        if _dim == dim and backends.get(backend) is not None:
+            candidates.append((abs(_size_class - size_class) + abs(_pts_class - pts_class), backend))
+    if not candidates:
+        return None
+    return backends[min(candidates)[1]]
+
+
+def selected_plan_class(sz, num_pts):
+    """
+    Determine the backend that a generic Plan for a NUFFT problem is constructed with
+    :param sz: A tuple indicating the geometry of the signal
+    :param num_pts: The number of non-uniform points
+    :return: The fastest Plan subclass for problems of this size if the backends have been calibrated (see
+        `profiled_plan_class`), or the default (best) Plan subclass otherwise.
+    """
+    if default_plan_class is None:
+        check_backends(raise_errors=True)
+    return profiled_plan_class(sz, num_pts) or default_plan_class
+
+
+def calibrate(shapes=None, epsilon=None, repeats=3, filepath=None):
+    """
+    Time all available backends on representative NUFFT problems and save the fastest backend for each problem class.
+    Once saved, generic Plan objects are constructed using the fastest backend for their problem class.
+    :param shapes: An iterable of (sz, num_pts) tuples to time. If None, a default set of 2D and 3D problems is used.
+    :param epsilon: The precision of the NUFFTs to time. If None, the nfft.epsilon configuration value is used.
+    :param repeats: The number of times each problem is timed; the fastest run is kept.
+    :param filepath: Path to save the profile to. If None, the nfft.profile configuration value is used.
+    :return: A dictionary mapping each problem class to a dictionary of timings (in seconds), indexed by backend.
+    """
+    if shapes is None:
+        shapes = [((L,) * dim, num_pts) for dim in (2, 3) for L in (16, 32, 64) for num_pts in (10**3, 10**4, 10**5)]
+    if backends is None:
+        check_backends(raise_errors=True)
+
+    timings = {}
+    for sz, num_pts in shapes:
+        sz = tuple(sz)
+        fourier_pts = np.random.uniform(-np.pi, np.pi, (len(sz), num_pts))
+        sig = np.random.randn(*sz)
+        sig_f = np.random.randn(num_pts) + 1j * np.random.randn(num_pts)
+
+        key = problem_class(sz, num_pts)
+        timings[key] = {}
+        for backend in all_backends():
+            elapsed = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                plan = Plan(sz, fourier_pts, epsilon=epsilon, backend=backend)
+                plan.transform(sig)
+                plan.adjoint(sig_f)
+                elapsed.append(time.perf_counter() - t0)
+            timings[key][backend] = min(elapsed)
+            logger.info(f'NFFT backend {backend} on size {sz} with {num_pts} points: {min(elapsed):.4f}s')
+
+    fastest = {key: min(t, key=t.get) for key, t in timings.items()}
+    filepath = os.path.expanduser(filepath or config.nfft.profile)
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    with open(filepath, 'w') as f:
+        json.dump({'timings': timings, 'fastest': fastest}, f, indent=2)
+    logger.info(f'Saved NFFT backend profile to {filepath}')
+
+    load_profile(filepath)
+    clear_plan_cache()
+    return timings
+
+
+def clear_plan_cache():
+    """
+    Discard all NUFFT plans cached by `cached_plan`
+    :return: On return, the global plan cache has been emptied.
+    """
+    plan_cache.clear()
+
+
+def points_key(fourier_pts):
+    """
+    Compute a key of an array of Fourier points, identifying its contents without holding on to it.
+    This hashes all the points, so callers which transform on the same points repeatedly may compute it once, and pass
+    it to `cached_plan` (or `anufft3`/`nufft3`) with the points.
+    :param fourier_pts: An ndarray of Fourier points
+    :return: A hashable tuple uniquely (up to hash collisions) identifying the shape, type and values of fourier_pts.
+    """
+    fourier_pts = np.ascontiguousarray(fourier_pts)
+    return fourier_pts.shape, fourier_pts.dtype.str, hashlib.sha1(fourier_pts).hexdigest()
+
+
+def cached_plan(sz, fourier_pts, epsilon=None, ntransf=1, pts_key=None):
+    """
+    Get a NUFFT Plan for the given geometry, reusing a previously constructed Plan if one is found in the cache.
+    This is intended for call sites that transform many signals on identical Fourier points (e.g. basis expansions),
+    so that the setup cost of a Plan is paid only once for all of them.
+    :param sz: A tuple indicating the geometry of the signal
+    :param fourier_pts: The points in Fourier space where the Fourier transform is to be calculated,
+        arranged as a dimension-by-K array.
+    :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
+    :param ntransf: The number of signals transformed together, stacked along a trailing dimension. Plans are cached
+        regardless of it, so that e.g. the last, smaller batch of a pass reuses the plan of the other batches.
+    :param pts_key: A key of the Fourier points, as computed by `points_key`. If None, it is computed from fourier_pts.
+    :return: A Plan object
+    """
+    if epsilon is None:
+        epsilon = config.nfft.epsilon
+    cache_size = config.nfft.plan_cache_size
+    if cache_size <= 0:
+        return Plan(sz=sz, fourier_pts=fourier_pts, epsilon=epsilon, ntransf=ntransf)
+
+    key = (tuple(sz), epsilon, points_key(fourier_pts) if pts_key is None else pts_key)
+    plan = plan_cache.pop(key, None)
+    if plan is None:
+        logger.debug(f'NUFFT plan cache miss for size {sz} and {fourier_pts.shape[-1]} points')
+        plan = Plan(sz=sz, fourier_pts=fourier_pts, epsilon=epsilon, ntransf=ntransf)
+
+    # (Re-)insert as the most recently used plan, evicting the least recently used ones if needed
+    plan_cache[key] = plan
+    while len(plan_cache) > cache_size:
+        plan_cache.popitem(last=False)
+
+    if plan.ntransf != ntransf:
+        # The number of signals only matters on execution, so the cached plan is shared through a shallow copy
+        plan = copy.copy(plan)
+        plan.ntransf = ntransf
+
+    return plan
+
+
+def anufft3(vol_f, fourier_pts, sz, real=False, epsilon=None, pts_key=None):
+    """
+    Compute the adjoint NUFFT of one or more signals given at non-uniform Fourier points
+    :param vol_f: An array of K values at the Fourier points, or a K-by-n array of n such signals.
+    :param fourier_pts: The points in Fourier space, arranged as a dimension-by-K array.
+    :param sz: A tuple indicating the geometry of the output signal
+    :param real: Whether to only return the real part of the result
+    :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
+    :param pts_key: A key of the Fourier points, as computed by `points_key` (see `cached_plan`).
+    :return: An array of shape `sz`, or `sz` + (n,) for a K-by-n array of signals.
+    """
+    ntransf = vol_f.shape[1] if vol_f.ndim == 2 else 1
+    plan = cached_plan(sz, fourier_pts, epsilon=epsilon, ntransf=ntransf, pts_key=pts_key)
     adjoint = plan.adjoint(vol_f)
     return np.real(adjoint) if real else adjoint
 
 
-def nufft3(vol_f, fourier_pts, sz, real=False):
-    plan = Plan(sz=sz, fourier_pts=fourier_pts)
+def nufft3(vol_f, fourier_pts, sz, real=False, epsilon=None, pts_key=None):
+    """
+    Compute the NUFFT of one or more signals at non-uniform Fourier points
+    :param vol_f: A signal of shape `sz`, or an array of shape `sz` + (n,) of n such signals.
+    :param fourier_pts: The points in Fourier space, arranged as a dimension-by-K array.
+    :param sz: A tuple indicating the geometry of the input signal
+    :param real: Whether to only return the real part of the result
+    :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
+    :param pts_key: A key of the Fourier points, as computed by `points_key` (see `cached_plan`).
+    :return: An array of K values at the Fourier points, or a K-by-n array for a stack of n signals.
+    """
+    ntransf = vol_f.shape[-1] if vol_f.ndim == len(sz) + 1 else 1
+    plan = cached_plan(sz, fourier_pts, epsilon=epsilon, ntransf=ntransf, pts_key=pts_key)
     transform = plan.transform(vol_f)
     return np.real(transform) if real else transform
@@ -1,33 +1,94 @@
 import numpy as np
 import finufftpy
+from aspire import config
 from aspire.nfft import Plan
 from aspire.utils import ensure
 
 
 class FINufftPlan(Plan):
-    def __init__(self, sz, fourier_pts, epsilon=1e-15, **kwargs):
+    def __init__(self, sz, fourier_pts, epsilon=None, ntransf=1, **kwargs):
         """
         A plan for non-uniform FFT (3D)
         :param sz: A tuple indicating the geometry of the signal
         :param fourier_pts: The points in Fourier space where the Fourier transform is to be calculated,
             arranged as a 3-by-K array. These need to be in the range [-pi, pi] in each dimension.
-        :param epsilon: The desired precision of the NUFFT
+        :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
+        :param ntransf: The number of signals transformed together, stacked along a trailing dimension.
         """
-        self.sz = sz
+        self.sz = tuple(sz)
         self.dim = len(sz)
         # TODO: Things get messed up unless we ensure a 'C' ordering here - investigate why
         self.fourier_pts = np.asarray(np.mod(fourier_pts + np.pi, 2 * np.pi) - np.pi, order='C')
         self.num_pts = fourier_pts.shape[1]
-        self.epsilon = epsilon
+        self.epsilon = config.nfft.epsilon if epsilon is None else epsilon
+        self.ntransf = ntransf
 
         # Get a handle on the appropriate 1d/2d/3d forward transform function in finufftpy
         self.transform_function = getattr(finufftpy, {1: 'nufft1d2', 2: 'nufft2d2', 3: 'nufft3d2'}[self.dim])
         # Get a handle on the appropriate 1d/2d/3d adjoint function in finufftpy
         self.adjoint_function = getattr(finufftpy, {1: 'nufft1d1', 2: 'nufft2d1', 3: 'nufft3d1'}[self.dim])
 
+    @property
+    def many(self):
+        # finufftpy only provides many-vector variants of the 2d transforms; other dimensions loop over signals.
+        # This is evaluated on execution, as `ntransf` may be changed on plans shared through `cached_plan`.
+        return self.ntransf > 1 and self.dim == 2
+
     def transform(self, signal):
-        ensure(signal.shape == self.sz, f'Signal to be transformed must have shape {self.sz}')
+        if self.ntransf == 1 and signal.ndim == self.dim:
+            ensure(signal.shape == self.sz, f'Signal to be transformed must have shape {self.sz}')
+            return self._transform(signal)
+
+        sz = self.sz + (self.ntransf,)
+        ensure(signal.shape == sz, f'Signals to be transformed must have shape {sz}')
+
+        if self.many:
+            epsilon = max(self.epsilon, np.finfo(signal.dtype).eps)
+            result = np.zeros((self.num_pts, self.ntransf), dtype='complex128', order='F')
+            result_code = finufftpy.nufft2d2many(
+                *self.fourier_pts,
+                result,
+                -1,
+                epsilon,
+                np.asarray(signal, dtype='complex128', order='F')
+            )
+            if result_code != 0:
+                raise RuntimeError(f'FINufft transform failed. Result code {result_code}')
+            return result
+
+        result = np.zeros((self.num_pts, self.ntransf), dtype='complex128')
+        for i in range(self.ntransf):
+            result[:, i] = self._transform(signal[..., i])
+        return result
 
+    def adjoint(self, signal):
+        if self.ntransf == 1 and signal.ndim == 1:
+            return self._adjoint(signal)
+
+        ensure(signal.shape == (self.num_pts, self.ntransf),
+               f'Signals to be transformed must have shape {(self.num_pts, self.ntransf)}')
+
+        if self.many:
+            epsilon = max(self.epsilon, np.finfo(signal.dtype).eps)
+            result = np.zeros(self.sz + (self.ntransf,), dtype='complex128', order='F')
+            result_code = finufftpy.nufft2d1many(
+                *self.fourier_pts,
+                np.asarray(signal, dtype='complex128', order='F'),
+                1,
+                epsilon,
+                *self.sz,
+                result
+            )
+            if result_code != 0:
+                raise RuntimeError(f'FINufft adjoint failed. Result code {result_code}')
+            return result
+
+        result = np.zeros(self.sz + (self.ntransf,), dtype='complex128', order='F')
+        for i in range(self.ntransf):
+            result[..., i] = self._adjoint(signal[:, i])
+        return result
+
+    def _transform(self, signal):
         epsilon = max(self.epsilon, np.finfo(signal.dtype).eps)
 
         # Forward transform functions in finufftpy have signatures of the form:
@@ -52,8 +113,7 @@ class FINufftPlan(Plan):
 
         return result
 
-    def adjoint(self, signal):
-
+    def _adjoint(self, signal):
         epsilon = max(self.epsilon, np.finfo(signal.dtype).eps)
 
         # Adjoint functions in finufftpy have signatures of the form:
@@ -0,0 +1,232 @@
+import logging
+import numpy as np
+from numpy.polynomial.legendre import leggauss
+from scipy.special import i0
+from scipy.sparse import csr_matrix
+
+from aspire import config
+from aspire.nfft import Plan
+from aspire.utils import ensure
+
+logger = logging.getLogger(__name__)
+
+
+class GriddingPlan(Plan):
+    """
+    A pure-NumPy non-uniform FFT using Kaiser-Bessel gridding.
+
+    Signals are pre-corrected (deapodized) for the gridding kernel, zero-padded onto a grid oversampled by a factor
+    `sigma` and Fourier transformed; values at the non-uniform points are then interpolated from that grid with a
+    separable Kaiser-Bessel kernel of width `W` grid points. The adjoint applies the transpose of each of these steps.
+    The interpolation is expressed as a sparse matrix, which is precomputed once per plan (as long as it is not too
+    large; see the nfft.gridding_max_nnz configuration value) and reused for all signals transformed with the plan.
+    """
+
+    # Oversampling factor of the fine grid
+    sigma = 2
+
+    def __init__(self, sz, fourier_pts, epsilon=None, ntransf=1, **kwargs):
+        """
+        A plan for non-uniform FFT (1D/2D/3D)
+        :param sz: A tuple indicating the geometry of the signal
+        :param fourier_pts: The points in Fourier space where the Fourier transform is to be calculated,
+            arranged as a dimension-by-K array. These need to be in the range [-pi, pi] in each dimension.
+        :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
+        :param ntransf: The number of signals transformed together, stacked along a trailing dimension.
+        """
+        self.sz = tuple(sz)
+        self.dim = len(sz)
+        ensure(self.dim in (1, 2, 3), 'Only 1D, 2D and 3D transforms are supported')
+        self.fourier_pts = np.mod(np.reshape(fourier_pts, (self.dim, -1)) + np.pi, 2 * np.pi) - np.pi
+        self.num_pts = self.fourier_pts.shape[1]
+        self.epsilon = config.nfft.epsilon if epsilon is None else epsilon
+        self.ntransf = ntransf
+
+        # Kernel width (in fine grid points) and shape parameter (Beatty et al., IEEE TMI 24 (6), 2005)
+        self.width = int(min(max(np.ceil(-np.log10(self.epsilon)) + 1, 2), 16))
+        self.beta = np.pi * np.sqrt((self.width / self.sigma * (self.sigma - 0.5)) ** 2 - 0.8)
+
+        self.fine_sz = tuple(int(self.sigma * n) for n in self.sz)
+        # Indices of the signal modes (-n//2 .. n - n//2 - 1) in the fine grid, in each dimension
+        self.mode_indices = [np.arange(-(n // 2), n - n // 2) % m for n, m in zip(self.sz, self.fine_sz)]
+        # Deapodization factors (inverse Fourier series coefficients of the kernel), in each dimension
+        self.deapodization = [1. / self._kernel_fourier_series(n, m) for n, m in zip(self.sz, self.fine_sz)]
+
+        # Split the points into chunks, so as to bound the memory needed to form each interpolation matrix
+        nnz_per_pt = self.width ** self.dim
+        chunk_size = max(1, config.nfft.gridding_max_nnz // (16 * nnz_per_pt))
+        self._chunks = [slice(i, min(i + chunk_size, self.num_pts)) for i in range(0, self.num_pts, chunk_size)]
+
+        if nnz_per_pt * self.num_pts <= config.nfft.gridding_max_nnz:
+            self._matrices = [self._interpolation_matrix(chunk) for chunk in self._chunks]
+        else:
+            logger.info(f'Gridding interpolation matrix too large to keep ({nnz_per_pt * self.num_pts} entries), '
+                        f'it will be recomputed for every transform')
+            self._matrices = None
+
+    def _kernel(self, x):
+        """
+        Evaluate the (unnormalized) Kaiser-Bessel kernel
+        :param x: An array of offsets, in units of fine grid points, in the range [-W/2, W/2].
+        :return: The kernel evaluated at x.
+        """
+        return i0(self.beta * np.sqrt(np.maximum(1 - (2 * x / self.width) ** 2, 0)))
+
+    def _kernel_fourier_series(self, n, m):
+        """
+        Evaluate the Fourier transform of the kernel at the signal modes, by Gauss-Legendre quadrature
+        :param n: The size of the signal along a dimension
+        :param m: The size of the fine grid along that dimension
+        :return: An array of n values, corresponding to modes -n//2 .. n - n//2 - 1.
+        """
+        nodes, weights = leggauss(2 * self.width + 16)
+        nodes, weights = nodes * self.width / 2, weights * self.width / 2
+        modes = np.arange(-(n // 2), n - n // 2)
+        return np.cos(2 * np.pi * np.outer(modes, nodes) / m) @ (weights * self._kernel(nodes))
+
+    def _interpolation_matrix(self, chunk):
+        """
+        Form the sparse matrix interpolating values on the fine grid at a subset of the Fourier points
+        :param chunk: A slice selecting the points
+        :return: A sparse (CSR) matrix of size num_chunk_pts-by-prod(fine_sz), acting on C-ordered fine grids.
+        """
+        pts = self.fourier_pts[:, chunk]
+        num_pts = pts.shape[1]
+        offsets = np.arange(self.width)
+
+        cols = np.zeros((num_pts,) + (1,) * self.dim, dtype=np.int64)
+        vals = np.ones((num_pts,) + (1,) * self.dim)
+        stride = 1
+        for d in reversed(range(self.dim)):
+            m = self.fine_sz[d]
+            # Position of each point on the fine grid and the W grid points closest to it
+            t = m * pts[d] / (2 * np.pi)
+            grid_pts = np.ceil(t - self.width / 2).astype(np.int64)[:, np.newaxis] + offsets
+
+            # Combine the one-dimensional indices and weights into the tensor-product stencil around each point
+            shape = [num_pts] + [1] * self.dim
+            shape[d + 1] = self.width
+            cols = cols + np.reshape((grid_pts % m) * stride, shape)
+            vals = vals * np.reshape(self._kernel(t[:, np.newaxis] - grid_pts), shape)
+            stride *= m
+
+        nnz_per_pt = self.width ** self.dim
+        return csr_matrix(
+            (vals.ravel(), cols.ravel(), np.arange(0, num_pts * nnz_per_pt + 1, nnz_per_pt)),
+            shape=(num_pts, stride)
+        )
+
+    def _matrix_chunks(self):
+        """
+        Iterate over the chunks of the interpolation matrix, forming them on the fly if they were not precomputed
+        :return: A generator of (slice, sparse matrix) pairs.
+        """
+        for i, chunk in enumerate(self._chunks):
+            yield chunk, self._matrices[i] if self._matrices is not None else self._interpolation_matrix(chunk)
+
+    def _deapodize(self, signal):
+        """
+        Multiply a (stack of) signal(s) by the separable deapodization factors
+        """
+        for d in range(self.dim):
+            shape = [1] * signal.ndim
+            shape[d] = self.sz[d]
+            signal = signal * np.reshape(self.deapodization[d], shape)
+        return signal
+
+    def transform(self, signal):
+        single = self.ntransf == 1 and signal.ndim == self.dim
+        result = self.interpolate(self.grid(signal))
+        return result[:, 0] if single else result
+
+    def grid(self, signal):
+        """
+        Deapodize signals and Fourier transform them on the fine grid, the first step of the transform
+        :param signal: An array of size sz, or sz-by-ntransf, of signals.
+        :return: An array of size prod(fine_sz)-by-ntransf. This only depends on the signal size and the precision
+            of the plan, and may be passed to the `interpolate` method of any plan with the same signal size and
+            precision (but possibly different points).
+        """
+        if self.ntransf == 1 and signal.ndim == self.dim:
+            ensure(signal.shape == self.sz, f'Signal to be transformed must have shape {self.sz}')
+            signal = signal[..., np.newaxis]
+        else:
+            sz = self.sz + (self.ntransf,)
+            ensure(signal.shape == sz, f'Signals to be transformed must have shape {sz}')
+        ntransf = signal.shape[-1]
+
+        fine = np.zeros(self.fine_sz + (ntransf,), dtype='complex128')
+        fine[np.ix_(*self.mode_indices, np.arange(ntransf))] = self._deapodize(signal)
+        fine = np.fft.fftn(fine, axes=tuple(range(self.dim)))
+        return np.reshape(fine, (-1, ntransf))
+
+    def interpolate(self, fine):
+        """
+        Interpolate Fourier transformed signals on the fine grid at the Fourier points, the last step of the transform
+        :param fine: An array of size prod(fine_sz)-by-ntransf, as returned by `grid`.
+        :return: An array of size K-by-ntransf.
+        """
+        result = np.zeros((self.num_pts, fine.shape[-1]), dtype='complex128')
+        for chunk, matrix in self._matrix_chunks():
+            result[chunk] = matrix @ fine
+        return result
+
+    def adjoint(self, signal):
+        single = self.ntransf == 1 and signal.ndim == 1
+        result = self.gather(self.spread(signal))
+        return result[..., 0] if single else result
+
+    def spread(self, signal, fine=None):
+        """
+        Spread signals at the Fourier points onto the fine grid, the first step of the adjoint transform
+        :param signal: An array of K values, or a K-by-ntransf array of signals, at the Fourier points.
+        :param fine: An array of size prod(fine_sz)-by-ntransf to accumulate the result into, as returned by an earlier
+            call to `spread` of a plan with the same signal size and precision (but possibly different points).
+            If None, a new array is allocated.
+        :return: The array `fine`, to which the spread signals have been added.
+        """
+        if signal.ndim == 1:
+            signal = signal[:, np.newaxis]
+        ensure(signal.shape == (self.num_pts, self.ntransf),
+               f'Signals to be transformed must have shape {(self.num_pts, self.ntransf)}')
+
+        if fine is None:
+            fine = np.zeros((np.prod(self.fine_sz), self.ntransf), dtype='complex128')
+        for chunk, matrix in self._matrix_chunks():
+            fine += matrix.T @ signal[chunk]
+
+        return fine
+
+    def spread_each(self, signal, n_groups):
+        """
+        Spread a signal at equally-sized groups of consecutive Fourier points onto a separate fine grid for each group,
+        so that transforming those grids with `gather` gives the adjoint transform of each group of points on its own
+        :param signal: An array of K values at the Fourier points.
+        :param n_groups: The number of groups, which must divide K.
+        :return: An array of size prod(fine_sz)-by-n_groups. This is dense (as is its transform by `gather`), so
+            callers should bound the number of groups per call (see `aspire.volume.im_backproject_each`).
+        """
+        ensure(signal.shape == (self.num_pts,), f'Signal to be transformed must have shape {(self.num_pts,)}')
+        ensure(self.num_pts % n_groups == 0, f'{self.num_pts} points cannot be split into {n_groups} groups')
+        groups = np.repeat(np.arange(n_groups), self.num_pts // n_groups)
+
+        fine = np.zeros((np.prod(self.fine_sz), n_groups), dtype='complex128')
+        for chunk, matrix in self._matrix_chunks():
+            # The signal of each group, as a column of an (otherwise zero) sparse matrix
+            num_pts = chunk.stop - chunk.start
+            signals = csr_matrix((signal[chunk], (np.arange(num_pts), groups[chunk])), shape=(num_pts, n_groups))
+            fine += (matrix.T @ signals).toarray()
+
+        return fine
+
+    def gather(self, fine):
+        """
+        Transform signals spread onto the fine grid back to the signal modes, the last step of the adjoint transform
+        :param fine: An array of size prod(fine_sz)-by-ntransf, as returned by `spread`.
+        :return: An array of size sz-by-ntransf.
+        """
+        ntransf = fine.shape[-1]
+        fine = np.reshape(fine, self.fine_sz + (ntransf,))
+        # The adjoint of the (unnormalized) forward FFT is an unnormalized inverse FFT
+        fine = np.fft.ifftn(fine, axes=tuple(range(self.dim))) * np.prod(self.fine_sz)
+        return self._deapodize(fine[np.ix_(*self.mode_indices, np.arange(ntransf))])
@@ -1,5 +1,6 @@
 import numpy as np
 from pynfft.nfft import NFFT
+from aspire import config
 from aspire.utils import ensure
 from aspire.nfft import Plan
 from aspire.nfft.utils import nextpow2
@@ -13,21 +14,23 @@ class PyNfftPlan(Plan):
         rel_errs = [6e-2, 2e-3, 2e-5, 2e-7, 3e-9, 4e-11, 4e-13, 0]
         return list(filter(lambda i_err: i_err[1] < epsilon, enumerate(rel_errs, start=1)))[0][0]
 
-    def __init__(self, sz, fourier_pts, epsilon=1e-15, **kwargs):
+    def __init__(self, sz, fourier_pts, epsilon=None, ntransf=1, **kwargs):
         """
         A plan for non-uniform FFT (3D)
         :param sz: A tuple indicating the geometry of the signal
         :param fourier_pts: The points in Fourier space where the Fourier transform is to be calculated,
             arranged as a 3-by-K array. These need to be in the range [-pi, pi] in each dimension.
-        :param epsilon: The desired precision of the NUFFT
+        :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
+        :param ntransf: The number of signals transformed together, stacked along a trailing dimension.
         """
-        self.sz = sz
+        self.sz = tuple(sz)
         self.dim = len(sz)
         self.fourier_pts = fourier_pts
         self.num_pts = fourier_pts.shape[1]
-        self.epsilon = epsilon
+        self.epsilon = config.nfft.epsilon if epsilon is None else epsilon
+        self.ntransf = ntransf
 
-        self.cutoff = PyNfftPlan.epsilon_to_nfft_cutoff(epsilon)
+        self.cutoff = PyNfftPlan.epsilon_to_nfft_cutoff(self.epsilon)
         self.multi_bandwith = tuple(2 * 2**nextpow2(self.sz))
         # TODO - no other flags used in the MATLAB code other than these 2 are supported by the PyNFFT wrapper
         self._flags = ('PRE_PHI_HUT', 'PRE_PSI')
@@ -44,8 +47,36 @@ class PyNfftPlan(Plan):
         self._plan.precompute()
 
     def transform(self, signal):
-        ensure(signal.shape == self.sz, f'Signal to be transformed must have shape {self.sz}')
+        if self.ntransf == 1 and signal.ndim == self.dim:
+            ensure(signal.shape == self.sz, f'Signal to be transformed must have shape {self.sz}')
+            return self._transform(signal)
 
+        sz = self.sz + (self.ntransf,)
+        ensure(signal.shape == sz, f'Signals to be transformed must have shape {sz}')
+
+        # PyNFFT has no many-vector interface, so we reuse the precomputed plan for each signal in turn
+        result = np.zeros((self.num_pts, self.ntransf), dtype='complex128')
+        for i in range(self.ntransf):
+            result[:, i] = self._transform(signal[..., i])
+        if signal.dtype == np.float32:
+            result = result.astype('complex64')
+        return result
+
+    def adjoint(self, signal):
+        if self.ntransf == 1 and signal.ndim == 1:
+            return self._adjoint(signal)
+
+        ensure(signal.shape == (self.num_pts, self.ntransf),
+               f'Signals to be transformed must have shape {(self.num_pts, self.ntransf)}')
+
+        result = np.zeros(self.sz + (self.ntransf,), dtype='complex128')
+        for i in range(self.ntransf):
+            result[..., i] = self._adjoint(signal[:, i])
+        if signal.dtype == np.float32:
+            result = result.astype('complex64')
+        return result
+
+    def _transform(self, signal):
         self._plan.f_hat = signal.astype('complex64')
         f = self._plan.trafo()
 
@@ -54,7 +85,7 @@ class PyNfftPlan(Plan):
 
         return f
 
-    def adjoint(self, signal):
+    def _adjoint(self, signal):
         self._plan.f = signal.astype('complex64')
         f_hat = self._plan.adjoint()
 
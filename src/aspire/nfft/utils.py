@@ -3,3 +3,52 @@ import numpy as np
 
 def nextpow2(x):
     return np.ceil(np.log2(np.array(x))).astype('int')
+
+
+def _nudft_factors(sz, fourier_pts, sign):
+    """
+    Compute the one-dimensional exponential factors of a direct non-uniform DFT, one for each dimension
+    :param sz: A tuple indicating the geometry of the signal
+    :param fourier_pts: The points in Fourier space, arranged as a dimension-by-K array.
+    :param sign: The sign of the exponent (-1 for the transform, +1 for the adjoint)
+    :return: A list of K-by-sz[d] arrays, one for each dimension d.
+    """
+    return [
+        np.exp(sign * 1j * np.outer(fourier_pts[d], np.arange(-(n // 2), n - n // 2)))
+        for d, n in enumerate(sz)
+    ]
+
+
+def _nudft_subscripts(dim):
+    signal_subscripts = 'abc'[:dim]
+    return ','.join('k' + s for s in signal_subscripts), signal_subscripts
+
+
+def nudft(sig, fourier_pts):
+    """
+    Compute the non-uniform DFT of a signal directly, without any approximation.
+    This is slow (O(N*K) for a signal of N elements and K points) and intended as a reference for NUFFT backends.
+    :param sig: A signal in 1, 2 or 3 dimensions, whose center (zero frequency) is at index N//2 in each dimension.
+    :param fourier_pts: The points in Fourier space where the Fourier transform is to be calculated,
+        arranged as a dimension-by-K array. These are in the range [-pi, pi] in each dimension.
+    :return: The K values of the Fourier transform of `sig` at `fourier_pts`, in the same convention as `Plan.transform`.
+    """
+    fourier_pts = np.reshape(fourier_pts, (sig.ndim, -1))
+    factors = _nudft_factors(sig.shape, fourier_pts, -1)
+    factor_subscripts, signal_subscripts = _nudft_subscripts(sig.ndim)
+    return np.einsum(f'{factor_subscripts},{signal_subscripts}->k', *factors, sig, optimize=True)
+
+
+def anudft(sig_f, fourier_pts, sz):
+    """
+    Compute the adjoint of the non-uniform DFT directly, without any approximation.
+    This is slow (O(N*K) for a signal of N elements and K points) and intended as a reference for NUFFT backends.
+    :param sig_f: An array of K values at `fourier_pts`.
+    :param fourier_pts: The points in Fourier space, arranged as a dimension-by-K array.
+    :param sz: A tuple indicating the geometry of the output signal
+    :return: An array of shape `sz`, in the same convention as `Plan.adjoint`.
+    """
+    fourier_pts = np.reshape(fourier_pts, (len(sz), -1))
+    factors = _nudft_factors(sz, fourier_pts, 1)
+    factor_subscripts, signal_subscripts = _nudft_subscripts(len(sz))
+    return np.einsum(f'k,{factor_subscripts}->{signal_subscripts}', sig_f, *factors, optimize=True)
@@ -5,7 +5,7 @@ import pandas as pd
 from scipy.spatial.transform import Rotation as R
 
 from aspire.image import Image
-from aspire.volume import im_backproject, vol_project
+from aspire.volume import im_backproject, im_backproject_each, vol_project
 from aspire.utils import ensure
 from aspire.utils.filters import MultiplicativeFilter, PowerFilter
 from aspire.utils.coor_trans import grid_2d
@@ -331,6 +331,40 @@ class ImageSource:
         logger.info(f'Loaded {len(indices)} images')
         return im
 
+    def shard(self, rank, world_size, strategy='contiguous'):
+        """
+        Get a lightweight view on the subset of images of this `ImageSource` that one of `world_size` workers should
+        process. The shards for ranks 0..world_size-1 are disjoint and together cover all images of this `ImageSource`.
+        :param rank: The 0-based index of the worker (shard) for which to return a view.
+        :param world_size: The total number of workers (shards).
+        :param strategy: How images are partitioned among workers. One of:
+            'contiguous'
+                Each worker gets a contiguous range of image indices, of (nearly) equal size.
+            'file'
+                Images are grouped by the `.mrcs` file they are stored in, and each worker gets whole files, so that
+                no two workers ever read the same file. Only applicable to sources with file information in their
+                metadata (e.g. a `RelionSource`).
+        :return: An `ImageSourceShard` object sharing metadata, filters and the generation pipeline with this
+            `ImageSource`.
+        """
+        ensure(0 <= rank < world_size, f'rank must be in the range [0, {world_size})')
+        ensure(strategy in ('contiguous', 'file'), f'Unsupported sharding strategy {strategy}')
+
+        if strategy == 'contiguous':
+            indices = np.array_split(np.arange(self.n), world_size)[rank]
+        else:
+            ensure(self.has_metadata('__mrc_filepath'), "'file' sharding requires '__mrc_filepath' in the metadata")
+            # Files are numbered in order of first appearance, and assigned in that order to ranks, so that the
+            # number of images per rank stays balanced (as far as the file sizes permit).
+            file_codes, _ = pd.factorize(self._metadata['__mrc_filepath'])
+            file_counts = np.bincount(file_codes)
+            file_midpoints = np.cumsum(file_counts) - file_counts / 2
+            file_ranks = np.minimum((file_midpoints * world_size / self.n).astype(int), world_size - 1)
+            indices = np.flatnonzero(file_ranks[file_codes] == rank)
+
+        logger.info(f'Shard {rank}/{world_size} ({strategy}) has {len(indices)} images')
+        return ImageSourceShard(self, indices)
+
     def downsample(self, L):
         ensure(L <= self.L, "Max desired resolution should be less than the current resolution")
         logger.info(f'Setting max. resolution of source = {L}')
@@ -368,34 +402,66 @@ class ImageSource:
         # Invalidate images
         self._im = None
 
-    def im_backward(self, im, start):
+    def im_backward(self, im, start, epsilon=None, backprojector=None):
         """
         Apply adjoint mapping to set of images
         :param im: An L-by-L-by-n array of images to which we wish to apply the adjoint of the forward model.
         :param start: Start index of image to consider
-        :return: An L-by-L-by-L volume containing the sum of the adjoint mappings applied to the start+num-1 images.
+        :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
+        :param backprojector: A `Backprojector` object. If specified, the backprojections of the images are added to
+            it (and epsilon is ignored), rather than computed here.
+        :return: An L-by-L-by-L volume containing the sum of the adjoint mappings applied to the start+num-1 images,
+            or None if a backprojector was given.
+        """
+        num = im.shape[-1]
+        im = self.im_backward_prepare(im, start)
+        if backprojector is not None:
+            backprojector.add(im, self.rots[start:start+num, :, :])
+            return None
+        vol = im_backproject(im, self.rots[start:start+num, :, :], epsilon=epsilon)
+
+        return vol
+
+    def im_backward_each(self, im, start, epsilon=None):
+        """
+        Apply adjoint mapping to each of a set of images, separately
+        :param im: An L-by-L-by-n array of images to which we wish to apply the adjoint of the forward model.
+        :param start: Start index of image to consider
+        :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
+        :return: An L-by-L-by-L-by-n array of volumes containing the adjoint mappings applied to each of the
+            start .. start+n-1 images.
+        """
+        num = im.shape[-1]
+        im = self.im_backward_prepare(im, start)
+        return im_backproject_each(im, self.rots[start:start+num, :, :], epsilon=epsilon)
+
+    def im_backward_prepare(self, im, start):
+        """
+        Apply the adjoint of the steps of the forward model that follow projection (multiplication by the amplitudes,
+        translation and filtering) to a set of images, leaving only the backprojection of `im_backward`
+        :param im: An L-by-L-by-n `Image` object.
+        :param start: Start index of image to consider
+        :return: An L-by-L-by-n array of images, to be backprojected along the rotations of images start .. start+n-1.
         """
         num = im.shape[-1]
 
         all_idx = np.arange(start, min(start + num, self.n))
         im *= np.broadcast_to(self.amplitudes[all_idx], (self.L, self.L, len(all_idx)))
         im = im.shift(-self.offsets[all_idx, :])
-        im = self.eval_filters(im, start=start, num=num).asnumpy()
-        vol = im_backproject(im, self.rots[start:start+num, :, :])
+        return self.eval_filters(im, start=start, num=num).asnumpy()
 
-        return vol
-
-    def vol_forward(self, vol, start, num):
+    def vol_forward(self, vol, start, num, epsilon=None):
         """
         Apply forward image model to volume
         :param vol: A volume of size L-by-L-by-L.
         :param start: Start index of image to consider
         :param num: Number of images to consider
+        :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
         :return: The images obtained from volume by projecting, applying CTFs, translating, and multiplying by the
             amplitude.
         """
         all_idx = np.arange(start, min(start + num, self.n))
-        im = vol_project(vol, self.rots[all_idx, :, :])
+        im = vol_project(vol, self.rots[all_idx, :, :], epsilon=epsilon)
         im = self.eval_filters(im, start, num)
         im = Image(im).shift(self.offsets[all_idx, :])
         im *= np.broadcast_to(self.amplitudes[all_idx], (self.L, self.L, len(all_idx)))
@@ -434,3 +500,111 @@ class ArrayImageSource(ImageSource):
         if indices is None:
             indices = np.arange(start, min(start + num, self.n))
         return self._im[indices]
+
+
+class ImageSourceShard(ImageSource):
+    """
+    A lightweight view on a subset of the images of a parent `ImageSource`, typically obtained through the `shard`
+    method of the parent. Image index `i` of the shard corresponds to image index `indices[i]` of the parent.
+
+    Metadata (and hence filters, offsets, rotations etc.), cached images and the generation pipeline are not copied,
+    but read from (and written to) the parent `ImageSource`. Images are generated by the parent, so a shard of a
+    `RelionSource` only ever reads the `.mrcs` files referenced by its own images.
+    """
+    def __init__(self, src, indices):
+        """
+        Initialize a view on a parent `ImageSource`
+        :param src: The parent `ImageSource` object
+        :param indices: A numpy array of 0-based indices of images of the parent `ImageSource` in this view
+        """
+        indices = np.asarray(indices, dtype=int)
+        ensure(indices.ndim == 1, 'indices must be a 1D array')
+        ensure(len(indices) == 0 or (indices.min() >= 0 and indices.max() < src.n), 'indices out of range')
+
+        self.src = src
+        self.indices = indices
+        self.n = len(indices)
+
+        # The private attribute '_im' can be cached by calling this object's cache() method explicitly
+        self._im = None
+
+    def __str__(self):
+        return f'Shard of {len(self.indices)} images of {self.src}'
+
+    @property
+    def L(self):
+        return self.src.L
+
+    @property
+    def dtype(self):
+        return self.src.dtype
+
+    @property
+    def generation_pipeline(self):
+        return self.src.generation_pipeline
+
+    @property
+    def _metadata(self):
+        """
+        :return: A (copied) Dataframe of the metadata of the images in this shard, indexed by local image indices.
+        """
+        return self.src._metadata.iloc[self.indices].reset_index(drop=True)
+
+    @property
+    def _rotations(self):
+        return self.src._rotations[self.indices]
+
+    @_rotations.setter
+    def _rotations(self, value):
+        quats = self.src._rotations.as_quat()
+        quats[self.indices] = value.as_quat()
+        self.src._rotations = R.from_quat(quats)
+
+    def _parent_indices(self, indices=None):
+        """
+        Map 0-based image indices of this shard to 0-based image indices of the parent `ImageSource`
+        :param indices: A numpy array of image indices of this shard. If None, all images of this shard are considered.
+        :return: A numpy array of image indices of the parent `ImageSource`.
+        """
+        if indices is None:
+            return self.indices
+        return self.indices[indices]
+
+    def set_metadata(self, metadata_fields, values, indices=None):
+        self.src.set_metadata(metadata_fields, values, indices=self._parent_indices(indices))
+
+    def has_metadata(self, metadata_fields):
+        return self.src.has_metadata(metadata_fields)
+
+    def get_metadata(self, metadata_fields, indices=None, default_value=None):
+        return self.src.get_metadata(metadata_fields, indices=self._parent_indices(indices),
+                                     default_value=default_value)
+
+    def _images(self, start=0, num=np.inf, indices=None, *args, **kwargs):
+        if indices is None:
+            indices = np.arange(start, min(start + num, self.n))
+        return self.src._images(indices=self._parent_indices(indices), *args, **kwargs)
+
+    def images(self, start, num, *args, **kwargs):
+        indices = np.arange(start, min(start + num, self.n))
+        parent_indices = self._parent_indices(indices)
+
+        if self._im is not None:
+            logger.info(f'Loading images from cache')
+            im = Image(self._im[:, :, indices])
+        elif self.src._im is not None:
+            logger.info(f'Loading images from parent cache')
+            im = Image(self.src._im[:, :, parent_indices])
+        else:
+            # Xforms in the shared generation pipeline are indexed by the image indices of the parent.
+            im = self.src._images(indices=parent_indices, *args, **kwargs)
+            im = self.generation_pipeline.forward(im, indices=parent_indices)
+
+        logger.info(f'Loaded {len(indices)} images')
+        return im
+
+    def downsample(self, L):
+        raise NotImplementedError('Shards share the generation pipeline of their parent - downsample the parent.')
+
+    def whiten(self, noise_filter):
+        raise NotImplementedError('Shards share the generation pipeline of their parent - whiten the parent.')
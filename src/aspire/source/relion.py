@@ -5,9 +5,9 @@ import pandas as pd
 import numpy as np
 import mrcfile
 from concurrent import futures
-from multiprocessing import cpu_count
 
 from aspire.utils import ensure
+from aspire.utils.threads import io_threads, share_cores
 from aspire.source import ImageSource
 from aspire.image import Image
 from aspire.io.starfile import StarFile
@@ -54,7 +54,8 @@ class RelionSource(ImageSource):
             If None, the folder corresponding to filepath is used.
         :param pixel_size: the pixel size of the images in angstroms (Default 1)
         :param B: the envelope decay of the CTF in inverse square angstrom (Default 0)
-        :param n_workers: Number of threads to spawn to read referenced .mrcs files (Default -1 to auto detect)
+        :param n_workers: Number of threads to spawn to read referenced .mrcs files (Default -1 to use the
+            number of I/O threads in the thread budget, see aspire.utils.threads)
         :param max_rows: Maximum number of rows in STAR file to read. If None, all rows are read.
             Note that this refers to the max number of images to load, not the max. number of .mrcs files (which may be
             equal to or less than the number of images).
@@ -137,35 +138,35 @@ class RelionSource(ImageSource):
     def _images(self, start=0, num=np.inf, indices=None):
         if indices is None:
             indices = np.arange(start, min(start + num, self.n))
-        else:
-            start = indices.min()
         logger.info(f'Loading {len(indices)} images from STAR file')
 
         def load_single_mrcs(filepath, df):
             arr = mrcfile.open(filepath).data
             data = arr[df['__mrc_index'] - 1, :, :].T
 
-            return df.index, data
+            return df['__position'].values, data
 
         n_workers = self.n_workers
         if n_workers < 0:
-            n_workers = cpu_count() - 1
+            n_workers = io_threads()
 
         df = self._metadata.loc[indices]
+        # Position of each image in the returned stack - indices need not be contiguous (e.g. for shards of this source)
+        df = df.assign(**{'__position': np.arange(len(indices))})
         im = np.empty((self._original_resolution, self._original_resolution, len(indices)))
 
         groups = df.groupby('__mrc_filepath')
         n_workers = min(n_workers, len(groups))
 
-        with futures.ThreadPoolExecutor(n_workers) as executor:
+        with share_cores(n_workers), futures.ThreadPoolExecutor(n_workers) as executor:
             to_do = []
             for filepath, _df in groups:
                 future = executor.submit(load_single_mrcs, filepath, _df)
                 to_do.append(future)
 
             for future in futures.as_completed(to_do):
-                data_indices, data = future.result()
-                im[:, :, data_indices-start] = data
+                positions, data = future.result()
+                im[:, :, positions] = data
 
         logger.info(f'Loading {len(indices)} images complete')
 
@@ -119,17 +119,12 @@ class Simulation(ImageSource):
         if indices is None:
             indices = np.arange(start, min(start+num, self.n))
 
-        im = np.zeros((self.L, self.L, len(indices)))
+        # Project each of the states present along the rotations of its own images, remembering that `states` is
+        # 1-indexed
+        unique_states, state_indices = np.unique(self.states[indices], return_inverse=True)
+        vols = self.vols[:, :, :, unique_states - 1]
+        im = vol_project(vols, self.rots[indices, :, :], state_indices=state_indices)
 
-        states = self.states[indices]
-        unique_states = np.unique(states)
-        for k in unique_states:
-            vol_k = self.vols[:, :, :, k-1]
-            idx_k = np.where(states == k)[0]
-            rot = self.rots[indices[idx_k], :, :]
-
-            im_k = vol_project(vol_k, rot)
-            im[:, :, idx_k] = im_k
         return Image(im)
 
     def clean_images(self, start=0, num=np.inf, indices=None):
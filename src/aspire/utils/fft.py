@@ -1,8 +1,267 @@
 """
 FFT/IFFT utilities
 """
+import os
+import atexit
+import pickle
+import logging
+from functools import lru_cache
+
+import numpy as np
+from scipy.fftpack import ifftshift, fftshift
+
+from aspire import config
+from aspire.utils.threads import transform_threads
+
+logger = logging.getLogger(__name__)
+
+
+class NumpyFFT:
+    """
+    FFTs using numpy.fft
+    """
+    def fftn(self, x, axes=None):
+        return np.fft.fftn(x, axes=axes)
+
+    def ifftn(self, x, axes=None):
+        return np.fft.ifftn(x, axes=axes)
+
+    def rfftn(self, x, s=None, axes=None):
+        return np.fft.rfftn(x, s=s, axes=axes)
+
+    def irfftn(self, x, s=None, axes=None):
+        return np.fft.irfftn(x, s=s, axes=axes)
+
+
+class ScipyFFT:
+    """
+    FFTs using scipy.fft, multithreaded over the transform budget (see aspire.utils.threads), if available,
+    or the single-threaded scipy.fftpack otherwise.
+    """
+    def __init__(self):
+        try:
+            import scipy.fft
+            self._fft = scipy.fft
+        except ImportError:
+            import scipy.fftpack
+            self._fft = None
+            self._fftpack = scipy.fftpack
+            # scipy.fftpack has no multidimensional real transforms
+            self._numpy_fft = NumpyFFT()
+
+    def fftn(self, x, axes=None):
+        if self._fft is None:
+            return self._fftpack.fftn(x, axes=axes)
+        return self._fft.fftn(x, axes=axes, workers=transform_threads())
+
+    def ifftn(self, x, axes=None):
+        if self._fft is None:
+            return self._fftpack.ifftn(x, axes=axes)
+        return self._fft.ifftn(x, axes=axes, workers=transform_threads())
+
+    def rfftn(self, x, s=None, axes=None):
+        if self._fft is None:
+            return self._numpy_fft.rfftn(x, s=s, axes=axes)
+        return self._fft.rfftn(x, s=s, axes=axes, workers=transform_threads())
+
+    def irfftn(self, x, s=None, axes=None):
+        if self._fft is None:
+            return self._numpy_fft.irfftn(x, s=s, axes=axes)
+        return self._fft.irfftn(x, s=s, axes=axes, workers=transform_threads())
+
+
+class PyfftwFFT:
+    """
+    FFTs using the pyfftw interfaces, with plans cached across calls and FFTW wisdom persisted to the file given by
+    the 'pyfftw_wisdom' parameter in the 'fft' section of package configuration. Wisdom is only persisted if that
+    parameter is set, as it is not by default.
+    """
+    def __init__(self):
+        import pyfftw
+        import pyfftw.interfaces.numpy_fft
+        self._pyfftw = pyfftw
+        self._fft = pyfftw.interfaces.numpy_fft
+
+        pyfftw.interfaces.cache.enable()
+        pyfftw.interfaces.cache.set_keepalive_time(config.fft.pyfftw_keepalive)
+
+        self.wisdom_filepath = os.path.expanduser(config.fft.pyfftw_wisdom) if config.fft.pyfftw_wisdom else None
+        self.load_wisdom()
+
+    def load_wisdom(self):
+        """
+        Import FFTW wisdom from the configured wisdom file, if one is configured and exists
+        """
+        if self.wisdom_filepath and os.path.exists(self.wisdom_filepath):
+            try:
+                with open(self.wisdom_filepath, 'rb') as f:
+                    self._pyfftw.import_wisdom(pickle.load(f))
+                logger.info(f'Loaded FFTW wisdom from {self.wisdom_filepath}')
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                logger.warning(f'Unable to load FFTW wisdom from {self.wisdom_filepath}: {e}')
+
+    def save_wisdom(self):
+        """
+        Export the FFTW wisdom accumulated so far to the configured wisdom file, if one is configured
+        """
+        if not self.wisdom_filepath:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.wisdom_filepath)), exist_ok=True)
+            with open(self.wisdom_filepath, 'wb') as f:
+                pickle.dump(self._pyfftw.export_wisdom(), f)
+        except OSError as e:
+            logger.warning(f'Unable to save FFTW wisdom to {self.wisdom_filepath}: {e}')
+
+    def fftn(self, x, axes=None):
+        return self._fft.fftn(x, axes=axes, threads=transform_threads(),
+                              planner_effort=config.fft.pyfftw_planner_effort)
+
+    def ifftn(self, x, axes=None):
+        return self._fft.ifftn(x, axes=axes, threads=transform_threads(),
+                               planner_effort=config.fft.pyfftw_planner_effort)
+
+    def rfftn(self, x, s=None, axes=None):
+        return self._fft.rfftn(x, s=s, axes=axes, threads=transform_threads(),
+                               planner_effort=config.fft.pyfftw_planner_effort)
+
+    def irfftn(self, x, s=None, axes=None):
+        return self._fft.irfftn(x, s=s, axes=axes, threads=transform_threads(),
+                                planner_effort=config.fft.pyfftw_planner_effort)
+
+
+# Instantiated FFT backends, indexed by name
+_backends = {}
+_backend_classes = {'numpy': NumpyFFT, 'scipy': ScipyFFT, 'pyfftw': PyfftwFFT}
+
+
+def fft_backend(name=None):
+    """
+    Get an FFT backend object
+    :param name: One of 'numpy', 'scipy' or 'pyfftw'. If None, the 'backend' parameter in the 'fft' section of
+        package configuration is used.
+    :return: An object with `fftn(x, axes)`, `ifftn(x, axes)`, `rfftn(x, s, axes)` and `irfftn(x, s, axes)` methods.
+    """
+    name = name or config.fft.backend
+    if name not in _backends:
+        backend = _backends[name] = _backend_classes[name]()
+        if isinstance(backend, PyfftwFFT) and backend.wisdom_filepath:
+            # Persist any wisdom gathered by the shared backend for future sessions
+            atexit.register(backend.save_wisdom)
+    return _backends[name]
+
+
+def fftn(x, axes=None):
+    """
+    Calculate the (non-centered) n-dimensional FFT using the configured FFT backend
+    :param x: The signal to be transformed.
+    :param axes: The axes over which to transform. If None, all axes are transformed.
+    :return: The Fourier transform of x.
+    """
+    return fft_backend().fftn(x, axes=axes)
+
+
+def ifftn(x, axes=None):
+    """
+    Calculate the (non-centered) n-dimensional inverse FFT using the configured FFT backend
+    :param x: The signal to be transformed.
+    :param axes: The axes over which to transform. If None, all axes are transformed.
+    :return: The inverse Fourier transform of x.
+    """
+    return fft_backend().ifftn(x, axes=axes)
+
+
+def rfftn(x, s=None, axes=None):
+    """
+    Calculate the (non-centered) n-dimensional FFT of a real signal using the configured FFT backend
+    :param x: The real signal to be transformed.
+    :param s: The shape of the signal along the transformed axes, zero-padding or cropping x as needed.
+    :param axes: The axes over which to transform. If None, all axes are transformed.
+    :return: The non-negative frequency half of the Fourier transform of x along the last of `axes`.
+    """
+    return fft_backend().rfftn(x, s=s, axes=axes)
+
+
+def irfftn(x, s=None, axes=None):
+    """
+    Calculate the (non-centered) n-dimensional inverse FFT of a Hermitian spectrum using the configured FFT backend
+    :param x: The non-negative frequency half of the spectrum along the last of `axes`, as returned by `rfftn`.
+    :param s: The shape of the real output along the transformed axes. This should be given, since the length of the
+        last transformed axis cannot be inferred from x.
+    :param axes: The axes over which to transform. If None, all axes are transformed.
+    :return: The real inverse Fourier transform of x.
+    """
+    return fft_backend().irfftn(x, s=s, axes=axes)
+
+
+def fftn_real(x):
+    """
+    Calculate the full n-dimensional FFT of a real signal, using a real-to-complex FFT and Hermitian symmetry
+    :param x: The real signal to be transformed.
+    :return: The Fourier transform of x over all its axes, as an array of the same shape.
+    """
+    n = x.shape[-1]
+    half = rfftn(x)
+    x_f = np.empty(x.shape, dtype=half.dtype)
+    x_f[..., :half.shape[-1]] = half
+    # Negative frequencies along the last axis are the conjugate of the positive frequencies at the opposite point
+    opposite = np.ix_(*[(-np.arange(m)) % m for m in x.shape[:-1]], n - np.arange(half.shape[-1], n))
+    x_f[..., half.shape[-1]:] = np.conj(half[opposite])
+    return x_f
+
+
+@lru_cache(maxsize=32)
+def _centering_phases(sz, sign):
+    """
+    Compute the phase modulations that center an FFT, in place of shifting the signal before and after it.
+    Writing c = N // 2, we have that fftshift(fft(ifftshift(x)))[k] = a[k] * fft(b * x)[k], where
+    b[n] = exp(2*pi*i*c*n/N) and a[k] = exp(-2*pi*i*c^2/N) * b[k] (conjugated for the inverse FFT).
+    For even N, these reduce to the real 'checkerboard' b[n] = (-1)^n and a[k] = (-1)^(N/2) * (-1)^k.
+    :param sz: A tuple of the sizes of the transformed axes
+    :param sign: +1 for the forward FFT, -1 for the inverse FFT
+    :return: A tuple (b, a) of arrays of shape `sz`, the phase modulations applied before and after the FFT.
+    """
+    before = np.ones(1)
+    after = np.ones(1)
+    for n in sz:
+        c = n // 2
+        if n % 2 == 0:
+            b = (-1.) ** np.arange(n)
+            a = (-1.) ** c * b
+        else:
+            b = np.exp(sign * 2j * np.pi * c * np.arange(n) / n)
+            a = np.exp(-sign * 2j * np.pi * c * c / n) * b
+        before = np.multiply.outer(before, b)
+        after = np.multiply.outer(after, a)
+    return before.reshape(sz), after.reshape(sz)
+
+
+def _centered(x, axes, inverse):
+    """
+    Calculate a centered FFT over leading axes by phase modulation, without copying shifted versions of the signal
+    :param x: The signal to be transformed.
+    :param axes: The leading axes (0, 1, ..., d-1) over which to transform.
+    :param inverse: Whether to calculate the inverse FFT.
+    :return: The centered (inverse) Fourier transform of x.
+    """
+    x = np.asarray(x)
+    sz = x.shape[:len(axes)]
+    before, after = _centering_phases(sz, -1 if inverse else 1)
+    # Broadcast the phases over any trailing (stack) dimensions
+    extra_dims = (1,) * (x.ndim - len(axes))
+    before = before.reshape(sz + extra_dims)
+    after = after.reshape(sz + extra_dims)
+
+    if before.dtype.kind != 'c' and x.dtype.kind == 'f':
+        # A real checkerboard keeps real signals real (and in their own precision)
+        x = x * before.astype(x.dtype, copy=False)
+    else:
+        x = x * before.astype(np.result_type(x.dtype, np.complex64), copy=False)
+
+    x = ifftn(x, axes=axes) if inverse else fftn(x, axes=axes)
+    x *= after.astype(x.dtype, copy=False)
+    return x
 
-from scipy.fftpack import ifftshift, ifft, ifft2, fftshift, fft, fft2, ifftn, fftn
 
 def centered_ifft1(x):
     """
@@ -11,17 +270,12 @@ def centered_ifft1(x):
         The inverse FFT is only applied along the first dimension.
     :return: The centered inverse Fourier transform of x.
     """
-    x = ifftshift(x, 0)
-    x = ifft(x, axes=0)
-    x = fftshift(x, 0)
-    return x
+    return _centered(x, (0,), inverse=True)
 
 
 def centered_fft1(x):
-    x = ifftshift(x, 0)
-    x = fft(x, axes=0)
-    x = fftshift(x, 0)
-    return x
+    return _centered(x, (0,), inverse=False)
+
 
 def centered_ifft2(x):
     """
@@ -30,17 +284,12 @@ def centered_ifft2(x):
         The inverse FFT is only applied along the first two dimensions.
     :return: The centered inverse Fourier transform of x.
     """
-    x = ifftshift(ifftshift(x, 0), 1)
-    x = ifft2(x, axes=(0, 1))
-    x = fftshift(fftshift(x, 0), 1)
-    return x
+    return _centered(x, (0, 1), inverse=True)
 
 
 def centered_fft2(x):
-    x = ifftshift(ifftshift(x, 0), 1)
-    x = fft2(x, axes=(0, 1))
-    x = fftshift(fftshift(x, 0), 1)
-    return x
+    return _centered(x, (0, 1), inverse=False)
+
 
 def centered_ifft3(x):
     """
@@ -49,17 +298,111 @@ def centered_ifft3(x):
         The inverse FFT is only applied along the first three dimensions.
     :return: The centered inverse Fourier transform of x.
     """
-    x = ifftshift(ifftshift(ifftshift(x, 0), 1), 2)
-    x = ifftn(x, axes=(0, 1, 2))
-    x = fftshift(fftshift(fftshift(x, 0), 1), 2)
-    return x
+    return _centered(x, (0, 1, 2), inverse=True)
 
 
 def centered_fft3(x):
-    x = ifftshift(ifftshift(ifftshift(x, 0), 1), 2)
-    x = fftn(x, axes=(0, 1, 2))
-    x = fftshift(fftshift(fftshift(x, 0), 1), 2)
-    return x
+    return _centered(x, (0, 1, 2), inverse=False)
+
+
+@lru_cache(maxsize=32)
+def _real_centering_phases(n, half):
+    """
+    Compute the phase modulation that centers the (non-centered) FFT of a real signal along one axis.
+    Writing c = n // 2, we have that fft(ifftshift(x))[k] = exp(2*pi*i*c*k/n) * fft(x)[k].
+    :param n: The size of the transformed axis
+    :param half: Whether the axis holds the non-negative frequencies 0 .. n//2 only, as for the last axis of `rfftn`.
+    :return: A one-dimensional array of phases, indexed in the (non-centered) output order of the FFT.
+    """
+    k = np.arange(n // 2 + 1) if half else np.fft.fftfreq(n, 1. / n)
+    return np.exp(2j * np.pi * (n // 2) * k / n)
+
+
+def _phase_shape(ndim, axis, n):
+    shape = [1] * ndim
+    shape[axis] = n
+    return shape
+
+
+def _centered_real(x, ndim):
+    """
+    Calculate a centered FFT of a real signal over its leading axes, keeping only half of the spectrum
+    :param x: The real signal to be transformed.
+    :param ndim: The number of leading axes (0, 1, ..., ndim-1) over which to transform.
+    :return: The centered Fourier transform of x, restricted to non-negative frequencies along axis ndim-1.
+        Along axes 0 .. ndim-2, index i corresponds to frequency i - n//2 (as for `centered_fft2` etc.), while along
+        axis ndim-1, index j corresponds to frequency j, for j = 0 .. n//2.
+    """
+    x = np.asarray(x)
+    axes = tuple(range(ndim))
+    x_f = rfftn(x, axes=axes)
+    for d in axes:
+        phases = _real_centering_phases(x.shape[d], d == ndim - 1)
+        x_f *= np.reshape(phases, _phase_shape(x_f.ndim, d, len(phases))).astype(x_f.dtype, copy=False)
+    return np.fft.fftshift(x_f, axes=axes[:-1])
+
+
+def _centered_real_inverse(x_f, sz):
+    """
+    Calculate a centered inverse FFT of a half spectrum, as returned by `_centered_real`, yielding a real signal
+    :param x_f: The half spectrum to be transformed.
+    :param sz: A tuple of the sizes of the real signal along the transformed (leading) axes.
+    :return: The real centered inverse Fourier transform of x_f.
+    """
+    sz = tuple(sz)
+    axes = tuple(range(len(sz)))
+    x_f = np.fft.ifftshift(x_f, axes=axes[:-1])
+    for d in axes:
+        phases = np.conj(_real_centering_phases(sz[d], d == len(sz) - 1))
+        x_f = x_f * np.reshape(phases, _phase_shape(x_f.ndim, d, len(phases))).astype(x_f.dtype, copy=False)
+    return irfftn(x_f, s=sz, axes=axes)
+
+
+def centered_rfft2(x):
+    """
+    Calculate a centered, two-dimensional FFT of a real signal, keeping only the non-negative frequencies along the
+    second dimension
+    :param x: The real two-dimensional signal to be transformed.
+        The FFT is only applied along the first two dimensions.
+    :return: An array of size L1-by-(L2//2+1) (by any trailing dimensions of x), holding the entries of
+        `centered_fft2(x)` for frequencies 0 .. L2//2 along the second dimension. For even L2, the last of these is
+        the Nyquist frequency, found at index 0 (frequency -L2/2) in `centered_fft2(x)`.
+    """
+    return _centered_real(x, 2)
+
+
+def centered_irfft2(x, sz):
+    """
+    Calculate a centered, two-dimensional inverse FFT of a Hermitian-symmetric spectrum, as returned by
+    `centered_rfft2`
+    :param x: The non-negative frequency half of the spectrum along the second dimension.
+    :param sz: A tuple (L1, L2) giving the size of the real signal.
+    :return: The real centered inverse Fourier transform of x.
+    """
+    return _centered_real_inverse(x, sz)
+
+
+def centered_rfft3(x):
+    """
+    Calculate a centered, three-dimensional FFT of a real signal, keeping only the non-negative frequencies along the
+    third dimension
+    :param x: The real three-dimensional signal to be transformed.
+        The FFT is only applied along the first three dimensions.
+    :return: An array of size L1-by-L2-by-(L3//2+1) (by any trailing dimensions of x), holding the entries of
+        `centered_fft3(x)` for frequencies 0 .. L3//2 along the third dimension.
+    """
+    return _centered_real(x, 3)
+
+
+def centered_irfft3(x, sz):
+    """
+    Calculate a centered, three-dimensional inverse FFT of a Hermitian-symmetric spectrum, as returned by
+    `centered_rfft3`
+    :param x: The non-negative frequency half of the spectrum along the third dimension.
+    :param sz: A tuple (L1, L2, L3) giving the size of the real signal.
+    :return: The real centered inverse Fourier transform of x.
+    """
+    return _centered_real_inverse(x, sz)
 
 
 def mdim_ifftshift(x, dims=None):
@@ -62,12 +62,30 @@ class Filter:
         """
         raise NotImplementedError('Subclasses should implement this method')
 
-    def evaluate_grid(self, L, *args, **kwargs):
+    def evaluate_grid(self, L, *args, half=False, **kwargs):
+        """
+        Evaluate the filter on a centered L-by-L grid of frequencies.
+        :param L: The size of the grid.
+        :param half: If True, return the values needed to filter real images, on an L-by-(L//2+1) grid of the
+            non-negative frequencies along the second dimension, laid out as the output of `centered_rfft2`.
+            Filtering a real image (and keeping the real part of the result, see `Image.filter`) only applies the
+            Hermitian part (h(omega) + conj(h(-omega))) / 2 of the filter, so that is what is returned. For symmetric
+            filters (h(omega) = h(-omega)), such as CTFs, this is just the filter itself.
+        :return: An array of filter values of size L-by-L, or L-by-(L//2+1) if `half` is True.
+        """
         grid2d = grid_2d(L)
-        omega = np.pi * np.vstack((grid2d['x'].flatten('F'), grid2d['y'].flatten('F')))
+        x, y = grid2d['x'], grid2d['y']
+        omega = np.pi * np.vstack((x.flatten('F'), y.flatten('F')))
         h = self.evaluate(omega, *args, **kwargs)
 
-        h = m_reshape(h, grid2d['x'].shape)
+        h = m_reshape(h, x.shape)
+
+        if half:
+            # The mirror image -omega of each frequency, wrapping around the grid as in the FFT (so that the Nyquist
+            # frequency -pi of even grids is its own mirror image), is found by flipping the non-centered grid
+            h = np.fft.ifftshift(h)
+            h = (h + np.conj(np.roll(np.flip(h), 1, axis=(0, 1)))) / 2
+            h = np.fft.fftshift(h[:, :L//2 + 1], axes=0)
 
         return h
 
@@ -4,6 +4,8 @@ import cupy as cp
 class Cupy:
     fft2 = staticmethod(cp.fft.fft2)
     ifft2 = staticmethod(cp.fft.ifft2)
+    rfft2 = staticmethod(cp.fft.rfft2)
+    irfft2 = staticmethod(cp.fft.irfft2)
 
     def __getattr__(self, item):
         """
@@ -1,5 +1,6 @@
 import numpy as np
-import pyfftw
+
+from aspire.utils import fft
 
 
 class Numpy:
@@ -8,17 +9,20 @@ class Numpy:
 
     @staticmethod
     def fft2(a, axes=(0, 1)):
-        b = pyfftw.empty_aligned(a.shape, dtype='complex128')
-        cls = pyfftw.FFTW(pyfftw.empty_aligned(a.shape, dtype='complex128'), b, axes=axes, direction='FFTW_FORWARD')
-        cls(a, b)
-        return b
+        # Transforms go through the configured FFT backend, which reuses plans across calls where it can
+        return fft.fftn(a, axes=axes)
 
     @staticmethod
     def ifft2(a, axes=(0, 1)):
-        b = pyfftw.empty_aligned(a.shape, dtype='complex128')
-        cls = pyfftw.FFTW(pyfftw.empty_aligned(a.shape, dtype='complex128'), b, axes=axes, direction='FFTW_BACKWARD')
-        cls(a, b)
-        return b
+        return fft.ifftn(a, axes=axes)
+
+    @staticmethod
+    def rfft2(a, axes=(0, 1)):
+        return fft.rfftn(a, axes=axes)
+
+    @staticmethod
+    def irfft2(a, s=None, axes=(0, 1)):
+        return fft.irfftn(a, s=s, axes=axes)
 
     def __getattr__(self, item):
         """
@@ -53,9 +53,10 @@ def conj_grad(a_fun, b, cg_opt=None, init=None):
                 output to the terminal (default 1).
             iter_callback: If non-empty, specifies a function to be called at
                 the end of every iteration. In this case, iter_callback must be a
-                function handle taking as single argument the info structure at
-                the current iteration. For information on the info structure,
-                see below (default []).
+                function handle taking as arguments the info structure at the
+                current iteration, and the current values of x and p (which may
+                be passed in `init` to resume the iterations from this point).
+                For information on the info structure, see below (default []).
             preconditioner: If non-empty, specifies a preconditioner to be
                 used in every iteration as a function handle defining the linear
                 operator x -> Px (default []).
@@ -91,11 +92,11 @@ def conj_grad(a_fun, b, cg_opt=None, init=None):
     cg_opt = fill_struct(cg_opt, default_opt)
 
     default_init = {'x': None, 'p': None}
-    init = fill_struct(default_init, init)
+    init = fill_struct(init, default_init)
     if init['x'] is None:
-        x = np.zeros(b.shape)
+        x = np.zeros(b.shape, dtype=np.result_type(b, np.float32))
     else:
-        x = init['x']
+        x = np.array(init['x'], dtype=np.result_type(init['x'], b))
 
     b_norm = np.linalg.norm(b)
     r = b.copy()
@@ -111,7 +112,7 @@ def conj_grad(a_fun, b, cg_opt=None, init=None):
         r = r-a_x
         s = cg_opt['preconditioner'](r)
     else:
-        a_x = np.zeros(x.shape)
+        a_x = np.zeros(x.shape, dtype=x.dtype)
 
     obj = (np.real(np.sum(x.conj() * a_x, -1)
             - 2 * np.real(np.sum(np.conj(b * x), -1))))
@@ -119,7 +120,7 @@ def conj_grad(a_fun, b, cg_opt=None, init=None):
     if init['p'] is None:
         p = s.copy()
     else:
-        p = init['p']
+        p = np.array(init['p'], dtype=np.result_type(init['p'], b))
 
     info = fill_struct(att_vals={'iter': [0], 'res': [np.linalg.norm(r)], 'obj': [obj]})
     if cg_opt['store_iterates']:
@@ -133,6 +134,10 @@ def conj_grad(a_fun, b, cg_opt=None, init=None):
         # Matlat code returns b_norm == 0, this break the Python code when b = 0
         return x, obj, info
 
+    if np.all(np.sqrt(np.sum(r ** 2, -1)) < b_norm * cg_opt['rel_tolerance']):
+        # A starting point given in `init` may already solve the system
+        return x, obj, info
+
     for i in range(1, cg_opt['max_iter'] + 1):
         if cg_opt['verbose']:
             logger.info('[CG] Applying matrix & preconditioner')
@@ -166,6 +171,9 @@ def conj_grad(a_fun, b, cg_opt=None, init=None):
             logger.info('[CG] Iteration {}. Residual: {}. Objective: {}'.format(
                 i, np.linalg.norm(info['res'][i]), np.sum(info['obj'][i])))
 
+        if cg_opt['iter_callback']:
+            cg_opt['iter_callback'](info, x, p)
+
         if np.all(res < b_norm * cg_opt['rel_tolerance']):
             break
 
@@ -173,3 +181,140 @@ def conj_grad(a_fun, b, cg_opt=None, init=None):
         logger.warning('[CG] Conjugate gradient reached maximum number of iterations!')
 
     return x, obj, info
+
+
+def block_conj_grad(a_fun, b, cg_opt=None, init=None):
+    """
+    Block Conjugate Gradient method to solve a linear system for several right-hand sides at once.
+
+    Unlike `conj_grad` with several right-hand sides, which runs independent iterations (that happen to share the
+    applications of A), the search directions of all right-hand sides are combined (O'Leary, Linear Algebra Appl. 29,
+    1980), so that each iteration minimizes the error over the span of all of them. This typically needs fewer
+    iterations, each of which applies A to n vectors at once.
+    :param a_fun:  A function handle specifying the linear operation x -> Ax, taking as input an array of shape (n, p),
+        where n is the number of right-hand sides and p is the dimension of the space.
+    :param b:  The right-hand sides of Ax = b, as an array of shape (n, p).
+    :param cg_opt: The parameters of the method, as for `conj_grad` (max_iter, verbose, iter_callback, preconditioner,
+        rel_tolerance). The iterations stop once the residual norm of every right-hand side has decreased below
+        rel_tolerance, relative to the norm of that right-hand side.
+    :param init: A structure specifying the starting point of the algorithm, as for `conj_grad`.
+    :return: The output result includes:
+            x: The result of the block conjugate gradient method, an array of shape (n, p).
+            obj: The value of the objective function of each right-hand side at the last iteration.
+            info: A structure containing intermediate information obtained during each iteration, as for `conj_grad`
+            (iter, res and obj, the latter two of which are arrays of n values).
+    """
+
+    def identity(input_x):
+        return input_x
+    default_opt = {'verbose': 0, 'max_iter': 50, 'iter_callback': [],
+                   'rel_tolerance': 1e-15, 'preconditioner': identity}
+    cg_opt = fill_struct(cg_opt, default_opt)
+
+    init = fill_struct(init, {'x': None, 'p': None})
+    b = np.atleast_2d(b)
+    if init['x'] is None:
+        x = np.zeros(b.shape, dtype=np.result_type(b, np.float32))
+        a_x = np.zeros(b.shape, dtype=x.dtype)
+    else:
+        x = np.array(init['x'], dtype=np.result_type(init['x'], b))
+        a_x = a_fun(x)
+
+    def objective():
+        return np.real(np.sum(x.conj() * a_x, -1) - 2 * np.real(np.sum(np.conj(b * x), -1)))
+
+    b_norms = np.linalg.norm(b, axis=-1)
+    r = b - a_x
+    s = cg_opt['preconditioner'](r.copy())
+    p = s.copy() if init['p'] is None else np.array(init['p'], dtype=np.result_type(init['p'], b))
+
+    res = np.linalg.norm(r, axis=-1)
+    obj = objective()
+    info = {'iter': [0], 'res': [res], 'obj': [obj]}
+    if cg_opt['verbose']:
+        logger.info(f'[Block CG] Initialized. Residuals: {res}')
+
+    if np.all(res <= b_norms * cg_opt['rel_tolerance']):
+        return x, obj, info
+
+    # The rows of p, r and s are the search directions, residuals and preconditioned residuals; their inner products
+    # form small n-by-n systems, which are solved in the least squares sense, so that search directions that become
+    # linearly dependent (e.g. once some right-hand sides have converged) do not break the iterations.
+    old_gamma = s.conj() @ r.T
+    for i in range(1, cg_opt['max_iter'] + 1):
+        a_p = a_fun(p)
+        alpha = np.linalg.lstsq(p.conj() @ a_p.T, old_gamma, rcond=None)[0]
+        x += alpha.T @ p
+        a_x += alpha.T @ a_p
+        r -= alpha.T @ a_p
+
+        res = np.linalg.norm(r, axis=-1)
+        obj = objective()
+        info['iter'].append(i)
+        info['res'].append(res)
+        info['obj'].append(obj)
+
+        if cg_opt['verbose']:
+            logger.info(f'[Block CG] Iteration {i}. Residuals: {res}')
+
+        if cg_opt['iter_callback']:
+            cg_opt['iter_callback'](info, x, p)
+
+        if np.all(res <= b_norms * cg_opt['rel_tolerance']):
+            break
+
+        s = cg_opt['preconditioner'](r.copy())
+        new_gamma = s.conj() @ r.T
+        beta = np.linalg.lstsq(old_gamma, new_gamma, rcond=None)[0]
+        p = s + beta.T @ p
+        old_gamma = new_gamma
+
+    if i == cg_opt['max_iter']:
+        logger.warning('[Block CG] Block conjugate gradient reached maximum number of iterations!')
+
+    return x, obj, info
+
+
+def iterative_refinement(a_fun, solve, b, rel_tolerance, max_iter=10, x0=None):
+    """
+    Solve a linear system by iterative refinement.
+
+    Each step computes the residual r = b - Ax in the precision of b, and corrects x by an approximate solution of the
+    system Ad = r, typically computed in lower precision (e.g. by `conj_grad` in single precision). As long as each of
+    these corrections reduces the error by some factor, the iterations reach the accuracy of the residuals rather than
+    that of the corrections.
+    :param a_fun: A function handle specifying the linear operation x -> Ax, in the precision of b.
+    :param solve: A function handle taking a residual r and returning an approximate solution d of Ad = r.
+    :param b: The right-hand side of Ax = b.
+    :param rel_tolerance: The residual norm, relative to that of b, at which to stop the iterations.
+    :param max_iter: The maximum number of corrections.
+    :param x0: The starting point of the iterations. If None, the iterations start from zero.
+    :return: The output result includes:
+            x: The result of iterative refinement, once the residual norm has decreased below rel_tolerance, relative,
+                or after max_iter corrections.
+            info: A structure containing the iteration number (iter) and the residual norm (res) at each iteration.
+    """
+    x = np.zeros(b.shape, dtype=np.result_type(b, np.float32))
+    b_norm = np.linalg.norm(b)
+    if x0 is None:
+        r = b.copy()
+    else:
+        x += x0
+        r = b - a_fun(x)
+    info = {'iter': [], 'res': []}
+
+    for i in range(max_iter + 1):
+        res = np.linalg.norm(r)
+        info['iter'].append(i)
+        info['res'].append(res)
+        logger.info(f'[Refinement] Iteration {i}. Residual: {res}')
+        if res <= b_norm * rel_tolerance or i == max_iter:
+            break
+
+        x += solve(r)
+        r = b - a_fun(x)
+
+    if info['res'][-1] > b_norm * rel_tolerance:
+        logger.warning('[Refinement] Iterative refinement reached maximum number of iterations!')
+
+    return x, info
@@ -0,0 +1,133 @@
+"""
+A global thread budget, shared by ASPIRE's executors, its FFT/NUFFT transforms and the BLAS.
+
+The cores ASPIRE may use (the 'cores' parameter in the 'threads' section of package configuration) are divided
+among the workers currently running concurrently - processes started with `process_pool`, or threads started within
+a `share_cores` block - so that nested parallelism (e.g. multithreaded transforms in each of several worker processes)
+does not oversubscribe the machine.
+"""
+import os
+import logging
+import threading
+from concurrent import futures
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+
+from aspire import config
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+logger = logging.getLogger(__name__)
+
+# Number of concurrent workers among which the cores available to this process are shared
+_n_workers = 1
+# Guards updates of _n_workers by `share_cores` blocks entered and exited concurrently in different threads
+_n_workers_lock = threading.Lock()
+
+
+def total_cores():
+    """
+    Determine the number of cores ASPIRE may use on this machine
+    :return: The 'cores' configuration value if positive, or else the number of cores available to this process.
+    """
+    if config.threads.cores > 0:
+        return config.threads.cores
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return cpu_count()
+
+
+def _budget(n_threads):
+    """
+    Determine the number of threads a single worker may use
+    :param n_threads: A configured number of threads (0 or negative to use as many as possible)
+    :return: The share of cores available to each concurrent worker, capped at n_threads if positive.
+    """
+    share = max(1, total_cores() // _n_workers)
+    return min(n_threads, share) if n_threads > 0 else share
+
+
+def io_threads():
+    """
+    :return: The number of threads to use for reading data (e.g. .mrcs stacks referenced in STAR files).
+    """
+    return _budget(config.threads.io_threads)
+
+
+def transform_threads():
+    """
+    :return: The number of threads to use in FFTs and NUFFTs.
+    """
+    return _budget(config.threads.transform_threads)
+
+
+def blas_threads():
+    """
+    :return: The number of threads to use in BLAS/LAPACK operations.
+    """
+    return _budget(config.threads.blas_threads)
+
+
+@contextmanager
+def thread_limits():
+    """
+    Limit the native (BLAS and OpenMP) thread pools to the current thread budget.
+    OpenMP is used by the compiled NUFFT libraries, so its limit is the number of transform threads.
+    This has no effect if threadpoolctl is not installed.
+    """
+    if threadpool_limits is None:
+        yield
+    else:
+        with threadpool_limits(limits={'blas': blas_threads(), 'openmp': transform_threads()}):
+            yield
+
+
+@contextmanager
+def share_cores(n_workers):
+    """
+    Divide the current thread budget among a number of concurrent workers for the duration of a block
+    :param n_workers: The number of workers (typically threads of a ThreadPoolExecutor) running concurrently
+    """
+    global _n_workers
+
+    # The count is multiplied on entry and divided on exit (rather than saved and restored), so that blocks which
+    # overlap in different threads, and are not exited in the reverse order they were entered, leave it correct
+    n_workers = max(1, n_workers)
+    with _n_workers_lock:
+        _n_workers *= n_workers
+    try:
+        yield
+    finally:
+        with _n_workers_lock:
+            _n_workers //= n_workers
+
+
+def worker_initializer(n_workers):
+    """
+    Initialize a worker process, so that it only uses its share of the thread budget
+    :param n_workers: The total number of workers among which the cores are shared
+    """
+    global _n_workers
+
+    _n_workers = max(1, n_workers)
+    if threadpool_limits is not None:
+        threadpool_limits(limits={'blas': blas_threads(), 'openmp': transform_threads()})
+
+
+def process_pool(n_processes):
+    """
+    Create a process pool whose workers share the thread budget of this process
+    :param n_processes: The number of worker processes
+    :return: A `concurrent.futures.ProcessPoolExecutor` object
+    """
+    logger.info(f'Launching {n_processes} processes with {max(1, total_cores() // (_n_workers * n_processes))} '
+                f'cores each')
+    return futures.ProcessPoolExecutor(
+        n_processes,
+        initializer=worker_initializer,
+        initargs=(_n_workers * n_processes,)
+    )
@@ -1,10 +1,14 @@
+from functools import lru_cache
+
 import numpy as np
 
+from aspire import config
 from aspire.utils import ensure
 from aspire.utils.coor_trans import grid_2d
 from aspire.utils.fft import centered_ifft2, centered_fft2
 from aspire.utils.matlab_compat import m_reshape, m_flatten
-from aspire.nfft import Plan
+from aspire.nfft import Plan, selected_plan_class
+from aspire.nfft.gridding import GriddingPlan
 
 
 class Volume:
@@ -22,9 +26,69 @@ class Volume:
 
 
 class CartesianVolume(Volume):
+    """
+    A volume sampled on a Cartesian grid
+    """
+    def __init__(self, data=None):
+        """
+        :param data: An L-by-L-by-L array of voxel values.
+        """
+        self.data = data
+        # The plan of the last call to `project`, with the precision and rotations it was made for
+        self._plan = None
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        # Oversampled Fourier transforms of the volume, by precision. These depend on the data only, and are dropped
+        # whenever it is assigned.
+        self._fine = {}
+
     def expand(self, basis):
         return BasisVolume(basis)
 
+    def project(self, rot_matrices, epsilon=1e-3):
+        """
+        Project the volume along rotations, approximately, using the Fourier slice theorem.
+        As with `vol_project`, the Fourier transform of the volume is evaluated on the rotated grids, but instead of
+        a NUFFT for each set of rotations, it is interpolated (with a Kaiser-Bessel kernel, see
+        `aspire.nfft.gridding.GriddingPlan`) from an oversampled Fourier transform of the volume, computed once for
+        each precision. This is considerably faster when projecting along many batches of rotations, and when only
+        approximate projections are needed, as the interpolation kernel narrows as the precision is relaxed.
+        The oversampled transforms are cached until `data` is next assigned; modifying the array of `data` in place
+        does not invalidate them. The interpolation matrix of the last rotations is kept as well, so that projecting
+        new data along the same rotations only grids the new volume.
+        :param rot_matrices: An n-by-3-by-3 array of rotation matrices corresponding to viewing directions.
+        :param epsilon: The desired precision of the projections (default 1e-3). 1e-1 gives a kernel of width 2,
+            i.e. comparable to trilinear interpolation.
+        :return: An L-by-L-by-n array of projections.
+        """
+        L = self.data.shape[0]
+        n = rot_matrices.shape[0]
+
+        if self._plan is not None and self._plan[0] == epsilon and np.array_equal(self._plan[1], rot_matrices):
+            plan = self._plan[2]
+        else:
+            pts_rot = m_reshape(rotated_grids(L, rot_matrices), (3, L**2*n))
+            plan = GriddingPlan(self.data.shape, pts_rot, epsilon=epsilon)
+            self._plan = epsilon, np.array(rot_matrices), plan
+
+        if epsilon not in self._fine:
+            self._fine[epsilon] = plan.grid(self.data)
+
+        im_f = 1./L * plan.interpolate(self._fine[epsilon])
+        im_f = m_reshape(im_f, (L, L, n))
+
+        if L % 2 == 0:
+            im_f[0, :, :] = 0
+            im_f[:, 0, :] = 0
+
+        return np.real(centered_ifft2(im_f))
+
 
 class PolarVolume(Volume):
     def expand(self, basis):
@@ -49,16 +113,38 @@ class FBBasisVolume(BasisVolume):
 
 
 # TODO: The following functions likely all need to be moved inside the Volume class
-def vol_project(vol, rot_matrices):
+def vol_project(vol, rot_matrices, epsilon=None, state_indices=None):
+    """
+    Project a volume, or a stack of volumes, along rotations
+    :param vol: An L-by-L-by-L volume, or an L-by-L-by-L-by-K array of K volumes, to project.
+    :param rot_matrices: An n-by-3-by-3 array of rotation matrices corresponding to viewing directions.
+    :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
+    :param state_indices: For K > 1 volumes, an array of n (0-indexed) volume indices, giving the volume to project
+        along each rotation. The rotations are grouped by volume, and each volume is only transformed at the points of
+        its own projections.
+    :return: An L-by-L-by-n array of projections.
+    """
     L = vol.shape[0]
     n = rot_matrices.shape[0]
-    pts_rot = rotated_grids(L, rot_matrices)
+    n_vols = vol.shape[3] if vol.ndim == 4 else 1
+    if n_vols > 1:
+        ensure(state_indices is not None and len(state_indices) == n,
+               "A volume index must be given for each rotation when projecting multiple volumes")
+    else:
+        vol = vol.reshape(vol.shape[:3] + (1,))
+        state_indices = np.zeros(n, dtype=int)
 
-    # TODO: rotated_grids might as well give us correctly shaped array in the first place
-    pts_rot = m_reshape(pts_rot, (3, L**2*n))
+    pts_rot = rotated_grids(L, rot_matrices)
 
-    im_f = 1./L * Plan(vol.shape, pts_rot).transform(vol)
-    im_f = m_reshape(im_f, (L, L, -1))
+    im_f = np.zeros((L, L, n), dtype='complex128')
+    for k in range(n_vols):
+        idx = np.flatnonzero(state_indices == k)
+        if len(idx) == 0:
+            continue
+        # TODO: rotated_grids might as well give us correctly shaped array in the first place
+        pts_k = m_reshape(pts_rot[..., idx], (3, L**2*len(idx)))
+        im_f[:, :, idx] = m_reshape(1./L * Plan(vol.shape[:3], pts_k, epsilon=epsilon).transform(vol[..., k]),
+                                    (L, L, len(idx)))
 
     if L % 2 == 0:
         im_f[0, :, :] = 0
@@ -69,34 +155,94 @@ def vol_project(vol, rot_matrices):
     return np.real(im)
 
 
-def rotated_grids(L, rot_matrices):
+@lru_cache(maxsize=8)
+def _base_grid(L):
+    """
+    The (unrotated) 2D Fourier grid on which rotated_grids is based
+    :param L: The resolution of the grid.
+    :return: A read-only 2-by-L-by-L array of frequencies in the range [-pi, pi].
+    """
+    grid2d = grid_2d(L)
+    pts = np.pi * np.stack([grid2d['x'], grid2d['y']])
+    pts.setflags(write=False)
+    return pts
+
+
+def rotated_grids(L, rot_matrices, dtype='double'):
     """
     Generate rotated Fourier grids in 3D from rotation matrices
     :param L: The resolution of the desired grids.
     :param rot_matrices: An array of size k-by-3-by-3 containing K rotation matrices
-    :return: A set of rotated Fourier grids in three dimensions as specified by the rotation matrices.
-        Frequencies are in the range [-pi, pi].
+    :param dtype: The data type of the grids (default 'double').
+    :return: A set of rotated Fourier grids in three dimensions as specified by the rotation matrices, as a
+        3-by-L-by-L-by-K array. Frequencies are in the range [-pi, pi].
     """
-    # TODO: Flattening and reshaping at end may not be necessary!
-    grid2d = grid_2d(L)
-    num_pts = L**2
-    num_rots = rot_matrices.shape[0]
-    pts = np.pi * np.vstack([grid2d['x'].flatten('F'), grid2d['y'].flatten('F'), np.zeros(num_pts)])
-    pts_rot = np.zeros((3, num_pts, num_rots))
-    for i in range(num_rots):
-        pts_rot[:, :, i] = rot_matrices[i, :, :] @ pts
-
-    pts_rot = m_reshape(pts_rot, (3, L, L, num_rots))
-    return pts_rot
+    pts = _base_grid(L).astype(dtype, copy=False)
+    # The grid lies in the plane z = 0, so only the first two columns of each rotation matrix are needed
+    rots = np.asarray(rot_matrices)[:, :, :2].astype(dtype, copy=False)
+    return np.einsum('nij,jkl->ikln', rots, pts)
 
 
-def im_backproject(im, rot_matrices):
+def im_backproject(im, rot_matrices, epsilon=None):
     """
     Backproject images along rotation
     :param im: An L-by-L-by-n array of images to backproject.
     :param rot_matrices: An n-by-3-by-3 array of rotation matrices corresponding to viewing directions.
+    :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
     :return: An L-by-L-by-L volumes corresponding to the sum of the backprojected images.
     """
+    L = im.shape[0]
+    pts_rot, im_f = backprojection_data(im, rot_matrices)
+
+    plan = Plan(
+        sz=(L, L, L),
+        fourier_pts=pts_rot,
+        epsilon=epsilon
+    )
+    vol = np.real(plan.adjoint(im_f)) / L
+
+    return vol
+
+
+def im_backproject_each(im, rot_matrices, epsilon=None):
+    """
+    Backproject each of a set of images along its rotation, separately
+    :param im: An L-by-L-by-n array of images to backproject.
+    :param rot_matrices: An n-by-3-by-3 array of rotation matrices corresponding to viewing directions.
+    :param epsilon: The desired precision of the NUFFT. If None, the nfft.epsilon configuration value is used.
+    :return: An L-by-L-by-L-by-n array of volumes, the backprojections of each of the images.
+    """
+    L, _, n = im.shape
+    pts_rot, im_f = backprojection_data(im, rot_matrices)
+    pts_rot, im_f = np.reshape(pts_rot, (3, n, L**2)), np.reshape(im_f, (n, L**2))
+
+    vols = np.zeros((L, L, L, n))
+    if selected_plan_class((L, L, L), L**2) is not GriddingPlan:
+        # Other backends have no way of transforming each image on its own in a single call
+        for i in range(n):
+            vols[..., i] = np.real(Plan((L, L, L), pts_rot[:, i], epsilon=epsilon).adjoint(im_f[i])) / L
+        return vols
+
+    # Chunks of images are spread with a single plan, onto a fine grid per image, and these grids are transformed
+    # together. The number of images per chunk bounds the memory taken by the grids.
+    fine_bytes = np.prod([GriddingPlan.sigma * L] * 3) * np.dtype('complex128').itemsize
+    chunk_size = max(1, config.nfft.gridding_max_bytes // fine_bytes)
+    for i in range(0, n, chunk_size):
+        chunk = slice(i, min(i + chunk_size, n))
+        n_chunk = chunk.stop - chunk.start
+        plan = GriddingPlan((L, L, L), np.reshape(pts_rot[:, chunk], (3, -1)), epsilon=epsilon)
+        vols[..., chunk] = np.real(plan.gather(plan.spread_each(im_f[chunk].ravel(), n_chunk))) / L
+
+    return vols
+
+
+def backprojection_data(im, rot_matrices):
+    """
+    Compute the Fourier transforms of images to be backprojected, and the points in 3D Fourier space they lie on
+    :param im: An L-by-L-by-n array of images to backproject.
+    :param rot_matrices: An n-by-3-by-3 array of rotation matrices corresponding to viewing directions.
+    :return: A tuple (pts_rot, im_f) of a 3-by-L^2*n array of Fourier points and the L^2*n values at these points.
+    """
     L, _, n = im.shape
     ensure(L == im.shape[1], "im must be LxLxK")
     ensure(n == rot_matrices.shape[0], "Number of rotation matrices must match the number of images")
@@ -110,10 +256,49 @@ def im_backproject(im, rot_matrices):
         im_f[:, 0, :] = 0
     im_f = m_flatten(im_f)
 
-    plan = Plan(
-        sz=(L, L, L),
-        fourier_pts=pts_rot
-    )
-    vol = np.real(plan.adjoint(im_f)) / L
+    return pts_rot, im_f
 
-    return vol
+
+class Backprojector:
+    """
+    Accumulates the backprojections of batches of images into a single volume.
+
+    Backprojection is the adjoint of a 3D NUFFT, which spreads the Fourier transforms of the images (central slices of
+    the volume's Fourier transform) onto an oversampled Fourier grid, then inverse Fourier transforms and corrects
+    (deapodizes) that grid. Since all of this is linear, the Backprojector spreads each batch of images onto one
+    persistent grid, using Kaiser-Bessel gridding, and only transforms and deapodizes that grid once, when the volume
+    is requested. The per-batch cost is thus that of spreading alone.
+    """
+    def __init__(self, L, epsilon=None):
+        """
+        :param L: The resolution of the images and of the volume.
+        :param epsilon: The desired precision of the backprojection. If None, the nfft.epsilon configuration value
+            is used.
+        """
+        self.L = L
+        self.epsilon = epsilon
+        self.n = 0
+
+        self._fine = None
+        self._plan = None
+
+    def add(self, im, rot_matrices):
+        """
+        Add the backprojections of a batch of images
+        :param im: An L-by-L-by-n array of images to backproject.
+        :param rot_matrices: An n-by-3-by-3 array of rotation matrices corresponding to viewing directions.
+        """
+        ensure(im.shape[0] == self.L, f"Images must be of size {self.L}x{self.L}")
+        pts_rot, im_f = backprojection_data(im, rot_matrices)
+
+        self._plan = GriddingPlan((self.L,) * 3, pts_rot, epsilon=self.epsilon)
+        self._fine = self._plan.spread(im_f, self._fine)
+        self.n += im.shape[-1]
+
+    def volume(self):
+        """
+        :return: An L-by-L-by-L volume corresponding to the sum of the backprojections of all images added so far.
+        """
+        if self._plan is None:
+            return np.zeros((self.L,) * 3)
+        return np.real(self._plan.gather(self._fine)[..., 0]) / self.L
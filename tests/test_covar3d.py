@@ -1,4 +1,5 @@
 import os
+import tempfile
 import numpy as np
 from scipy.cluster.vq import kmeans2
 
@@ -14,6 +15,9 @@ from aspire.estimation.covar import CovarianceEstimator
 from aspire.utils.matrix import eigs
 from aspire.utils.misc import src_wiener_coords
 from aspire.utils.matlab_compat import Random
+from aspire.utils.matrix import symmat_to_vec_iso
+from aspire.utils.config import config_override
+from aspire import config
 
 import os.path
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'saved_test_data')
@@ -58,18 +62,18 @@ class Covar3DTestCase(TestCase):
             atol=1e-4
         ))
 
-    @patch('scipy.sparse.linalg.cg')
+    @patch('aspire.estimation.covar.conj_grad')
     def testCovar3D1(self, cg):
         cg_return_value = np.load(os.path.join(DATA_DIR, 'cg_return_value.npy'))
-        cg.return_value = cg_return_value, 0  # 0 = convergence success
+        cg.return_value = cg_return_value, 0, {'iter': [1], 'res': [0.]}  # A zero residual = convergence success
 
         covar_est = self.covar_estimator.estimate(self.mean_est, self.noise_variance)
 
         # Since we're only mocking a linear system solver, ensure that we did return the solution
         # for the argument we got called with.
         # 'call_args' is a tuple with the first member being the ordered arguments of the Mock call
-        # In our case (in order) - the LinearOperator and 'b' (the RHS of the linear system)
-        op, b = cg.call_args[0]
+        # In our case (in order) - the linear operator, 'b' (the RHS of the linear system) and the options
+        op, b, _ = cg.call_args[0]
         self.assertTrue(np.allclose(b, op(cg_return_value), atol=1e-5))
 
         self.assertTrue(np.allclose(
@@ -87,11 +91,11 @@ class Covar3DTestCase(TestCase):
             atol=1e-4
         ))
 
-    @patch('scipy.sparse.linalg.cg')
+    @patch('aspire.estimation.covar.conj_grad')
     def testCovar3D2(self, cg):
         # Essentially the same as above, except that our estimator now has a preconditioner
         cg_return_value = np.load(os.path.join(DATA_DIR, 'cg_return_value.npy'))
-        cg.return_value = cg_return_value, 0  # 0 = convergence success
+        cg.return_value = cg_return_value, 0, {'iter': [1], 'res': [0.]}  # A zero residual = convergence success
 
         covar_est = self.covar_estimator_with_preconditioner.estimate(self.mean_est, self.noise_variance)
 
@@ -162,3 +166,40 @@ class Covar3DTestCase(TestCase):
 
         clustering_accuracy = self.sim.eval_clustering(vol_idx)
         self.assertEqual(clustering_accuracy, 1)
+
+    def testConjGrad(self):
+        # The kernel is applied once per iteration (the residuals logged are those of the iterations)
+        b_coeff = np.random.RandomState(0).randn(self.covar_estimator.basis.count, self.covar_estimator.basis.count)
+        b_coeff = b_coeff + b_coeff.T
+        estimator = self.covar_estimator
+        with patch.object(estimator, 'apply_kernel', wraps=estimator.apply_kernel) as apply_kernel, \
+                patch.object(estimator, '_log_solve') as log_solve:
+            x = estimator.conj_grad(b_coeff)
+        iterations = log_solve.call_args[0][0]
+        self.assertLessEqual(apply_kernel.call_count, iterations + 1)
+
+        b = symmat_to_vec_iso(b_coeff)
+        residual = b - estimator.apply_kernel(symmat_to_vec_iso(x), packed=True)
+        self.assertLess(np.linalg.norm(residual), config.covar.cg_tol * np.linalg.norm(b))
+
+    def testConjGradMixedPrecision(self):
+        # Single precision corrections refined with double precision residuals reach the configured tolerance
+        b_coeff = np.random.RandomState(0).randn(self.covar_estimator.basis.count, self.covar_estimator.basis.count)
+        b_coeff = b_coeff + b_coeff.T
+        with config_override({'covar.mixed_precision': 1}):
+            x = self.covar_estimator_with_preconditioner.conj_grad(b_coeff)
+
+        b = symmat_to_vec_iso(b_coeff)
+        residual = b - self.covar_estimator.apply_kernel(symmat_to_vec_iso(x), packed=True)
+        self.assertLess(np.linalg.norm(residual), config.covar.cg_tol * np.linalg.norm(b))
+
+    def testKernelOutOfCoreParallel(self):
+        # Partial kernels of several processes added into a memory-mapped kernel give the in-memory serial kernel
+        sim = Simulation(n=64, filters=[RadialCTFFilter(defocus=d) for d in np.linspace(1.5e4, 2.5e4, 7)])
+        basis = FBBasis3D((8, 8, 8))
+        kernel = CovarianceEstimator(sim, basis, mean_kernel=self.mean_estimator.kernel).compute_kernel()
+        with tempfile.TemporaryDirectory() as tmpdir, config_override({'covar.kernel_directory': tmpdir}):
+            estimator = CovarianceEstimator(sim, basis, mean_kernel=self.mean_estimator.kernel, n_processes=2)
+            kernel_parallel = estimator.compute_kernel()
+            self.assertIsInstance(kernel_parallel.kernel, np.memmap)
+            self.assertTrue(np.allclose(kernel_parallel.kernel, kernel.kernel))
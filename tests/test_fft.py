@@ -1,6 +1,13 @@
+import os
+import tempfile
 from unittest import TestCase
+from unittest.mock import patch
 import numpy as np
+import scipy.fftpack
 from aspire.utils.numeric import xp
+from aspire.utils.config import config_override
+from aspire.utils.fft import centered_fft1, centered_ifft1, centered_fft2, centered_ifft2, centered_fft3, \
+    centered_ifft3, centered_rfft2, centered_irfft2, centered_rfft3, centered_irfft3, fftn_real, PyfftwFFT
 
 
 class ConfigTest(TestCase):
@@ -16,3 +23,75 @@ class ConfigTest(TestCase):
         c = xp.ifft2(b)
 
         self.assertTrue(np.allclose(a, c))
+
+
+class CenteredFFTTestCase(TestCase):
+    def setUp(self):
+        np.random.seed(0)
+
+    def tearDown(self):
+        pass
+
+    def _reference(self, x, axes, inverse):
+        # The centered FFT as a shift of the signal, a transform and a shift of the result
+        transform = scipy.fftpack.ifftn if inverse else scipy.fftpack.fftn
+        return scipy.fftpack.fftshift(transform(scipy.fftpack.ifftshift(x, axes), axes=axes), axes)
+
+    def testCentered(self):
+        for backend in ('numpy', 'scipy', 'pyfftw'):
+            with config_override({'fft.backend': backend, 'fft.pyfftw_planner_effort': 'FFTW_ESTIMATE'}):
+                for sz in ((8, 8, 3), (7, 7, 3), (8, 7, 6)):
+                    x = np.random.randn(*sz) + 1j * np.random.randn(*sz)
+                    self.assertTrue(np.allclose(centered_fft1(x), self._reference(x, (0,), False)))
+                    self.assertTrue(np.allclose(centered_ifft1(x), self._reference(x, (0,), True)))
+                    self.assertTrue(np.allclose(centered_fft2(x), self._reference(x, (0, 1), False)))
+                    self.assertTrue(np.allclose(centered_ifft2(x), self._reference(x, (0, 1), True)))
+                    self.assertTrue(np.allclose(centered_fft3(x), self._reference(x, (0, 1, 2), False)))
+                    self.assertTrue(np.allclose(centered_ifft3(x), self._reference(x, (0, 1, 2), True)))
+
+    def testCenteredReal(self):
+        x = np.random.randn(8, 8).astype('float32')
+        self.assertTrue(np.allclose(centered_fft2(x), self._reference(x, (0, 1), False), atol=1e-5))
+        # The input is left untouched
+        y = x.copy()
+        centered_fft2(x)
+        self.assertTrue(np.array_equal(x, y))
+
+    def testCenteredRealHalf(self):
+        def half(x_f, axis):
+            # Non-negative frequencies 0 .. n//2 of a centered spectrum (the Nyquist frequency wraps around to -n/2)
+            n = x_f.shape[axis]
+            return np.take(x_f, (n // 2 + np.arange(n // 2 + 1)) % n, axis=axis)
+
+        for backend in ('numpy', 'scipy', 'pyfftw'):
+            with config_override({'fft.backend': backend, 'fft.pyfftw_planner_effort': 'FFTW_ESTIMATE'}):
+                for sz in ((8, 8, 3), (7, 7, 3), (8, 7, 6)):
+                    x = np.random.randn(*sz)
+                    x_f = centered_rfft2(x)
+                    self.assertTrue(np.allclose(x_f, half(self._reference(x, (0, 1), False), 1)))
+                    self.assertTrue(np.allclose(centered_irfft2(x_f, sz[:2]), x))
+                    x_f = centered_rfft3(x)
+                    self.assertTrue(np.allclose(x_f, half(self._reference(x, (0, 1, 2), False), 2)))
+                    self.assertTrue(np.allclose(centered_irfft3(x_f, sz), x))
+                    self.assertTrue(np.allclose(fftn_real(x), scipy.fftpack.fftn(x)))
+
+    def testPyfftwWisdom(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir, 'wisdom.pickle')
+            with config_override({'fft.pyfftw_wisdom': filepath, 'fft.pyfftw_planner_effort': 'FFTW_ESTIMATE'}):
+                backend = PyfftwFFT()
+                backend.fftn(np.random.randn(16, 16))
+                backend.save_wisdom()
+                self.assertTrue(os.path.exists(filepath))
+                # Wisdom saved by one backend is loaded by the next
+                PyfftwFFT().load_wisdom()
+
+    def testPyfftwWisdomDisabled(self):
+        # Wisdom is not persisted unless a file is configured, as it is not by default
+        with config_override({'fft.pyfftw_planner_effort': 'FFTW_ESTIMATE'}):
+            backend = PyfftwFFT()
+            self.assertIsNone(backend.wisdom_filepath)
+            backend.fftn(np.random.randn(16, 16))
+            with patch('aspire.utils.fft.open', create=True) as open_mock:
+                backend.save_wisdom()
+            open_mock.assert_not_called()
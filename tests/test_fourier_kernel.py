@@ -1,8 +1,10 @@
 import numpy as np
 from unittest import TestCase
+from scipy.fftpack import fftn, ifftn
 from aspire.estimation.kernel import FourierKernel
 
 import os.path
+import tempfile
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'saved_test_data')
 
 
@@ -31,3 +33,61 @@ class FourierKernelTestCase(TestCase):
                 ])
             )
         )
+
+    def testSaveLoad(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir, 'kernel.npz')
+            self.kernel.save(filepath)
+            kernel = FourierKernel.load(filepath)
+        self.assertTrue(np.array_equal(kernel.kernel, self.kernel.kernel))
+        self.assertEqual(kernel.kernel.dtype, self.kernel.kernel.dtype)
+        self.assertEqual(kernel.is_centered(), self.kernel.is_centered())
+
+    def testConvolveVolume(self):
+        # Real volumes are convolved through real-to-complex FFTs; these should agree with the full complex FFTs
+        vol = np.random.randn(8, 8, 8)
+        vol_conv = np.real(ifftn(fftn(vol, (16, 16, 16)) * self.kernel.kernel))[:8, :8, :8]
+        self.assertTrue(np.allclose(self.kernel.convolve_volume(vol), vol_conv))
+
+    def testConvolveVolumeMatrixHalf(self):
+        # A kernel stored with only the non-negative frequencies along its last dimension should convolve (and be
+        # circularized) as the full kernel does
+        kernel = np.random.randn(8, 8, 8, 8, 8, 8)
+        kernel = kernel + np.roll(np.flip(kernel), 1, axis=tuple(range(6)))
+        kernel_f = np.real(fftn(kernel))
+        kernel_full = FourierKernel(kernel_f, centered=False)
+        kernel_half = FourierKernel(kernel_f[..., :5], centered=False)
+        self.assertTrue(kernel_half.half)
+
+        x = np.random.randn(4, 4, 4, 4, 4, 4)
+        self.assertTrue(np.allclose(kernel_half.convolve_volume_matrix(x), kernel_full.convolve_volume_matrix(x)))
+        self.assertTrue(np.allclose(kernel_half.circularize(), kernel_full.circularize()[..., :3]))
+
+    def testConvolveVolumes(self):
+        # A stack of volumes is convolved as each of its volumes would be on its own, along the real or complex path
+        vols = np.random.randn(8, 8, 8, 3)
+        vols_conv = self.kernel.convolve_volume(vols)
+        self.assertEqual(vols_conv.shape, (8, 8, 8, 3))
+        for j in range(3):
+            vol_conv = np.real(ifftn(fftn(vols[..., j], (16, 16, 16)) * self.kernel.kernel))[:8, :8, :8]
+            self.assertTrue(np.allclose(vols_conv[..., j], vol_conv))
+        self.assertTrue(np.allclose(self.kernel.convolve_volume(vols, real=False), vols_conv))
+
+    def testToeplitz(self):
+        # The Toeplitz matrix (and its implicit form) agree with convolving unit volumes one at a time
+        A = np.zeros((512, 512))
+        for i in range(512):
+            A[:, i] = self.kernel.convolve_volume(np.eye(512)[:, i].reshape((8, 8, 8), order='F')).flatten(order='F')
+        self.assertTrue(np.allclose(self.kernel.toeplitz().reshape((512, 512), order='F'), A))
+
+        operator = self.kernel.toeplitz_operator()
+        x = np.random.randn(512, 2)
+        self.assertTrue(np.allclose(operator @ x, A @ x))
+        self.assertTrue(np.allclose(operator.rmatvec(x[:, 0]), A.T @ x[:, 0]))
+
+    def testToeplitzHalf(self):
+        # The Toeplitz matrix of a half kernel is that of the full kernel it was taken from
+        kernel_half = FourierKernel(self.kernel.kernel_half(), centered=False)
+        self.assertTrue(np.allclose(kernel_half.toeplitz(), self.kernel.toeplitz()))
+        x = np.random.randn(512, 2)
+        self.assertTrue(np.allclose(kernel_half.toeplitz_operator() @ x, self.kernel.toeplitz_operator() @ x))
@@ -4,6 +4,8 @@ from scipy import misc
 
 from aspire.image import Image, _im_translate, _im_translate2
 from aspire.source import ArrayImageSource
+from aspire.utils.filters import CTFFilter, ArrayFilter, FunctionFilter
+from aspire.utils.fft import centered_fft2, centered_ifft2
 
 import os.path
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'saved_test_data')
@@ -38,6 +40,38 @@ class ImageTestCase(TestCase):
         self.assertTrue(np.allclose(im1, im2))
         self.assertTrue(np.allclose(im1[:, :, 0], im3))
 
+    def testImShiftSubpixel(self):
+        # Real images are shifted through real-to-complex FFTs; these should agree with the complex path
+        shifts = np.array([[10.3, -20.7]])
+        for L in (64, 63):
+            im = self.im_np[:L, :L, :]
+            im1 = _im_translate(im, shifts)
+            im2 = _im_translate(im.astype('complex128'), shifts)
+            self.assertTrue(np.allclose(im1, im2))
+
+    def testImFilter(self):
+        # Filtering a real image only evaluates the filter on half the frequency plane
+        filter = CTFFilter(defocus_u=15000, defocus_v=12000, defocus_ang=0.3)
+        for L in (64, 63):
+            im = Image(self.im_np[:L, :L, :])
+            filter_values = filter.evaluate_grid(L)
+            self.assertEqual(filter.evaluate_grid(L, half=True).shape, (L, L // 2 + 1))
+            im_filtered = np.real(centered_ifft2(centered_fft2(im.asnumpy()) * filter_values[:, :, np.newaxis]))
+            self.assertTrue(np.allclose(im.filter(filter).asnumpy(), im_filtered))
+
+    def testImFilterAsymmetric(self):
+        # Filters that are not symmetric (h(omega) != h(-omega)) give the same result on half the frequency plane
+        filters = [
+            ArrayFilter(np.random.RandomState(0).randn(8, 8)),
+            FunctionFilter(lambda x, y: 1 + 0.5 * x + 0.2 * np.sin(y) + 0.1j * x * y)
+        ]
+        for filter in filters:
+            for L in (8, 7):
+                im = Image(self.im_np[:L, :L, :])
+                filter_values = filter.evaluate_grid(L)
+                im_filtered = np.real(centered_ifft2(centered_fft2(im.asnumpy()) * filter_values[:, :, np.newaxis]))
+                self.assertTrue(np.allclose(im.filter(filter).asnumpy(), im_filtered))
+
     def testArrayImageSource(self):
         # An Image can be wrapped in an ArrayImageSource when we need to deal with ImageSource objects.
         src = ArrayImageSource(self.im)
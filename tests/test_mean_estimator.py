@@ -1,12 +1,21 @@
 import numpy as np
 from unittest import TestCase
+from unittest.mock import patch
+from functools import partial
 
 from aspire.source.simulation import Simulation
 from aspire.basis.fb_3d import FBBasis3D
 from aspire.utils.filters import RadialCTFFilter
 from aspire.estimation.mean import MeanEstimator
+from aspire.nfft.gridding import GriddingPlan
+from aspire.volume import Backprojector
+from aspire.estimation.preconditioner import operator_diagonal, JacobiPreconditioner
+from aspire import config
+from aspire.utils.config import config_override
 
+import os
 import os.path
+import tempfile
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'saved_test_data')
 
 
@@ -73,6 +82,52 @@ class MeanEstimatorTestCase(TestCase):
             ]
         ))
 
+    def testAdjointPerBatch(self):
+        # Backprojecting each batch with its own adjoint NUFFT gives the same result as accumulating all batches on a
+        # single Fourier grid, when gridding is the selected backend
+        with config_override({'mean.gridded_backprojection': 1}), \
+                patch('aspire.estimation.selected_plan_class', return_value=GriddingPlan), \
+                patch('aspire.estimation.Backprojector', side_effect=Backprojector) as backprojector:
+            mean_b_coeff = self.estimator.src_backward()
+        self.assertTrue(backprojector.called)
+        self.assertTrue(np.allclose(mean_b_coeff, self.estimator.src_backward(), atol=1e-6))
+
+    def testAdjointPerBatchOtherBackend(self):
+        # The gridding backend is not used for backprojection when another backend is selected
+        with config_override({'mean.gridded_backprojection': 1}), \
+                patch('aspire.estimation.selected_plan_class', return_value=object), \
+                patch('aspire.estimation.Backprojector') as backprojector:
+            self.estimator.src_backward()
+        self.assertFalse(backprojector.called)
+
+    def testEstimateSinglePass(self):
+        # Computing the kernel and the adjoint mapping in a single pass over the images gives the same estimate
+        estimator = MeanEstimator(self.estimator.src, self.estimator.basis, preconditioner='none')
+        with config_override({'mean.single_pass': 1}):
+            estimate = estimator.estimate()
+        self.assertTrue(np.allclose(estimate, self.estimator.estimate(), atol=1e-5))
+
+    def testKernelCache(self):
+        with tempfile.TemporaryDirectory() as tmpdir, config_override({'kernel_cache.directory': tmpdir}):
+            kernel = self.estimator.kernel
+            self.assertEqual(os.listdir(tmpdir), [f'{self.estimator.kernel_digest()}.npz'])
+
+            # Another estimator for the same images finds the kernel in the cache
+            estimator = MeanEstimator(self.estimator.src, self.estimator.basis, preconditioner='none')
+            cached_kernel = estimator.load_cached_kernel()
+            self.assertTrue(np.array_equal(cached_kernel.kernel, kernel.kernel))
+            self.assertTrue(np.array_equal(estimator.kernel.kernel, kernel.kernel))
+
+            # The kernel depends on the NUFFT precision
+            estimator = MeanEstimator(self.estimator.src, self.estimator.basis, epsilon=1e-6)
+            self.assertIsNone(estimator.load_cached_kernel())
+
+    def testParallel(self):
+        # Distributing the passes over the images among processes gives the same results, up to rounding
+        estimator = MeanEstimator(self.estimator.src, self.estimator.basis, preconditioner='none', n_processes=2)
+        self.assertTrue(np.allclose(estimator.kernel.kernel, self.estimator.kernel.kernel, atol=1e-6))
+        self.assertTrue(np.allclose(estimator.src_backward(), self.estimator.src_backward(), atol=1e-6))
+
     def testOptimize1(self):
         mean_b_coeff = np.array(
             [
@@ -197,4 +252,93 @@ class MeanEstimatorTestCase(TestCase):
                 9.00807559e-02,   3.71458771e-02,  -7.86838200e-02,  -1.03837231e-01,
                -1.26116949e-01,   9.82006976e-02],
             atol=1e-4
-        ))
\ No newline at end of file
+        ))
+
+    def testConjGradCheckpoint(self):
+        b_coeff = self.estimator.src_backward()
+        x = self.estimator.conj_grad(b_coeff)
+
+        with tempfile.TemporaryDirectory() as tmpdir, config_override({'mean.checkpoint_iterations': 1}):
+            checkpoint = os.path.join(tmpdir, 'cg.npz')
+
+            # Interrupt the iterations after a few kernel applications; they resume from the last checkpoint
+            apply_kernel = self.estimator.apply_kernel
+            calls = []
+
+            def interrupted_apply_kernel(*args, **kwargs):
+                calls.append(None)
+                if len(calls) > 3:
+                    raise KeyboardInterrupt
+                return apply_kernel(*args, **kwargs)
+
+            with patch.object(self.estimator, 'apply_kernel', interrupted_apply_kernel):
+                with self.assertRaises(KeyboardInterrupt):
+                    self.estimator.conj_grad(b_coeff, checkpoint=checkpoint)
+            self.assertTrue(os.path.exists(checkpoint))
+
+            self.assertTrue(np.allclose(self.estimator.conj_grad(b_coeff, checkpoint=checkpoint), x, atol=1e-4))
+            self.assertFalse(os.path.exists(checkpoint))
+
+        # Starting from (close to) the solution, fewer iterations are needed
+        with patch.object(self.estimator, 'apply_kernel', wraps=self.estimator.apply_kernel) as apply_kernel:
+            self.estimator.conj_grad(b_coeff)
+            cold_calls = apply_kernel.call_count
+            apply_kernel.reset_mock()
+            self.assertTrue(np.allclose(self.estimator.conj_grad(b_coeff, x0=x + 1e-3), x, atol=1e-4))
+            self.assertLess(apply_kernel.call_count, cold_calls)
+
+    def testEstimateMany(self):
+        # Solving for several right-hand sides together agrees with solving for each of them on its own
+        b_coeff = self.estimator.src_backward()
+        b_coeffs = np.stack([b_coeff, np.roll(b_coeff, 1), b_coeff], axis=1)
+        estimates = self.estimator_with_preconditioner.estimate_many(b_coeffs)
+        self.assertEqual(estimates.shape, (8, 8, 8, 3))
+        for j in range(3):
+            estimate = self.estimator_with_preconditioner.estimate(b_coeffs[:, j])
+            self.assertTrue(np.allclose(estimates[..., j], estimate, atol=1e-4))
+
+    def testEstimateMixedPrecision(self):
+        # Single precision corrections refined with double precision residuals reach the same tolerance
+        b_coeff = self.estimator_with_preconditioner.src_backward()
+        x = self.estimator_with_preconditioner.conj_grad(b_coeff)
+        with config_override({'mean.mixed_precision': 1}):
+            x_mixed = self.estimator_with_preconditioner.conj_grad(b_coeff)
+        self.assertEqual(x_mixed.dtype, np.float64)
+        residual = b_coeff - self.estimator_with_preconditioner.apply_kernel(x_mixed)
+        self.assertLess(np.linalg.norm(residual), config.mean.cg_tol * np.linalg.norm(b_coeff))
+        self.assertTrue(np.allclose(x_mixed, x, atol=1e-4))
+
+    def testPreconditioners(self):
+        # All preconditioners converge to the same solution
+        b_coeff = self.estimator_with_preconditioner.src_backward()
+        x = self.estimator_with_preconditioner.conj_grad(b_coeff)
+        for preconditioner in ('jacobi', 'coarse'):
+            estimator = MeanEstimator(self.estimator.src, self.estimator.basis, preconditioner=preconditioner)
+            estimator.kernel = self.estimator_with_preconditioner.kernel
+            self.assertTrue(np.allclose(estimator.conj_grad(b_coeff), x, atol=1e-4))
+
+    def testJacobiDiagonal(self):
+        # The diagonal of the kernel estimated from random probes is close to the exact diagonal
+        kernel = self.estimator.kernel
+        count = self.estimator.basis.count
+        apply = partial(self.estimator.apply_kernel, kernel=kernel)
+        diagonal = operator_diagonal(apply, count, count)
+        self.assertTrue(np.allclose(diagonal, np.diag(apply(np.eye(count)))))
+        estimate = operator_diagonal(apply, count, 256 if count > 256 else count // 2)
+        self.assertLess(np.linalg.norm(estimate - diagonal), 0.5 * np.linalg.norm(diagonal))
+
+    def testJacobiClamp(self):
+        # Small or negative estimates of the diagonal are clamped rather than rejected
+        diagonal = np.array([4., 1e-6, -0.5])
+        preconditioner = JacobiPreconditioner(lambda x: diagonal[:, np.newaxis] * x, 3, 3)
+        self.assertTrue(np.allclose(preconditioner(np.ones(3)), [0.25, 250., 250.]))
+
+    def testApplyKernelStack(self):
+        # Applying the kernel to a stack of coefficient vectors applies it to each of them, even for a single one
+        count = self.estimator.basis.count
+        coeffs = np.random.RandomState(0).randn(count, 3)
+        result = self.estimator.apply_kernel(coeffs)
+        self.assertEqual(result.shape, (count, 3))
+        for j in range(3):
+            self.assertTrue(np.allclose(result[:, j], self.estimator.apply_kernel(coeffs[:, j])))
+        self.assertEqual(self.estimator.apply_kernel(coeffs[:, :1]).shape, (count, 1))
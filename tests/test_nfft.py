@@ -1,8 +1,17 @@
+import json
+import tempfile
 import numpy as np
 from unittest import TestCase, skipUnless
+from unittest.mock import patch
 from unittest.case import SkipTest
 
-from aspire.nfft import Plan, backend_available
+from aspire import config
+import aspire.nfft
+from aspire.nfft import Plan, all_backends, backend_available, cached_plan, clear_plan_cache, plan_cache, \
+    points_key, calibrate, load_profile, problem_class
+from aspire.nfft.utils import nudft, anudft
+from aspire.nfft.gridding import GriddingPlan
+from aspire.utils.config import config_override
 
 import os.path
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'saved_test_data')
@@ -52,3 +61,230 @@ class SimTestCase(TestCase):
             result,
             [-0.05646675 + 1.503746j, 1.677600 + 0.6610926j, 0.9124417 - 0.7394574j, -0.9136836 - 0.5491410j]
         ))
+
+
+    def testTransformMany(self):
+        backends = all_backends()
+        if not backends:
+            raise SkipTest
+
+        np.random.seed(0)
+        ims = np.random.randn(8, 8, 3)
+        fourier_pts = np.random.uniform(-np.pi, np.pi, (2, 20))
+
+        for backend in backends:
+            plan = Plan((8, 8), fourier_pts, backend=backend)
+            many_plan = Plan((8, 8), fourier_pts, ntransf=3, backend=backend)
+
+            result = many_plan.transform(ims)
+            self.assertEqual(result.shape, (20, 3))
+            for i in range(3):
+                self.assertTrue(np.allclose(result[:, i], plan.transform(ims[..., i]), atol=1e-5))
+
+            adjoint = many_plan.adjoint(result)
+            self.assertEqual(adjoint.shape, (8, 8, 3))
+            for i in range(3):
+                self.assertTrue(np.allclose(adjoint[..., i], plan.adjoint(result[:, i]), atol=1e-5))
+
+    def testNudft(self):
+        vol = np.load(os.path.join(DATA_DIR, 'nfft_volume.npy'))
+        fourier_pts = np.array([
+            [ 0.88952655922411,  0.35922344760724, -0.17107966400962, -0.70138277562649],
+            [ 1.87089316522016,  1.99362869011803,  2.11636421501590,  2.23909973991377],
+            [-3.93035749861843, -3.36417300942290, -2.79798852022738, -2.23180403103185]
+        ])
+
+        self.assertTrue(np.allclose(
+            nudft(vol, fourier_pts),
+            [-0.05646675 + 1.503746j, 1.677600 + 0.6610926j, 0.9124417 - 0.7394574j, -0.9136836 - 0.5491410j]
+        ))
+
+        # The adjoint satisfies <c, A x> = <A^H c, x>
+        c = np.random.randn(4) + 1j * np.random.randn(4)
+        self.assertTrue(np.allclose(
+            np.vdot(c, nudft(vol, fourier_pts)),
+            np.vdot(anudft(c, fourier_pts, vol.shape), vol)
+        ))
+
+    def testEpsilon(self):
+        backends = all_backends()
+        if not backends:
+            raise SkipTest
+
+        np.random.seed(0)
+        sig = np.random.randn(16, 16, 16)
+        sig_f = np.random.randn(200) + 1j * np.random.randn(200)
+        fourier_pts = np.random.uniform(-np.pi, np.pi, (3, 200))
+        expected = nudft(sig, fourier_pts)
+        expected_adjoint = anudft(sig_f, fourier_pts, sig.shape)
+
+        for backend in backends:
+            # (pynfft works in single precision, so we do not go beyond 1e-6 here)
+            for epsilon in (1e-4, 1e-6):
+                plan = Plan(sig.shape, fourier_pts, epsilon=epsilon, backend=backend)
+                result = plan.transform(sig)
+                adjoint = plan.adjoint(sig_f)
+                # Allow some slack over the requested precision, which backends only meet approximately
+                self.assertLess(np.linalg.norm(result - expected) / np.linalg.norm(expected), 10 * epsilon)
+                self.assertLess(
+                    np.linalg.norm(adjoint - expected_adjoint) / np.linalg.norm(expected_adjoint), 10 * epsilon
+                )
+
+    def testTransform3(self):
+        vol = np.load(os.path.join(DATA_DIR, 'nfft_volume.npy'))
+        fourier_pts = np.array([
+            [ 0.88952655922411,  0.35922344760724, -0.17107966400962, -0.70138277562649],
+            [ 1.87089316522016,  1.99362869011803,  2.11636421501590,  2.23909973991377],
+            [-3.93035749861843, -3.36417300942290, -2.79798852022738, -2.23180403103185]
+        ])
+
+        plan = Plan(vol.shape, fourier_pts, backend='gridding')
+        result = plan.transform(vol)
+
+        self.assertTrue(np.allclose(
+            result,
+            [-0.05646675 + 1.503746j, 1.677600 + 0.6610926j, 0.9124417 - 0.7394574j, -0.9136836 - 0.5491410j]
+        ))
+
+
+class GriddingTestCase(TestCase):
+    def setUp(self):
+        np.random.seed(0)
+
+    def _check(self, sz, epsilon):
+        fourier_pts = np.random.uniform(-np.pi, np.pi, (len(sz), 100))
+        sig = np.random.randn(*sz)
+        sig_f = np.random.randn(100) + 1j * np.random.randn(100)
+
+        plan = GriddingPlan(sz, fourier_pts, epsilon=epsilon)
+        expected = nudft(sig, fourier_pts)
+        expected_adjoint = anudft(sig_f, fourier_pts, sz)
+        self.assertLess(np.linalg.norm(plan.transform(sig) - expected) / np.linalg.norm(expected), 10 * epsilon)
+        self.assertLess(
+            np.linalg.norm(plan.adjoint(sig_f) - expected_adjoint) / np.linalg.norm(expected_adjoint), 10 * epsilon
+        )
+
+    def testAccuracy1D(self):
+        for epsilon in (1e-3, 1e-8, 1e-14):
+            self._check((17,), epsilon)
+
+    def testAccuracy2D(self):
+        for epsilon in (1e-3, 1e-8, 1e-14):
+            self._check((16, 15), epsilon)
+
+    def testAccuracy3D(self):
+        for epsilon in (1e-3, 1e-8, 1e-14):
+            self._check((8, 9, 8), epsilon)
+
+    def testUncachedMatrix(self):
+        # Interpolation matrices that are too large to keep are formed on the fly, chunk by chunk
+        with config_override({'nfft.gridding_max_nnz': 1000}):
+            plan = GriddingPlan((8, 8, 8), np.random.uniform(-np.pi, np.pi, (3, 50)), epsilon=1e-6)
+            self.assertIsNone(plan._matrices)
+            self.assertGreater(len(plan._chunks), 1)
+
+            vol = np.random.randn(8, 8, 8)
+            expected = nudft(vol, plan.fourier_pts)
+            self.assertLess(np.linalg.norm(plan.transform(vol) - expected) / np.linalg.norm(expected), 1e-5)
+
+class PlanCacheTestCase(TestCase):
+    def setUp(self):
+        clear_plan_cache()
+
+    def tearDown(self):
+        clear_plan_cache()
+
+    def testCachedPlanReused(self):
+        fourier_pts = np.random.uniform(-np.pi, np.pi, (2, 10))
+        try:
+            plan = cached_plan((8, 8), fourier_pts)
+        except RuntimeError:
+            raise SkipTest
+
+        # An equal (but distinct) array of points gets the same Plan back
+        self.assertIs(plan, cached_plan((8, 8), fourier_pts.copy()))
+        # A different size, precision or set of points gets a new Plan
+        self.assertIsNot(plan, cached_plan((10, 10), fourier_pts))
+        self.assertIsNot(plan, cached_plan((8, 8), fourier_pts, epsilon=1e-8))
+        self.assertIsNot(plan, cached_plan((8, 8), fourier_pts + 0.1))
+
+    def testCachedPlanNtransf(self):
+        # Plans for different numbers of signals on the same points share the cached plan
+        fourier_pts = np.random.uniform(-np.pi, np.pi, (2, 10))
+        try:
+            plan = cached_plan((8, 8), fourier_pts, ntransf=4)
+        except RuntimeError:
+            raise SkipTest
+
+        last = cached_plan((8, 8), fourier_pts, ntransf=3)
+        self.assertEqual(len(plan_cache), 1)
+        self.assertEqual((plan.ntransf, last.ntransf), (4, 3))
+
+        signals = np.random.randn(8, 8, 3)
+        reference = Plan(sz=(8, 8), fourier_pts=fourier_pts, ntransf=3)
+        self.assertTrue(np.allclose(last.transform(signals), reference.transform(signals)))
+
+    def testCachedPlanKey(self):
+        # A precomputed key of the points is used instead of hashing them again
+        fourier_pts = np.random.uniform(-np.pi, np.pi, (2, 10))
+        key = points_key(fourier_pts)
+        try:
+            plan = cached_plan((8, 8), fourier_pts, pts_key=key)
+        except RuntimeError:
+            raise SkipTest
+
+        self.assertIs(plan, cached_plan((8, 8), fourier_pts))
+        with patch('aspire.nfft.points_key') as points_key_mock:
+            self.assertIs(plan, cached_plan((8, 8), fourier_pts, pts_key=key))
+        points_key_mock.assert_not_called()
+
+    def testCacheEviction(self):
+        n = config.nfft.plan_cache_size
+        try:
+            first = cached_plan((8, 8), np.zeros((2, 1)))
+        except RuntimeError:
+            raise SkipTest
+
+        for i in range(1, n + 1):
+            cached_plan((8, 8), np.full((2, 1), i / (n + 1)))
+
+        self.assertEqual(len(plan_cache), n)
+        self.assertIsNot(first, cached_plan((8, 8), np.zeros((2, 1))))
+
+
+class CalibrationTestCase(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmpdir.name, 'nfft_profile.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        # Reload whichever profile is configured, so as not to affect other tests
+        aspire.nfft.profile = None
+
+    def testProblemClass(self):
+        self.assertEqual(problem_class((64, 64), 10000), '2,6,4')
+        self.assertEqual(problem_class((30, 30, 30), 40000), '3,5,5')
+
+    def testCalibrate(self):
+        timings = calibrate(shapes=[((8, 8), 100), ((8, 8, 8), 100)], repeats=1, filepath=self.filepath)
+        self.assertEqual(set(timings.keys()), {'2,3,2', '3,3,2'})
+        for t in timings.values():
+            self.assertEqual(set(t.keys()), set(all_backends()))
+
+        with open(self.filepath) as f:
+            saved = json.load(f)
+        self.assertEqual(saved['timings'], timings)
+
+    def testDispatch(self):
+        backend = all_backends()[-1]
+        with open(self.filepath, 'w') as f:
+            json.dump({'timings': {}, 'fastest': {'3,3,2': backend}}, f)
+        load_profile(self.filepath)
+
+        # Plans for 3D problems use the profiled backend, even for sizes not calibrated explicitly
+        plan = Plan((16, 16, 16), np.zeros((3, 1000)))
+        self.assertIsInstance(plan, aspire.nfft.backends[backend])
+        # Plans for problems of other dimensions use the default backend
+        plan = Plan((8, 8), np.zeros((2, 100)))
+        self.assertIsInstance(plan, aspire.nfft.default_plan_class)
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from unittest import TestCase
+
+from aspire.image import Image
+from aspire.source import ArrayImageSource
+from aspire.utils.filters import RadialCTFFilter
+
+
+class ShardTestCase(TestCase):
+    def setUp(self):
+        self.n = 10
+        im = Image(np.random.randn(8, 8, self.n))
+        metadata = pd.DataFrame({
+            '__mrc_filepath': ['a.mrcs'] * 4 + ['b.mrcs'] * 3 + ['c.mrcs'] * 2 + ['a.mrcs'],
+            '_rlnAngleRot': np.linspace(0, 90, self.n),
+            '_rlnAngleTilt': np.linspace(0, 45, self.n),
+            '_rlnAnglePsi': np.linspace(0, 30, self.n)
+        })
+        self.src = ArrayImageSource(im, metadata=metadata)
+        self.src.offsets = np.random.randn(self.n, 2)
+        self.src.filters = [RadialCTFFilter(defocus=d) for d in np.linspace(1.5e4, 2.5e4, self.n)]
+
+    def tearDown(self):
+        pass
+
+    def testContiguousShardsCoverSource(self):
+        shards = [self.src.shard(rank, 3) for rank in range(3)]
+        self.assertEqual([shard.n for shard in shards], [4, 3, 3])
+        self.assertTrue(np.array_equal(np.concatenate([shard.indices for shard in shards]), np.arange(self.n)))
+
+    def testFileShardsAreDisjoint(self):
+        shards = [self.src.shard(rank, 2, strategy='file') for rank in range(2)]
+        self.assertTrue(np.array_equal(np.sort(np.concatenate([shard.indices for shard in shards])), np.arange(self.n)))
+
+        filepaths = [set(self.src.get_metadata('__mrc_filepath', shard.indices)) for shard in shards]
+        self.assertEqual(filepaths[0], {'a.mrcs'})
+        self.assertEqual(filepaths[1], {'b.mrcs', 'c.mrcs'})
+
+    def testShardMetadata(self):
+        shard = self.src.shard(1, 3)
+        self.assertTrue(np.allclose(shard.offsets, self.src.offsets[shard.indices]))
+        self.assertTrue(np.allclose(shard.rots, self.src.rots[shard.indices]))
+        self.assertTrue(np.all(shard.filters == self.src.filters[shard.indices]))
+        self.assertEqual(shard.L, self.src.L)
+
+        # Metadata written through a shard is visible in the parent
+        shard.offsets = np.zeros((shard.n, 2))
+        self.assertTrue(np.allclose(self.src.offsets[shard.indices], 0))
+
+    def testShardImages(self):
+        shard = self.src.shard(2, 3, strategy='file')
+        self.assertTrue(np.allclose(
+            shard.images(0, np.inf).asnumpy(),
+            self.src.images(0, np.inf).asnumpy()[:, :, shard.indices]
+        ))
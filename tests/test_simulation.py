@@ -1,7 +1,10 @@
 import numpy as np
 from unittest import TestCase
+from unittest.mock import patch
 
 from aspire.source.simulation import Simulation
+from aspire.volume import vol_project
+from aspire.nfft import Plan
 from aspire.utils.filters import RadialCTFFilter, IdentityFilter
 
 import os.path
@@ -40,6 +43,29 @@ class SimTestCase(TestCase):
         images = self.sim.clean_images(0, 512).asnumpy()
         self.assertTrue(np.allclose(images, np.load(os.path.join(DATA_DIR, 'sim_clean_images.npy')), rtol=1e-2))
 
+    def testSimulationProjections(self):
+        # Projecting all states in one call should match projecting each state separately
+        indices = np.arange(0, 512)
+        states = self.sim.states[indices]
+        projections = self.sim.projections(indices=indices).asnumpy()
+        for k in np.unique(states):
+            idx_k = np.where(states == k)[0]
+            projections_k = vol_project(self.sim.vols[:, :, :, k-1], self.sim.rots[idx_k, :, :])
+            self.assertTrue(np.allclose(projections[:, :, idx_k], projections_k))
+
+    def testSimulationProjectionsPoints(self):
+        # Each state is only transformed at the points of its own images, L^2 points per image in total
+        num_pts = []
+
+        def plan(sz, fourier_pts, **kwargs):
+            num_pts.append(fourier_pts.shape[1])
+            return Plan(sz, fourier_pts, **kwargs)
+
+        with patch('aspire.volume.Plan', side_effect=plan):
+            self.sim.projections(indices=np.arange(0, 512))
+        self.assertEqual(len(num_pts), len(np.unique(self.sim.states[:512])))
+        self.assertEqual(sum(num_pts), 8**2 * 512)
+
     def testSimulationImagesNoisy(self):
         images = self.sim.images(0, 512).asnumpy()
         self.assertTrue(np.allclose(images, np.load(os.path.join(DATA_DIR, 'sim_images_with_noise.npy')), rtol=1e-2))
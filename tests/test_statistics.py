@@ -0,0 +1,51 @@
+import numpy as np
+from unittest import TestCase
+
+from aspire.source.simulation import Simulation
+from aspire.utils.filters import RadialCTFFilter
+from aspire.estimation.noise import WhiteNoiseEstimator, AnisotropicNoiseEstimator
+from aspire.estimation.statistics import ImageMoments, BackgroundMoments, NoisePSD, compute_statistics, \
+    partial_states, merge_states
+
+
+class StatisticsTestCase(TestCase):
+    def setUp(self):
+        self.sim = Simulation(
+            n=1024,
+            filters=[RadialCTFFilter(defocus=d) for d in np.linspace(1.5e4, 2.5e4, 7)]
+        )
+        self.statistics = [ImageMoments(), BackgroundMoments(self.sim.L), NoisePSD(self.sim.L)]
+
+    def tearDown(self):
+        pass
+
+    def testSinglePass(self):
+        # All statistics computed in a single pass agree with the noise estimators and the moments of all images
+        (mean, variance), (_, noise_variance), noise_psd = compute_statistics(self.sim, self.statistics, batch_size=100)
+
+        images = self.sim.images(0, np.inf).asnumpy()
+        self.assertTrue(np.allclose(mean, np.mean(images, axis=2)))
+        self.assertTrue(np.allclose(variance, np.var(images, axis=2)))
+
+        self.assertAlmostEqual(noise_variance, WhiteNoiseEstimator(self.sim, batchSize=512).estimate())
+        self.assertTrue(np.allclose(noise_psd, AnisotropicNoiseEstimator(self.sim, batchSize=512).estimate_noise_psd()))
+
+    def testMergeShards(self):
+        # Merging the partial states of the shards of a source gives the partial states of the whole source
+        states = partial_states(self.sim, self.statistics)
+        merged = merge_states(self.statistics, [partial_states(self.sim.shard(rank, 3), self.statistics, batch_size=100)
+                                                for rank in range(3)])
+        for state, merged_state in zip(states, merged):
+            self.assertEqual(state[0], merged_state[0])
+            for x, y in zip(state[1:], merged_state[1:]):
+                self.assertTrue(np.allclose(x, y))
+
+    def testMultipleProcesses(self):
+        results = compute_statistics(self.sim, self.statistics[1:], n_processes=2)
+        expected = compute_statistics(self.sim, self.statistics[1:])
+        self.assertTrue(np.allclose(results[0], expected[0]))
+        self.assertTrue(np.allclose(results[1], expected[1]))
+
+    def testKnownNoiseVariance(self):
+        noise_estimator = WhiteNoiseEstimator(self.sim, noise_variance=0.5)
+        self.assertAlmostEqual(noise_estimator.estimate(), 0.5)
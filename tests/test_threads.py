@@ -0,0 +1,65 @@
+import threading
+from unittest import TestCase
+
+from aspire.utils.config import config_override
+from aspire.utils.threads import total_cores, io_threads, transform_threads, blas_threads, share_cores, process_pool
+
+
+def _worker_budget():
+    return transform_threads(), blas_threads()
+
+
+class ThreadsTestCase(TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def testTotalCores(self):
+        self.assertGreaterEqual(total_cores(), 1)
+        with config_override({'threads.cores': 6}):
+            self.assertEqual(total_cores(), 6)
+
+    def testBudget(self):
+        with config_override({'threads.cores': 8, 'threads.blas_threads': 2}):
+            self.assertEqual(io_threads(), 8)
+            self.assertEqual(transform_threads(), 8)
+            # Configured limits cap the share of cores
+            self.assertEqual(blas_threads(), 2)
+
+    def testShareCores(self):
+        with config_override({'threads.cores': 8}):
+            with share_cores(2):
+                self.assertEqual(transform_threads(), 4)
+                with share_cores(4):
+                    self.assertEqual(transform_threads(), 1)
+                # Never less than one thread
+                with share_cores(16):
+                    self.assertEqual(transform_threads(), 1)
+            self.assertEqual(transform_threads(), 8)
+
+    def testShareCoresOverlapping(self):
+        # Blocks overlapping in different threads, exited in the order they were entered, leave the budget correct
+        with config_override({'threads.cores': 8}):
+            entered, exit_first = threading.Event(), threading.Event()
+
+            def first():
+                with share_cores(2):
+                    entered.set()
+                    exit_first.wait()
+
+            thread = threading.Thread(target=first)
+            thread.start()
+            entered.wait()
+            with share_cores(4):
+                self.assertEqual(transform_threads(), 1)
+                exit_first.set()
+                thread.join()
+                self.assertEqual(transform_threads(), 2)
+            self.assertEqual(transform_threads(), 8)
+
+    def testProcessPool(self):
+        with config_override({'threads.cores': 8, 'threads.blas_threads': 3}):
+            with process_pool(2) as executor:
+                self.assertEqual(executor.submit(_worker_budget).result(), (4, 3))
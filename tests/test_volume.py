@@ -0,0 +1,71 @@
+import numpy as np
+from unittest import TestCase
+from unittest.mock import patch
+
+from aspire.source.simulation import Simulation
+from aspire.utils.coor_trans import qrand_rots
+from aspire.volume import CartesianVolume, vol_project, im_backproject, im_backproject_each
+from aspire.utils.config import config_override
+
+
+class CartesianVolumeTestCase(TestCase):
+    def setUp(self):
+        self.vol = Simulation(L=8, n=16, C=1, seed=0).vols[:, :, :, 0].astype('double')
+        self.rots = qrand_rots(32, seed=0)
+
+    def tearDown(self):
+        pass
+
+    def testProject(self):
+        # Approximate projections are within the requested precision of the exact projections, up to a small factor
+        reference = vol_project(self.vol, self.rots, epsilon=1e-12)
+        vol = CartesianVolume(self.vol)
+        for epsilon in (1e-2, 1e-4, 1e-6):
+            projections = vol.project(self.rots, epsilon=epsilon)
+            self.assertEqual(projections.shape, (8, 8, 32))
+            error = np.linalg.norm(projections - reference) / np.linalg.norm(reference)
+            self.assertLess(error, 10 * epsilon)
+
+    def testProjectBatches(self):
+        # The oversampled Fourier transform of the volume is reused across batches of rotations
+        vol = CartesianVolume(self.vol)
+        projections = vol.project(self.rots)
+        self.assertTrue(np.allclose(vol.project(self.rots[:10]), projections[:, :, :10]))
+        self.assertEqual(len(vol._fine), 1)
+
+    def testProjectNewData(self):
+        # Assigning new data drops the cached Fourier transforms, while the plan of the same rotations is reused
+        vol = CartesianVolume(self.vol)
+        vol.project(self.rots)
+        plan = vol._plan[2]
+
+        vol.data = 2 * self.vol
+        self.assertEqual(vol._fine, {})
+        projections = vol.project(self.rots)
+        self.assertIs(vol._plan[2], plan)
+        self.assertTrue(np.allclose(projections, CartesianVolume(2 * self.vol).project(self.rots)))
+
+
+class BackprojectionTestCase(TestCase):
+    def setUp(self):
+        self.im = np.random.RandomState(0).randn(8, 8, 5)
+        self.rots = qrand_rots(5, seed=0)
+
+    def tearDown(self):
+        pass
+
+    def testImBackprojectEach(self):
+        # Backprojecting a batch of images separately agrees with backprojecting each image on its own
+        vols = im_backproject_each(self.im, self.rots, epsilon=1e-12)
+        self.assertEqual(vols.shape, (8, 8, 8, 5))
+        for j in range(5):
+            vol = im_backproject(self.im[:, :, j:j+1], self.rots[j:j+1], epsilon=1e-12)
+            self.assertTrue(np.allclose(vols[..., j], vol))
+
+    def testImBackprojectEachChunks(self):
+        # Images are spread onto their own grids in chunks bounded in memory, or one by one with other backends
+        vols = im_backproject_each(self.im, self.rots, epsilon=1e-12)
+        with config_override({'nfft.gridding_max_bytes': 2 * 16**3 * 16}):
+            self.assertTrue(np.allclose(im_backproject_each(self.im, self.rots, epsilon=1e-12), vols))
+        with patch('aspire.volume.selected_plan_class', return_value=object):
+            self.assertTrue(np.allclose(im_backproject_each(self.im, self.rots, epsilon=1e-12), vols))